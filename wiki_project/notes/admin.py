@@ -1,76 +1,202 @@
+from django import forms
+from django.conf import settings
 from django.contrib import admin
-from .models import Note, Category, Tag, NoteTag, Comment
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import PAGE_VAR
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.forms.models import BaseInlineFormSet
+from .forms import NoteAdminForm
+from .models import Note, Category, Tag, Comment
+from .pagination import EstimatedCountPaginator
+from .revisions import REVISION_FIELDS, record_revision
+from .search import filter_by_terms
+from .tags import parse_tag_names, set_note_tags
+
+
+class AutocompleteFilter(admin.SimpleListFilter):
+    """
+    Фильтр по внешнему ключу с полем автодополнения вместо списка всех значений.
+
+    Варианты подгружаются стандартным autocomplete_view админки, поэтому
+    у админки связанной модели должны быть заданы search_fields.
+    """
+    template = 'admin/notes/autocomplete_filter.html'
+    field_name = None
+
+    def __init__(self, request, params, model, model_admin):
+        self.model_field = model._meta.get_field(self.field_name)
+        self.admin_site = model_admin.admin_site
+        super().__init__(request, params, model, model_admin)
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if not value:
+            return queryset
+        if not value.isdigit():
+            raise IncorrectLookupParameters(f'{self.parameter_name}={value}')
+        return queryset.filter(**{self.model_field.attname: value})
+
+    def choices(self, changelist):
+        field = forms.ModelChoiceField(
+            queryset=self.model_field.remote_field.model._default_manager.all(),
+            widget=AutocompleteSelect(self.model_field, self.admin_site),
+            required=False,
+        )
+        yield {
+            'selected': self.value() is None,
+            'query_string': changelist.get_query_string(remove=[self.parameter_name]),
+            'widget': field.widget.render(self.parameter_name, self.value()),
+            # Остальные параметры списка, кроме номера страницы, сохраняются
+            'params': [
+                (name, value) for name, value in changelist.params.items()
+                if name not in (self.parameter_name, PAGE_VAR)
+            ],
+        }
+
+
+class AuthorFilter(AutocompleteFilter):
+    title = 'автору'
+    parameter_name = field_name = 'author'
+
+
+class CategoryFilter(AutocompleteFilter):
+    title = 'категории'
+    parameter_name = field_name = 'category'
+
+
+class NoteFilter(AutocompleteFilter):
+    title = 'заметке'
+    parameter_name = field_name = 'note'
+
+
+class LargeTableAdminMixin:
+    """
+    Настройки списков для больших таблиц: оценка числа строк вместо
+    COUNT(*), без второго подсчета всех строк и без date_hierarchy.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 20
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        # Подсчет строк должен дойти до запрошенной страницы
+        return self.paginator(
+            queryset, per_page, orphans, allow_empty_first_page, number=request.GET.get(PAGE_VAR),
+        )
+
+    @property
+    def media(self):
+        # Скрипты select2 для фильтров с автодополнением
+        return super().media + AutocompleteSelect(None, self.admin_site).media
 
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('name', 'created_at', 'notes_count')
     search_fields = ('name', 'description')
+    readonly_fields = ('notes_count',)
     list_per_page = 20
-    
-    def notes_count(self, obj):
-        return obj.notes.count()
-    notes_count.short_description = 'Количество заметок'
 
 
-class NoteTagInline(admin.TabularInline):
-    model = NoteTag
-    extra = 1
+class LatestCommentsFormSet(BaseInlineFormSet):
+    """Только последние ADMIN_INLINE_COMMENTS комментариев заметки"""
+
+    def get_queryset(self):
+        if not hasattr(self, '_queryset'):
+            limit = getattr(settings, 'ADMIN_INLINE_COMMENTS', 20)
+            self._queryset = self.queryset.order_by('-created_at', '-id')[:limit]
+        return self._queryset
 
 
 class CommentInline(admin.TabularInline):
     model = Comment
+    formset = LatestCommentsFormSet
     extra = 0
     readonly_fields = ('author', 'created_at')
+    verbose_name_plural = 'Последние комментарии (все — в разделе «Комментарии»)'
+
+    def get_queryset(self, request):
+        # __str__ комментария обращается к автору и заметке
+        return super().get_queryset(request).select_related('author', 'note')
 
 
 @admin.register(Note)
-class NoteAdmin(admin.ModelAdmin):
-    list_display = ('title', 'author', 'category', 'is_public', 'created_at', 'views_count')
-    list_filter = ('is_public', 'category', 'created_at', 'author')
-    search_fields = ('title', 'content', 'author__username')
-    readonly_fields = ('created_at', 'updated_at', 'views_count')
-    list_per_page = 20
-    date_hierarchy = 'created_at'
-    inlines = [NoteTagInline, CommentInline]
+class NoteAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = ('title', 'author', 'category', 'is_public', 'created_at', 'views_count', 'comments_count')
+    list_filter = ('is_public', 'created_at', CategoryFilter, AuthorFilter)
+    list_select_related = ('author', 'category')
+    # Поиск идет по инвертированному индексу (см. get_search_results)
+    search_fields = ('title',)
+    autocomplete_fields = ('author', 'category')
+    readonly_fields = ('created_at', 'updated_at', 'views_count', 'comments_count')
+    form = NoteAdminForm
+    inlines = [CommentInline]
     
     fieldsets = (
         ('Основная информация', {
             'fields': ('title', 'content', 'author')
         }),
         ('Категоризация', {
-            'fields': ('category', 'is_public')
+            'fields': ('category', 'tags', 'is_public')
         }),
         ('Метаданные', {
-            'fields': ('created_at', 'updated_at', 'views_count'),
+            'fields': ('created_at', 'updated_at', 'views_count', 'comments_count'),
             'classes': ('collapse',)
         }),
     )
     
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        results = filter_by_terms(queryset, search_term)
+        if search_term.isdigit():
+            results |= queryset.filter(pk=search_term)
+        return results, False
+    
     def save_model(self, request, obj, form, change):
         if not change:  # Если создается новый объект
             obj.author = request.user
         super().save_model(request, obj, form, change)
+        if not change or REVISION_FIELDS & set(form.changed_data):
+            record_revision(obj, request.user)
+    
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        set_note_tags(form.instance, parse_tag_names(form.cleaned_data.get('tags', '')))
 
 
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
     list_display = ('name', 'notes_count')
     search_fields = ('name',)
-    
-    def notes_count(self, obj):
-        return obj.note_tags.count()
-    notes_count.short_description = 'Количество заметок'
+    readonly_fields = ('notes_count',)
 
 
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('note', 'author', 'text_preview', 'created_at')
-    list_filter = ('created_at', 'author')
-    search_fields = ('text', 'author__username', 'note__title')
+    list_filter = ('created_at', NoteFilter, AuthorFilter)
+    list_select_related = ('note', 'author')
+    # Текст комментариев не индексируется: поиск по заметке и точному имени автора
+    search_fields = ('=author__username',)
+    autocomplete_fields = ('note', 'author')
     readonly_fields = ('created_at',)
-    list_per_page = 20
-    date_hierarchy = 'created_at'
+    
+    def get_queryset(self, request):
+        # Для списка нужен только заголовок заметки
+        return super().get_queryset(request).defer('note__content', 'note__content_html')
+    
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        by_author = queryset.filter(author__username=search_term)
+        return by_author | filter_by_terms(queryset, search_term, field='note_id'), False
     
     def text_preview(self, obj):
         return obj.text[:50] + '...' if len(obj.text) > 50 else obj.text
@@ -0,0 +1,177 @@
+"""
+Сводки просмотров и популярные заметки.
+
+Журнал ``ViewEvent`` пополняется буфером просмотров (см. ``viewcount.py``).
+``rollup_views`` периодически (команда ``rollup_views``) пересчитывает по
+нему почасовые сводки по заметкам, категориям и авторам, из почасовых —
+дневные, а из дневных — список ``TrendingNote`` для главной страницы.
+Пересчет идемпотентен: сводки за затронутые часы и дни заменяются
+целиком, а последние ``VIEW_ROLLUP_LOOKBACK_HOURS`` часов пересчитываются
+повторно, чтобы учесть просмотры, сброшенные из буферов с опозданием.
+
+Журнал и почасовые сводки хранятся ограниченное время и удаляются по
+дням (``VIEW_EVENT_RETENTION_DAYS``, ``HOURLY_VIEW_STAT_RETENTION_DAYS``).
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min, Sum
+from django.db.models.functions import TruncDate, TruncHour
+from django.utils import timezone
+
+from .caching import bump_version
+from .models import DailyViewStat, HourlyViewStat, Note, TrendingNote, ViewEvent, ViewStat
+
+
+def setting(name, default):
+    return getattr(settings, name, default)
+
+
+def hour_start(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def rollup_start(now):
+    """Начало пересчета: последний обработанный час минус запас на опоздавшие события"""
+    last = HourlyViewStat.objects.aggregate(last=Max('bucket'))['last']
+    if last is not None:
+        return last - timedelta(hours=setting('VIEW_ROLLUP_LOOKBACK_HOURS', 2))
+    first = ViewEvent.objects.aggregate(first=Min('viewed_at'))['first']
+    return hour_start(first if first is not None else now)
+
+
+def rollup_views(now=None):
+    """
+    Пересчитывает сводки с последнего обработанного часа до ``now``.
+
+    Возвращает словарь с числом записанных строк по таблицам.
+    """
+    now = now or timezone.now()
+    start = rollup_start(now)
+    with transaction.atomic():
+        hourly = rollup_hours(start)
+        daily = rollup_days(timezone.localdate(start))
+        trending = refresh_trending(timezone.localdate(now))
+        purged = purge_old(now)
+    bump_version('trending')
+    return {'hourly': hourly, 'daily': daily, 'trending': trending, **purged}
+
+
+def rollup_hours(start):
+    """Почасовые сводки за часы начиная со ``start``"""
+    per_note = (
+        ViewEvent.objects
+        .filter(day__gte=timezone.localdate(start), viewed_at__gte=start)
+        .annotate(bucket=TruncHour('viewed_at'))
+        .values('bucket', 'note_id')
+        .annotate(total=Sum('views'))
+        .values_list('bucket', 'note_id', 'total')
+    )
+    totals = defaultdict(int)
+    rows = list(per_note)
+    owners = {
+        pk: (category_id, author_id)
+        for pk, category_id, author_id in Note.objects.filter(
+            pk__in={note_id for _, note_id, _ in rows}
+        ).values_list('pk', 'category_id', 'author_id')
+    }
+    for bucket, note_id, views in rows:
+        totals[(ViewStat.NOTE, note_id, bucket)] += views
+        # У удаленных заметок нет категории и автора
+        category_id, author_id = owners.get(note_id, (None, None))
+        if category_id:
+            totals[(ViewStat.CATEGORY, category_id, bucket)] += views
+        if author_id:
+            totals[(ViewStat.AUTHOR, author_id, bucket)] += views
+
+    HourlyViewStat.objects.filter(bucket__gte=start).delete()
+    HourlyViewStat.objects.bulk_create(
+        [
+            HourlyViewStat(dimension=dimension, object_id=object_id, bucket=bucket, views=views)
+            for (dimension, object_id, bucket), views in totals.items()
+        ],
+        batch_size=1000,
+    )
+    return len(totals)
+
+
+def rollup_days(first_day):
+    """Дневные сводки из почасовых за дни начиная с ``first_day``"""
+    day_start = timezone.make_aware(datetime.combine(first_day, time.min))
+    rows = (
+        HourlyViewStat.objects
+        .filter(bucket__gte=day_start)
+        .annotate(day=TruncDate('bucket'))
+        .values('dimension', 'object_id', 'day')
+        .annotate(total=Sum('views'))
+        .values_list('dimension', 'object_id', 'day', 'total')
+    )
+    stats = [
+        DailyViewStat(dimension=dimension, object_id=object_id, day=day, views=views)
+        for dimension, object_id, day, views in rows
+    ]
+    DailyViewStat.objects.filter(day__gte=first_day).delete()
+    DailyViewStat.objects.bulk_create(stats, batch_size=1000)
+    return len(stats)
+
+
+def top_viewed(dimension, days, limit, today=None, object_ids=None):
+    """
+    Пары (id объекта, просмотры) за последние ``days`` дней по убыванию.
+
+    ``object_ids`` — ограничение на объекты (список или подзапрос).
+    """
+    today = today or timezone.localdate()
+    stats = DailyViewStat.objects.filter(dimension=dimension, day__gt=today - timedelta(days=days))
+    if object_ids is not None:
+        stats = stats.filter(object_id__in=object_ids)
+    return list(
+        stats.values('object_id')
+        .annotate(total=Sum('views'))
+        .order_by('-total', 'object_id')
+        .values_list('object_id', 'total')[:limit]
+    )
+
+
+def refresh_trending(today):
+    """Заменяет список популярных публичных заметок"""
+    top = top_viewed(
+        ViewStat.NOTE,
+        setting('TRENDING_DAYS', 7),
+        setting('TRENDING_SIZE', 5),
+        today=today,
+        object_ids=Note.objects.filter(is_public=True).values('pk'),
+    )
+    TrendingNote.objects.all().delete()
+    TrendingNote.objects.bulk_create([
+        TrendingNote(rank=rank, note_id=note_id, views=views)
+        for rank, (note_id, views) in enumerate(top, 1)
+    ])
+    return len(top)
+
+
+def purge_old(now):
+    """Удаляет журнал и почасовые сводки старше сроков хранения"""
+    today = timezone.localdate(now)
+    events = ViewEvent.objects.filter(
+        day__lt=today - timedelta(days=setting('VIEW_EVENT_RETENTION_DAYS', 30))
+    ).delete()[0]
+    hourly = HourlyViewStat.objects.filter(
+        bucket__lt=now - timedelta(days=setting('HOURLY_VIEW_STAT_RETENTION_DAYS', 90))
+    ).delete()[0]
+    return {'purged_events': events, 'purged_hourly': hourly}
+
+
+def trending_notes():
+    """
+    Популярные заметки для главной: несколько строк в порядке ранга.
+
+    Заметки, скрытые после пересчета, не показываются до следующего.
+    """
+    return (
+        TrendingNote.objects.filter(note__is_public=True)
+        .select_related('note')
+        .only('rank', 'views', 'note__title')
+    )
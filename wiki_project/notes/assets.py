@@ -0,0 +1,293 @@
+"""
+Сборка и отдача статических файлов.
+
+``collectstatic`` (или команда ``build_static``) с хранилищем
+``PrecompressedManifestStaticFilesStorage``:
+
+1. удаляет из сторонних CSS (``STATIC_PURGE_FILES``) правила, селекторы
+   которых ссылаются на классы, не встречающиеся в шаблонах и коде
+   (``STATIC_PURGE_SOURCES``, ``STATIC_PURGE_SAFELIST``);
+2. добавляет к именам файлов хэш содержимого (``ManifestStaticFilesStorage``);
+3. сохраняет рядом сжатые варианты ``.gz`` и, если установлен пакет
+   ``brotli``, ``.br``.
+
+``serve`` отдает собранные файлы из ``STATIC_ROOT``: выбирает сжатый
+вариант по ``Accept-Encoding``, а файлы с хэшем в имени помечает как
+неизменяемые на год.
+"""
+import fnmatch
+import gzip
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.functional import cached_property
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:  # .br-варианты не создаются
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt', '.html', '.xml', '.ttf', '.otf', '.eot', '.ico')
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# --- Удаление неиспользуемых правил CSS -----------------------------------
+
+TOKEN = re.compile(r'[A-Za-z_][\w-]*')
+CLASS_SELECTOR = re.compile(r'\.((?:\\.|[\w-])+)')
+# Части селектора, которые не требуют наличия класса на странице
+OPTIONAL_PARTS = re.compile(r'\[[^\]]*\]|:(?:not|is|where|has)\((?:[^()]|\([^()]*\))*\)')
+AT_RULE_NAME = re.compile(r'@([\w-]+)')
+# Правила внутри этих блоков проверяются по отдельности, остальные блоки сохраняются целиком
+NESTED_AT_RULES = {'media', 'supports', 'layer', 'container', 'document'}
+
+
+def used_tokens(sources, extensions=('.html', '.py', '.js', '.txt')):
+    """Все слова, похожие на имена классов, из файлов каталогов ``sources``"""
+    tokens = set()
+    for source in sources:
+        for directory, _, filenames in os.walk(source):
+            for filename in filenames:
+                if filename.endswith(extensions):
+                    with open(os.path.join(directory, filename), encoding='utf-8', errors='ignore') as file:
+                        tokens.update(TOKEN.findall(file.read()))
+    return tokens
+
+
+def _string_end(css, start):
+    quote, i = css[start], start + 1
+    while i < len(css) and css[i] != quote:
+        i += 2 if css[i] == '\\' else 1
+    return i + 1
+
+
+def _scan(css, start, stops):
+    """Первый символ из ``stops`` вне строк, комментариев и скобок"""
+    depth, i = 0, start
+    while i < len(css):
+        char = css[i]
+        if char in '"\'':
+            i = _string_end(css, i)
+            continue
+        if css.startswith('/*', i):
+            end = css.find('*/', i + 2)
+            i = len(css) if end < 0 else end + 2
+            continue
+        if char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif depth == 0 and char in stops:
+            return i
+        i += 1
+    return len(css)
+
+
+def _block_end(css, start):
+    """Позиция ``}``, закрывающей блок с ``{`` в позиции ``start``"""
+    depth, i = 0, start
+    while i < len(css):
+        i = _scan(css, i, '{}')
+        if i >= len(css):
+            break
+        depth += 1 if css[i] == '{' else -1
+        if depth == 0:
+            return i
+        i += 1
+    return len(css)
+
+
+def _selectors(prelude):
+    selectors, start = [], 0
+    while start <= len(prelude):
+        end = _scan(prelude, start, ',')
+        selectors.append(prelude[start:end].strip())
+        start = end + 1
+    return selectors
+
+
+def _selector_used(selector, used):
+    for name in CLASS_SELECTOR.findall(OPTIONAL_PARTS.sub('', selector)):
+        # Экранированные имена не разбираются — правило сохраняется
+        if '\\' not in name and name not in used:
+            return False
+    return True
+
+
+def purge_css(css, used):
+    """CSS без правил, все селекторы которых ссылаются на неиспользуемые классы"""
+    output, i = [], 0
+    while i < len(css):
+        if css[i].isspace():
+            i += 1
+            continue
+        if css.startswith('/*', i):
+            end = css.find('*/', i + 2)
+            end = len(css) if end < 0 else end + 2
+            # Лицензионные комментарии /*! ... */ сохраняются
+            if css.startswith('/*!', i):
+                output.append(css[i:end] + '\n')
+            i = end
+            continue
+        brace = _scan(css, i, '{;')
+        if brace >= len(css) or css[brace] == ';':
+            output.append(css[i:brace + 1])
+            i = brace + 1
+            continue
+        end = _block_end(css, brace)
+        prelude, body = css[i:brace].strip(), css[brace + 1:end]
+        if prelude.startswith('@'):
+            name = AT_RULE_NAME.match(prelude)
+            if name and name.group(1).lower() in NESTED_AT_RULES:
+                inner = purge_css(body, used)
+                if inner:
+                    output.append(f'{prelude}{{{inner}}}')
+            else:
+                output.append(css[i:end + 1])
+        else:
+            kept = [selector for selector in _selectors(prelude) if _selector_used(selector, used)]
+            if kept:
+                output.append(','.join(kept) + '{' + body + '}')
+        i = end + 1
+    return ''.join(output)
+
+
+# --- Хранилище ------------------------------------------------------------
+
+def compress(data):
+    """Пары (суффикс, сжатые данные), заметно меньшие исходных"""
+    variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data, quality=11)))
+    return [(suffix, compressed) for suffix, compressed in variants if len(compressed) < len(data) * 0.95]
+
+
+class PrecompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Хэши в именах файлов, очистка CSS и сжатые варианты при collectstatic"""
+
+    # Файлы, добавленные после сборки, хэшируются при первом обращении
+    manifest_strict = False
+
+    def stored_name(self, name):
+        # Статика не собрана (тесты, запуск без build_static): ссылки без хэша
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        self.purged = []
+        self.compressed = []
+        if not dry_run:
+            self.purge_unused_css(paths)
+        yield from super().post_process(paths, dry_run, **options)
+        if not dry_run:
+            self.compress_files()
+
+    def purge_unused_css(self, paths):
+        patterns = getattr(settings, 'STATIC_PURGE_FILES', ())
+        names = [name for name in paths if any(fnmatch.fnmatch(name, pattern) for pattern in patterns)]
+        if not names:
+            return
+        used = used_tokens(getattr(settings, 'STATIC_PURGE_SOURCES', ()))
+        used.update(getattr(settings, 'STATIC_PURGE_SAFELIST', ()))
+        for name in names:
+            storage, path = paths[name]
+            with storage.open(path) as file:
+                original = file.read().decode('utf-8')
+            purged = purge_css(original, used)
+            if self.exists(name):
+                self.delete(name)
+            self._save(name, ContentFile(purged.encode('utf-8')))
+            # Хэш и ссылки считаются уже по очищенной копии в STATIC_ROOT
+            paths[name] = (self, name)
+            self.purged.append((name, len(original.encode('utf-8')), len(purged.encode('utf-8'))))
+
+    def compress_files(self):
+        min_size = getattr(settings, 'STATIC_COMPRESS_MIN_SIZE', 256)
+        for name in sorted(set(self.hashed_files.values())):
+            if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+            with self.open(name) as file:
+                data = file.read()
+            if len(data) < min_size:
+                continue
+            for suffix, compressed in compress(data):
+                if self.exists(name + suffix):
+                    self.delete(name + suffix)
+                self._save(name + suffix, ContentFile(compressed))
+                self.compressed.append((name + suffix, len(data), len(compressed)))
+
+
+# --- Отдача ---------------------------------------------------------------
+
+ENCODINGS = (('.br', 'br'), ('.gz', 'gzip'))
+
+
+def accepted_encodings(header):
+    """Кодировки из Accept-Encoding с ненулевым весом"""
+    accepted = set()
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        weight = params.strip()
+        if weight.startswith('q='):
+            try:
+                if float(weight[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+class StaticFiles:
+    """Сведения о собранной статике, загружаемые один раз на процесс"""
+
+    @cached_property
+    def hashed_names(self):
+        return set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+
+static_files = StaticFiles()
+
+
+def serve(request, path):
+    """Файл из STATIC_ROOT с выбором сжатого варианта и заголовками кэширования"""
+    try:
+        full_path = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Файл не найден')
+    if not os.path.isfile(full_path):
+        raise Http404('Файл не найден')
+
+    content_type, _ = mimetypes.guess_type(full_path)
+    accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+    chosen, content_encoding = full_path, None
+    for suffix, coding in ENCODINGS:
+        if coding in accepted and os.path.isfile(full_path + suffix):
+            chosen, content_encoding = full_path + suffix, coding
+            break
+
+    modified = os.stat(chosen).st_mtime
+    if not was_modified_since(request.headers.get('If-Modified-Since'), modified):
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(open(chosen, 'rb'), content_type=content_type or 'application/octet-stream')
+        response['Last-Modified'] = http_date(modified)
+        if content_encoding:
+            response['Content-Encoding'] = content_encoding
+    patch_vary_headers(response, ('Accept-Encoding',))
+    if path in static_files.hashed_names:
+        # Содержимое файла с хэшем в имени не меняется
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=getattr(settings, 'STATIC_MAX_AGE', 0))
+    return response
@@ -0,0 +1,101 @@
+"""
+Асинхронные версии страниц чтения для запуска под ASGI.
+
+Классы наследуют синхронные представления из ``views.py`` и переиспользуют
+их запросы и контекст, заменяя только загрузку данных: страница списка и
+данные боковой панели загружаются одновременно через асинхронный ORM, а
+учет просмотра выполняется в фоновом потоке. Подключаются настройкой
+``NOTES_ASYNC_VIEWS`` (см. ``urls.py``).
+
+В Django 4.2 асинхронный ORM выполняет запросы одного HTTP-запроса в
+одном служебном потоке, поэтому ``asyncio.gather`` совмещает ожидание
+запросов с другой работой цикла событий, но не распараллеливает сами SQL.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import Http404
+
+from . import views
+from .analytics import trending_notes
+from .models import Category
+from .related import related_notes
+from .viewcount import record_view_later
+
+
+async def alist(queryset):
+    return [obj async for obj in queryset]
+
+
+class AsyncViewMixin:
+    """Асинхронный dispatch с загрузкой пользователя вне цикла событий"""
+
+    async def dispatch(self, request, *args, **kwargs):
+        # request.user загружается из сессии и базы лениво и синхронно
+        await sync_to_async(lambda: request.user.is_authenticated)()
+        response = super().dispatch(request, *args, **kwargs)
+        if asyncio.iscoroutine(response):
+            response = await response
+        return response
+
+
+class AsyncListMixin(AsyncViewMixin):
+    """Асинхронный GET для списков с курсорной пагинацией"""
+
+    async def get_extra_context(self):
+        """Данные, загружаемые одновременно со страницей списка"""
+        return {}
+
+    async def get(self, request, *args, **kwargs):
+        self.object_list = await sync_to_async(self.get_queryset)()
+        _, extra = await asyncio.gather(
+            self.apaginate_queryset(self.object_list, self.get_paginate_by(self.object_list)),
+            self.get_extra_context(),
+        )
+        context = await sync_to_async(self.get_context_data)()
+        context.update(extra)
+        return self.render_to_response(context)
+
+
+class HomeView(AsyncListMixin, views.HomeView):
+    async def get_extra_context(self):
+        categories, trending = await asyncio.gather(
+            alist(Category.objects.all()),
+            alist(trending_notes()),
+        )
+        return {'categories': categories, 'trending': trending}
+
+
+class CategoryNotesView(AsyncListMixin, views.CategoryNotesView):
+    pass
+
+
+class MyNotesView(AsyncListMixin, views.MyNotesView):
+    pass
+
+
+class NoteDetailView(AsyncViewMixin, views.NoteDetailView):
+    async def get(self, request, *args, **kwargs):
+        queryset = self.get_queryset().select_related('author', 'category')
+        try:
+            self.object = await queryset.aget(pk=kwargs['pk'])
+        except queryset.model.DoesNotExist:
+            raise Http404('Заметка не найдена')
+        await sync_to_async(self.object.ensure_rendered)()
+        # Счетчик показывается без текущего просмотра: он учитывается в фоне
+        record_view_later(request, self.object.pk)
+
+        paginator = views.comment_paginator(self.object.pk, getattr(settings, 'COMMENTS_FIRST_PAGE_SIZE', 20))
+        comments, tags, related = await asyncio.gather(
+            paginator.apage(),
+            alist(self.object.note_tags.select_related('tag')),
+            alist(related_notes(self.object, request.user)),
+        )
+        context = await sync_to_async(self.get_context_data)(
+            object=self.object, comments=comments, tags=tags, related=related,
+        )
+        return self.render_to_response(context)
+
+    def page_cache_hit(self, request, *args, **kwargs):
+        record_view_later(request, kwargs['pk'])
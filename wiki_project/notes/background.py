@@ -0,0 +1,146 @@
+"""
+Фоновая обработка отложенной работы пачками.
+
+``BatchWorker`` накапливает элементы (без повторов) и передаёт их
+обработчику из отдельного потока — когда набирается пачка нужного размера
+или истекает интервал. Запрос, поставивший работу в очередь, её не ждёт.
+Пачка, на которой обработчик упал, возвращается в очередь и повторяется
+со следующим интервалом; элементы, не обработанные за ``max_attempts``
+попыток, отбрасываются с записью в лог.
+
+``CounterWorker`` работает так же, но суммирует приращения по ключам и
+передаёт обработчику словарь {ключ: сумма}.
+"""
+import atexit
+import logging
+import threading
+from itertools import islice
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWorker:
+    """Очередь с фоновым потоком, обрабатывающим элементы пачками"""
+
+    def __init__(self, handler, batch_size=100, interval=1.0, name='batch-worker', max_attempts=5):
+        self.handler = handler
+        self.batch_size = batch_size
+        self.interval = interval
+        self.name = name
+        self.max_attempts = max_attempts
+        self._pending = {}
+        self._failures = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        atexit.register(self.flush)
+
+    def submit(self, items):
+        """Ставит элементы в очередь на обработку"""
+        with self._lock:
+            for item in items:
+                self._pending[item] = None
+            full = len(self._pending) >= self.batch_size
+        self._ensure_thread()
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        """Синхронно обрабатывает всё, что накопилось в очереди"""
+        while True:
+            batch = self._take_batch()
+            if not batch or not self._process(batch):
+                return
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _take_batch(self):
+        with self._lock:
+            batch = list(self._pending)[:self.batch_size]
+            for item in batch:
+                del self._pending[item]
+        return batch
+
+    def _process(self, batch):
+        try:
+            self.handler(batch)
+        except Exception:
+            logger.exception('%s: ошибка при обработке пачки из %d элементов', self.name, len(batch))
+            self._retry(batch)
+            return False
+        if self._failures:
+            with self._lock:
+                for item in batch:
+                    self._failures.pop(item, None)
+        return True
+
+    def _retry(self, batch):
+        """Возвращает пачку в очередь, кроме элементов, исчерпавших попытки"""
+        dropped = []
+        with self._lock:
+            for item in batch:
+                failures = self._failures.get(item, 0) + 1
+                if failures >= self.max_attempts:
+                    self._failures.pop(item, None)
+                    dropped.append(item)
+                else:
+                    self._failures[item] = failures
+                    self._requeue(batch, item)
+        if dropped:
+            logger.error(
+                '%s: отброшено %d элементов после %d попыток: %r',
+                self.name, len(dropped), self.max_attempts, dropped[:20],
+            )
+
+    def _requeue(self, batch, item):
+        self._pending[item] = None
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+
+class CounterWorker(BatchWorker):
+    """Фоновый агрегатор приращений счетчиков"""
+
+    def add(self, key, amount=1):
+        """Добавляет приращение к счетчику ``key``"""
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + amount
+            full = len(self._pending) >= self.batch_size
+        self._ensure_thread()
+        if full:
+            self._wakeup.set()
+
+    def submit(self, items):
+        for key in items:
+            self.add(key)
+
+    def _take_batch(self):
+        with self._lock:
+            batch = dict(islice(self._pending.items(), self.batch_size))
+            for key in batch:
+                del self._pending[key]
+        return batch
+
+    def _requeue(self, batch, key):
+        # Приращение складывается с накопленным с тех пор
+        self._pending[key] = self._pending.get(key, 0) + batch[key]
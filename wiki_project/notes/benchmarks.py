@@ -0,0 +1,164 @@
+"""
+Общие средства для замеров производительности.
+
+Замеры выполняются на отдельной тестовой базе, заполненной
+детерминированным набором данных (``populate_db --seed``). Результаты
+сохраняются в JSON и сравниваются с базовым прогоном: регрессией
+считается рост p95 сверх допустимого коэффициента или рост числа
+запросов.
+"""
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from contextlib import ExitStack, contextmanager
+
+import django
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+
+from .search import index_queue
+from .viewcount import view_buffer
+
+
+def percentile(values, fraction):
+    """Перцентиль с линейной интерполяцией"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(timings, queries=None):
+    """Сводка по замерам в миллисекундах"""
+    summary = {
+        'runs': len(timings),
+        'p50_ms': round(percentile(timings, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3) if timings else 0.0,
+    }
+    if queries is not None:
+        summary['queries'] = max(queries) if queries else 0
+    return summary
+
+
+def measure(action, repeat, warmup=0, count_queries=True):
+    """Многократный вызов ``action`` с замером времени и числа SQL-запросов"""
+    for _ in range(warmup):
+        action()
+    timings, queries = [], []
+    for _ in range(repeat):
+        with ExitStack() as stack:
+            # Запросы считаются по всем соединениям, включая реплики
+            contexts = [stack.enter_context(CaptureQueriesContext(db)) for db in connections.all()]
+            started = time.perf_counter()
+            action()
+            timings.append(time.perf_counter() - started)
+        queries.append(sum(len(context) for context in contexts))
+    return summarize(timings, queries if count_queries else None)
+
+
+@contextmanager
+def benchmark_database(keepdb=False, on_disk=False):
+    """
+    Временная тестовая база на время замеров.
+
+    ``on_disk`` — для SQLite создать базу в файле, а не в памяти: нужно для
+    замеров с несколькими потоками, где важны журнал и блокировки.
+    """
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    if on_disk and connection.vendor == 'sqlite' and not connection.settings_dict['TEST'].get('NAME'):
+        connection.settings_dict['TEST'] = {
+            **connection.settings_dict.get('TEST', {}),
+            'NAME': os.path.join(tempfile.gettempdir(), f'wiki_bench_{os.getpid()}.sqlite3'),
+        }
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False, keepdb=keepdb)
+    mirrors = {}
+    for alias in connections:
+        if connections[alias].settings_dict['TEST'].get('MIRROR') == DEFAULT_DB_ALIAS:
+            mirrors[alias] = connections[alias].settings_dict['NAME']
+            connections[alias].creation.set_as_test_mirror(connection.settings_dict)
+    try:
+        yield
+    finally:
+        # Отложенные записи должны попасть во временную базу, а не в основную
+        view_buffer.flush()
+        index_queue.flush()
+        for alias, name in mirrors.items():
+            connections[alias].close()
+            connections[alias].settings_dict['NAME'] = name
+        test_name = connection.settings_dict['NAME']
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+        if on_disk and not keepdb:
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(f'{test_name}{suffix}'):
+                    os.remove(f'{test_name}{suffix}')
+        teardown_test_environment()
+
+
+def seed_dataset(notes, seed, stdout=None):
+    """Заполнение базы детерминированным набором данных"""
+    # Индекс строится самой командой, фоновые очереди не нужны
+    with override_settings(SEARCH_INDEX_ASYNC=False, RELATED_NOTES_ASYNC=False):
+        call_command(
+            'populate_db',
+            notes=notes,
+            users=max(10, notes // 100),
+            tags=200,
+            categories=10,
+            seed=seed,
+            index=True,
+            stdout=stdout or io.StringIO(),
+        )
+
+
+def environment_info():
+    """Окружение прогона для сравнения результатов между коммитами"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def write_results(path, results):
+    with open(path, 'w', encoding='utf-8') as output:
+        json.dump(results, output, ensure_ascii=False, indent=2)
+
+
+def compare_results(current, baseline, max_ratio=1.25, max_extra_queries=0):
+    """
+    Список регрессий относительно базового прогона.
+
+    Сравниваются сценарии, присутствующие в обоих прогонах.
+    """
+    regressions = []
+    for name, result in current['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous:
+            continue
+        if previous['p95_ms'] and result['p95_ms'] > previous['p95_ms'] * max_ratio:
+            regressions.append(
+                f'{name}: p95 {result["p95_ms"]:.1f} мс > {previous["p95_ms"]:.1f} мс × {max_ratio}'
+            )
+        if 'queries' in previous and result.get('queries', 0) > previous['queries'] + max_extra_queries:
+            regressions.append(f'{name}: запросов {result["queries"]} > {previous["queries"]}')
+    return regressions
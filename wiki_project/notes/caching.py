@@ -0,0 +1,234 @@
+"""
+Кэширование страниц и фрагментов шаблонов приложения notes.
+
+Инвалидация построена на номерах версий в кэше: изменения заметок, тегов,
+комментариев и категорий увеличивают версию (см. ``signals.py``), а версия
+входит в ключ, так что устаревшие записи просто перестают читаться и
+вытесняются по таймауту.
+
+* ``notes`` — всё, что показывается в списках и на странице заметки;
+* ``categories`` — боковая панель с категориями и счетчиками;
+* ``trending`` — блок популярных заметок (обновляется ``rollup_views``);
+* ``related`` — похожие заметки на странице заметки (см. ``related.py``).
+
+Анонимным пользователям отдаются целиком закэшированные страницы,
+авторизованным — закэшированные фрагменты (боковая панель, карточки).
+
+``ConditionalGetMixin`` добавляет к страницам ETag и Last-Modified, чтобы
+браузер и обратный прокси получали 304 вместо повторной загрузки.
+"""
+import hashlib
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+VERSION_NAMES = ('notes', 'categories', 'trending', 'related')
+
+
+def _version_key(name):
+    return f'notes:version:{name}'
+
+
+def get_versions(*names):
+    """Текущие версии {имя: номер}"""
+    names = names or VERSION_NAMES
+    stored = cache.get_many([_version_key(name) for name in names])
+    return {name: stored.get(_version_key(name), 1) for name in names}
+
+
+def bump_version(*names):
+    """Увеличивает версии, делая недействительными зависящие от них ключи"""
+    for name in names:
+        key = _version_key(name)
+        if cache.add(key, 2, timeout=None):
+            continue
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Ключ вытеснен между add и incr
+            cache.set(key, 2, timeout=None)
+
+
+def cache_epoch():
+    """
+    Метка поколения версий: меняется, если кэш очищен и версии начались
+    заново, чтобы старые ETag не совпали с новыми страницами.
+    """
+    return cache.get_or_set('notes:version:epoch', lambda: uuid.uuid4().hex[:12], timeout=None)
+
+
+def visibility_scope(user):
+    """Область видимости: аноним или id автора"""
+    return f'user:{user.pk}' if user.is_authenticated else 'anon'
+
+
+def page_cache_key(request, version_names):
+    """Ключ страницы: путь, параметры запроса, область видимости и версии"""
+    versions = get_versions(*version_names)
+    raw = '|'.join([
+        request.path,
+        request.GET.urlencode(),
+        visibility_scope(request.user),
+        *(f'{name}={versions[name]}' for name in version_names),
+    ])
+    return 'notes:page:' + hashlib.md5(raw.encode()).hexdigest()
+
+
+def has_pending_messages(request):
+    """Есть ли у запроса неотображенные сообщения (такие страницы не кэшируются)"""
+    if 'messages' in request.COOKIES:
+        return True
+    # Хранилище только в cookie не пишет сообщения в сессию
+    if getattr(settings, 'MESSAGE_STORAGE', '').endswith('.CookieStorage'):
+        return False
+    session = getattr(request, 'session', None)
+    return bool(session is not None and session.session_key and session.get('_messages'))
+
+
+class AnonymousPageCacheMixin:
+    """
+    Кэширует отрендеренную страницу для анонимных пользователей.
+
+    ``page_cache_versions`` — версии, от которых зависит содержимое.
+    ``page_cache_hit`` вызывается при отдаче страницы из кэша.
+    """
+    page_cache_versions = ('notes', 'categories')
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.view_is_async:
+            return self._async_dispatch(request, *args, **kwargs)
+        key, response = self.cached_page(request, *args, **kwargs)
+        if response is not None:
+            return response
+        response = super().dispatch(request, *args, **kwargs)
+        self.store_page(key, response)
+        return response
+
+    async def _async_dispatch(self, request, *args, **kwargs):
+        # Обращения к кэшу и сессии синхронные — выполняются вне цикла событий
+        key, response = await sync_to_async(self.cached_page)(request, *args, **kwargs)
+        if response is not None:
+            return response
+        response = await super().dispatch(request, *args, **kwargs)
+        self.store_page(key, response)
+        return response
+
+    def cached_page(self, request, *args, **kwargs):
+        """Пара (ключ, ответ из кэша); ключ None — страница не кэшируется"""
+        if (
+            not getattr(settings, 'PAGE_CACHE_TIMEOUT', 60)
+            or request.method != 'GET'
+            or request.user.is_authenticated
+            or has_pending_messages(request)
+        ):
+            return None, None
+        key = page_cache_key(request, self.page_cache_versions)
+        response = cache.get(key)
+        if response is not None:
+            self.page_cache_hit(request, *args, **kwargs)
+        return key, response
+
+    def store_page(self, key, response):
+        if key and response.status_code == 200 and hasattr(response, 'add_post_render_callback'):
+            timeout = getattr(settings, 'PAGE_CACHE_TIMEOUT', 60)
+            response.add_post_render_callback(lambda rendered: cache.set(key, rendered, timeout))
+
+    def page_cache_hit(self, request, *args, **kwargs):
+        pass
+
+
+class FragmentCacheMixin:
+    """Передает в шаблон данные для ключей ``{% cache %}``"""
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['cache_versions'] = get_versions()
+        context['cache_scope'] = visibility_scope(self.request.user)
+        context['fragment_cache_timeout'] = getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 300)
+        return context
+
+
+class ConditionalGetMixin:
+    """
+    Условные GET-запросы (If-None-Match / If-Modified-Since).
+
+    ``get_validators`` дешево, не загружая содержимого, возвращает части
+    ETag и время последнего изменения (или None — проверка не нужна).
+    По умолчанию ETag строится из версий ``conditional_versions``, области
+    видимости и адреса страницы. При совпадении отдается 304 и вызывается
+    ``conditional_hit``.
+    """
+    conditional_versions = ('notes', 'categories')
+
+    def get_validators(self, request, *args, **kwargs):
+        """Пара (части ETag, время изменения или None); None — без проверки"""
+        versions = get_versions(*self.conditional_versions)
+        return [f'{name}={versions[name]}' for name in self.conditional_versions], None
+
+    def conditional_hit(self, request, *args, **kwargs):
+        pass
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.view_is_async:
+            return self._async_conditional_dispatch(request, *args, **kwargs)
+        validators, response = self.conditional_response(request, *args, **kwargs)
+        if response is not None:
+            return response
+        return self.add_validator_headers(request, super().dispatch(request, *args, **kwargs), validators)
+
+    async def _async_conditional_dispatch(self, request, *args, **kwargs):
+        validators, response = await sync_to_async(self.conditional_response)(request, *args, **kwargs)
+        if response is not None:
+            return response
+        response = await super().dispatch(request, *args, **kwargs)
+        return self.add_validator_headers(request, response, validators)
+
+    def conditional_response(self, request, *args, **kwargs):
+        """Пара (ETag, время изменения) и ответ 304/412, если тело не нужно"""
+        # Неотображенные сообщения должны попасть в новую страницу
+        if request.method not in ('GET', 'HEAD') or has_pending_messages(request):
+            return None, None
+        validators = self.get_validators(request, *args, **kwargs)
+        if validators is None:
+            return None, None
+        parts, last_modified = validators
+        raw = '|'.join([
+            getattr(settings, 'CONDITIONAL_ETAG_SALT', ''),
+            cache_epoch(),
+            request.get_full_path(),
+            visibility_scope(request.user),
+            *map(str, parts),
+        ])
+        validators = quote_etag(hashlib.md5(raw.encode()).hexdigest()), last_modified
+        response = get_conditional_response(
+            request,
+            etag=validators[0],
+            last_modified=last_modified and int(last_modified.timestamp()),
+        )
+        if response is not None:
+            if response.status_code == 304:
+                self.conditional_hit(request, *args, **kwargs)
+            response = self.add_validator_headers(request, response, validators)
+        return validators, response
+
+    def add_validator_headers(self, request, response, validators):
+        if validators is None or response.status_code not in (200, 304):
+            return response
+        etag, last_modified = validators
+        # Ответ из кэша страниц мог сохраниться с заголовками прошлого запроса
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+        # Прокси может хранить только анонимные страницы и обязан их перепроверять
+        patch_cache_control(
+            response,
+            max_age=getattr(settings, 'CONDITIONAL_MAX_AGE', 0),
+            must_revalidate=True,
+            **({'private': True} if request.user.is_authenticated else {'public': True}),
+        )
+        patch_vary_headers(response, ('Cookie',))
+        return response
@@ -0,0 +1,74 @@
+"""
+Денормализованные счетчики: ``Note.comments_count``, ``Category.notes_count``
+и ``Tag.notes_count``.
+
+Счетчики поддерживаются обработчиками сигналов (см. ``signals.py``)
+атомарными ``UPDATE ... SET n = n ± 1`` в той же транзакции, что и
+изменение. ``repair_counters`` пересчитывает их массово одним UPDATE на
+таблицу.
+"""
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def adjust_counter(model, pk, field, amount):
+    """Атомарно изменяет счетчик записи; значение не уходит ниже нуля"""
+    if pk is None or not amount:
+        return
+    queryset = model.objects.filter(pk=pk)
+    if amount < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -amount})
+    queryset.update(**{field: F(field) + amount})
+
+
+def counter_definitions(Note, Category, Tag, Comment, NoteTag):
+    """Описание счетчиков: (модель, поле, модель связей, внешний ключ)"""
+    return [
+        (Note, 'comments_count', Comment, 'note'),
+        (Category, 'notes_count', Note, 'category'),
+        (Tag, 'notes_count', NoteTag, 'tag'),
+    ]
+
+
+def actual_count(related_model, fk_name):
+    """Подзапрос с фактическим числом связанных записей"""
+    return Coalesce(
+        Subquery(
+            related_model.objects.filter(**{fk_name: OuterRef('pk')})
+            .order_by()
+            .values(fk_name)
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        Value(0),
+    )
+
+
+def repair_counters(models=None, dry_run=False):
+    """
+    Пересчитывает счетчики массовыми UPDATE.
+
+    ``models`` — кортеж (Note, Category, Tag, Comment, NoteTag); по умолчанию
+    текущие модели приложения (в миграциях передаются исторические).
+    Возвращает {'Модель.поле': число расходившихся записей}.
+    """
+    if models is None:
+        from .models import Category, Comment, Note, NoteTag, Tag
+        models = (Note, Category, Tag, Comment, NoteTag)
+
+    report = {}
+    with transaction.atomic():
+        for model, field, related_model, fk_name in counter_definitions(*models):
+            drifted = (
+                model.objects.annotate(actual=actual_count(related_model, fk_name))
+                .exclude(**{field: F('actual')})
+                .values('pk')
+            )
+            if dry_run:
+                report[f'{model.__name__}.{field}'] = drifted.count()
+            else:
+                report[f'{model.__name__}.{field}'] = model.objects.filter(pk__in=drifted).update(
+                    **{field: actual_count(related_model, fk_name)}
+                )
+    return report
@@ -2,6 +2,7 @@ from django import forms
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
 from .models import Note, Comment, Category
+from .tags import format_tag_names
 
 
 class NoteForm(forms.ModelForm):
@@ -26,7 +27,7 @@ class NoteForm(forms.ModelForm):
             'content': forms.Textarea(attrs={
                 'class': 'form-control',
                 'rows': 10,
-                'placeholder': 'Введите текст заметки'
+                'placeholder': 'Введите текст заметки (Markdown, ссылки на заметки: [[Заголовок]])'
             }),
             'category': forms.Select(attrs={
                 'class': 'form-control'
@@ -40,8 +41,26 @@ class NoteForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
         # Если редактируем существующую заметку, загружаем её теги
         if self.instance.pk:
-            tags = self.instance.note_tags.select_related('tag').all()
-            self.fields['tags'].initial = ', '.join([nt.tag.name for nt in tags])
+            self.fields['tags'].initial = format_tag_names(self.instance)
+
+
+class NoteAdminForm(forms.ModelForm):
+    """Форма заметки в админ-панели с тегами через запятую"""
+    tags = forms.CharField(
+        label='Теги',
+        required=False,
+        widget=forms.TextInput(attrs={'class': 'vTextField'}),
+        help_text='Введите теги через запятую'
+    )
+    
+    class Meta:
+        model = Note
+        fields = '__all__'
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.fields['tags'].initial = format_tag_names(self.instance)
 
 
 class CommentForm(forms.ModelForm):
@@ -0,0 +1,222 @@
+"""
+Инструментирование SQL-запросов и рендеринга шаблонов.
+
+``QueryInstrumentationMiddleware`` на время запроса подключает обертку
+``connection.execute_wrapper`` ко всем соединениям и считает число
+запросов, суммарное время SQL, повторяющиеся запросы (одинаковые с
+точностью до параметров — типичный признак N+1) и время рендеринга
+шаблона. Результаты помечаются именем маршрута (``home``,
+``note_detail``, ``admin:notes_note_changelist``...), копятся в кэше и
+доступны через команду ``query_report`` и служебную страницу для
+персонала.
+
+Запрос, превысивший бюджет ``QUERY_BUDGET`` (или значение для маршрута
+из ``QUERY_BUDGETS``), пишет предупреждение в журнал
+``notes.instrumentation``.
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+REPORT_INDEX_KEY = 'notes:instrumentation:index'
+TOP_DUPLICATES = 10
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_lock = threading.Lock()
+
+
+def query_signature(sql):
+    """SQL без значений: запросы, отличающиеся только параметрами, совпадают"""
+    return _LITERALS.sub('?', _IN_LIST.sub('IN (...)', sql))
+
+
+def query_budget(view_name):
+    """Допустимое число запросов для маршрута"""
+    budgets = getattr(settings, 'QUERY_BUDGETS', {})
+    return budgets.get(view_name, getattr(settings, 'QUERY_BUDGET', 50))
+
+
+class QueryCollector:
+    """Обертка для ``execute_wrapper``: считает запросы и их время"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.signatures = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.signatures[query_signature(sql)] += 1
+
+    def duplicates(self):
+        """{сигнатура: число выполнений} для запросов, выполненных больше одного раза"""
+        return {signature: n for signature, n in self.signatures.most_common() if n > 1}
+
+
+def _report_key(view_name):
+    return f'notes:instrumentation:view:{view_name}'
+
+
+def record_request(view_name, collector, render_time, total_time):
+    """Добавляет замер запроса в накопленную статистику маршрута"""
+    duplicates = collector.duplicates()
+    timeout = getattr(settings, 'QUERY_REPORT_TIMEOUT', 24 * 60 * 60)
+    # Чтение-изменение-запись: между процессами возможны потери отдельных
+    # замеров, для статистики это допустимо
+    with _lock:
+        stats = cache.get(_report_key(view_name)) or {
+            'requests': 0,
+            'queries': 0,
+            'max_queries': 0,
+            'sql_ms': 0.0,
+            'render_ms': 0.0,
+            'total_ms': 0.0,
+            'duplicated_queries': 0,
+            'over_budget': 0,
+            'top_duplicates': {},
+        }
+        stats['requests'] += 1
+        stats['queries'] += collector.count
+        stats['max_queries'] = max(stats['max_queries'], collector.count)
+        stats['sql_ms'] += collector.duration * 1000
+        stats['render_ms'] += render_time * 1000
+        stats['total_ms'] += total_time * 1000
+        stats['duplicated_queries'] += sum(n - 1 for n in duplicates.values())
+        stats['over_budget'] += collector.count > query_budget(view_name)
+        top = stats['top_duplicates']
+        for signature, n in duplicates.items():
+            top[signature] = max(top.get(signature, 0), n)
+        stats['top_duplicates'] = dict(
+            sorted(top.items(), key=lambda item: -item[1])[:TOP_DUPLICATES]
+        )
+        cache.set(_report_key(view_name), stats, timeout)
+
+        index = cache.get(REPORT_INDEX_KEY) or []
+        if view_name not in index:
+            cache.set(REPORT_INDEX_KEY, index + [view_name], timeout)
+
+
+def get_report():
+    """Накопленная статистика {маршрут: сводка} со средними значениями"""
+    index = cache.get(REPORT_INDEX_KEY) or []
+    stored = cache.get_many([_report_key(name) for name in index])
+    report = {}
+    for name in index:
+        stats = stored.get(_report_key(name))
+        if not stats:
+            continue
+        requests = stats['requests']
+        report[name] = {
+            **stats,
+            'budget': query_budget(name),
+            'avg_queries': round(stats['queries'] / requests, 2),
+            'avg_sql_ms': round(stats['sql_ms'] / requests, 3),
+            'avg_render_ms': round(stats['render_ms'] / requests, 3),
+            'avg_total_ms': round(stats['total_ms'] / requests, 3),
+        }
+    return report
+
+
+def reset_report():
+    index = cache.get(REPORT_INDEX_KEY) or []
+    cache.delete_many([_report_key(name) for name in index] + [REPORT_INDEX_KEY])
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Замеряет запросы к базе и рендеринг для каждого HTTP-запроса.
+
+    Включается настройкой ``QUERY_INSTRUMENTATION``. Должен стоять в
+    начале ``MIDDLEWARE``, чтобы учитывать запросы остальных слоев
+    (сессии, аутентификация). Сводка добавляется в заголовок
+    ``Server-Timing``. Работает и под WSGI, и под ASGI.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        collector = self.start(request)
+        started = time.perf_counter()
+        with self.instrument(collector):
+            response = self.get_response(request)
+        return self.finish(request, response, collector, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        collector = self.start(request)
+        started = time.perf_counter()
+        # Соединения у каждого потока свои: обертка подключается в том потоке,
+        # где sync_to_async выполняет запросы к базе этого HTTP-запроса
+        stack = await sync_to_async(self.instrument)(collector)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        total_time = time.perf_counter() - started
+        return await sync_to_async(self.finish)(request, response, collector, total_time)
+
+    def start(self, request):
+        request._instrumentation_render = [None, None]
+        return QueryCollector()
+
+    def instrument(self, collector):
+        """Подключает сборщик ко всем соединениям текущего потока"""
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(collector))
+        return stack
+
+    def finish(self, request, response, collector, total_time):
+        render_started, render_finished = request._instrumentation_render
+        render_time = (render_finished or 0) - (render_started or 0)
+        match = getattr(request, 'resolver_match', None)
+        view_name = (match and match.view_name) or 'unresolved'
+
+        record_request(view_name, collector, render_time, total_time)
+        response['Server-Timing'] = (
+            f'sql;dur={collector.duration * 1000:.1f};desc="{collector.count} queries", '
+            f'render;dur={render_time * 1000:.1f}, total;dur={total_time * 1000:.1f}'
+        )
+
+        budget = query_budget(view_name)
+        if collector.count > budget:
+            duplicates = collector.duplicates()
+            logger.warning(
+                '%s (%s): %d SQL-запросов при бюджете %d, повторяющихся: %d%s',
+                view_name, request.path, collector.count, budget, len(duplicates),
+                ''.join(f'\n  {n}× {signature}' for signature, n in list(duplicates.items())[:5]),
+            )
+        return response
+
+    def process_template_response(self, request, response):
+        # Вызывается последним перед рендерингом, если middleware стоит первым
+        timings = request._instrumentation_render
+        timings[0] = time.perf_counter()
+        response.add_post_render_callback(lambda rendered: timings.__setitem__(1, time.perf_counter()))
+        return response
@@ -0,0 +1,167 @@
+import asyncio
+import importlib
+import json
+import threading
+import time
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient, Client, override_settings
+from django.urls import clear_url_caches
+from notes.benchmarks import (
+    benchmark_database, compare_results, environment_info, seed_dataset, summarize, write_results,
+)
+from notes.models import Category, Note
+
+MODES = ('wsgi', 'asgi', 'asgi_async')
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пропускную способность страниц чтения под WSGI (потоки) и ASGI '
+        '(синхронные и асинхронные представления) при высокой конкурентности'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notes', type=int, default=1000, help='Размер набора данных')
+        parser.add_argument('--seed', type=int, default=42, help='Зерно генератора данных')
+        parser.add_argument('--concurrency', type=int, default=50, help='Число одновременных клиентов')
+        parser.add_argument('--requests', type=int, default=500, help='Запросов на сценарий в каждом режиме')
+        parser.add_argument('--modes', nargs='*', choices=MODES, default=list(MODES), help='Режимы запуска')
+        parser.add_argument('--output', help='Сохранить результаты в JSON-файл')
+        parser.add_argument('--baseline', help='JSON-файл базового прогона для сравнения')
+
+    def handle(self, *args, **options):
+        results = {
+            'meta': {
+                'notes': options['notes'],
+                'concurrency': options['concurrency'],
+                'requests': options['requests'],
+            },
+            'scenarios': {},
+        }
+        with benchmark_database(on_disk=True), override_settings(
+            PAGE_CACHE_TIMEOUT=0,
+            FRAGMENT_CACHE_TIMEOUT=0,
+            VIEW_COUNTER_DEDUP_TIMEOUT=0,
+            QUERY_INSTRUMENTATION=False,
+        ):
+            self.stdout.write(f'Заполнение базы: {options["notes"]} заметок...')
+            seed_dataset(options['notes'], options['seed'])
+            results['meta'].update(environment_info())
+            user = User.objects.filter(notes__isnull=False).order_by('pk').first()
+            note = Note.objects.filter(is_public=True).order_by('-comments_count', 'pk').first()
+            category = Category.objects.order_by('-notes_count').first()
+            scenarios = [
+                ('home', '/', None),
+                ('note_detail', f'/note/{note.pk}/', None),
+                ('category_notes', f'/category/{category.pk}/', None),
+                ('my_notes', '/my-notes/', user),
+            ]
+            connection.close()
+
+            try:
+                for mode in options['modes']:
+                    self.use_async_views(mode == 'asgi_async')
+                    for name, url, login_user in scenarios:
+                        run = self.run_wsgi if mode == 'wsgi' else self.run_asgi
+                        result = run(url, login_user, options['concurrency'], options['requests'])
+                        results['scenarios'][f'{mode}:{name}'] = result
+                        self.stdout.write(
+                            f'{mode:<10} {name:<15} {result["requests_per_sec"]:8.1f} зап/с  '
+                            f'p50 {result["p50_ms"]:8.2f} мс  p95 {result["p95_ms"]:8.2f} мс'
+                        )
+            finally:
+                self.use_async_views(settings.NOTES_ASYNC_VIEWS)
+
+        if options['output']:
+            write_results(options['output'], results)
+            self.stdout.write(f'Результаты сохранены в {options["output"]}')
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as source:
+                regressions = compare_results(results, json.load(source))
+            if regressions:
+                raise CommandError('Регрессии производительности:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('Регрессий относительно базового прогона нет'))
+
+    def use_async_views(self, enabled):
+        """Переключает маршруты страниц чтения на синхронные или асинхронные представления"""
+        settings.NOTES_ASYNC_VIEWS = enabled
+        importlib.reload(importlib.import_module('notes.urls'))
+        importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+        clear_url_caches()
+
+    def check_response(self, response, url):
+        if response.status_code != 200:
+            raise CommandError(f'GET {url}: статус {response.status_code}')
+
+    def run_wsgi(self, url, user, concurrency, total):
+        """Потоковый сервер: каждый клиент в своем потоке со своим соединением"""
+        timings = []
+        lock = threading.Lock()
+
+        def worker(count):
+            client = Client()
+            if user:
+                client.force_login(user)
+            local = []
+            try:
+                for _ in range(count):
+                    started = time.perf_counter()
+                    self.check_response(client.get(url), url)
+                    local.append(time.perf_counter() - started)
+            finally:
+                connection.close()
+            with lock:
+                timings.extend(local)
+
+        return self.run_workers(
+            lambda counts: self.run_threads(worker, counts), concurrency, total, timings
+        )
+
+    def run_threads(self, worker, counts):
+        threads = [threading.Thread(target=worker, args=(count,)) for count in counts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run_asgi(self, url, user, concurrency, total):
+        """ASGI: все клиенты в одном цикле событий, как в uvicorn/daphne"""
+        timings = []
+        clients = [AsyncClient() for _ in range(concurrency)]
+        if user:
+            for client in clients:
+                client.force_login(user)
+
+        async def worker(client, count):
+            for _ in range(count):
+                # Как ASGIHandler: отдельный поток для синхронного кода каждого запроса
+                async with ThreadSensitiveContext():
+                    started = time.perf_counter()
+                    response = await client.get(url)
+                    timings.append(time.perf_counter() - started)
+                    # Соединение потока запроса закрывается вне замера
+                    await sync_to_async(close_connection)()
+                self.check_response(response, url)
+
+        async def main(counts):
+            await asyncio.gather(*(worker(client, count) for client, count in zip(clients, counts)))
+
+        return self.run_workers(lambda counts: asyncio.run(main(counts)), concurrency, total, timings)
+
+    def run_workers(self, run, concurrency, total, timings):
+        counts = [total // concurrency + (i < total % concurrency) for i in range(concurrency)]
+        started = time.perf_counter()
+        run(counts)
+        elapsed = time.perf_counter() - started
+        summary = summarize(timings)
+        summary['requests_per_sec'] = round(len(timings) / elapsed, 1)
+        return summary
+
+
+def close_connection():
+    connection.close()
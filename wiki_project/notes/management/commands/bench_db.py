@@ -0,0 +1,138 @@
+import json
+import random
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connection
+from django.db.models import F
+from notes.benchmarks import (
+    benchmark_database, compare_results, environment_info, seed_dataset, summarize, write_results,
+)
+from notes.models import Comment, Note
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет пропускную способность базы при одновременных чтениях и записях; '
+        'профиль базы выбирается переменной WIKI_DB_PROFILE'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notes', type=int, default=1000, help='Размер набора данных')
+        parser.add_argument('--seed', type=int, default=42, help='Зерно генератора данных')
+        parser.add_argument('--readers', type=int, default=4, help='Число читающих потоков')
+        parser.add_argument('--writers', type=int, default=2, help='Число пишущих потоков')
+        parser.add_argument('--duration', type=float, default=10.0, help='Длительность замера, секунды')
+        parser.add_argument('--output', help='Сохранить результаты в JSON-файл')
+        parser.add_argument('--baseline', help='JSON-файл другого прогона (например, другого профиля) для сравнения')
+
+    def handle(self, *args, **options):
+        with benchmark_database(on_disk=True):
+            self.stdout.write(f'База: {connection.vendor}, заполнение: {options["notes"]} заметок...')
+            seed_dataset(options['notes'], options['seed'])
+            self.note_ids = list(Note.objects.filter(is_public=True).values_list('pk', flat=True))
+            self.user_ids = list(User.objects.values_list('pk', flat=True))
+            # Соединение главного потока не должно держать блокировок во время замера
+            connection.close()
+            results = self.run_load(options)
+
+        results['meta'].update(
+            environment_info(),
+            notes=options['notes'],
+            readers=options['readers'],
+            writers=options['writers'],
+            duration=options['duration'],
+        )
+        for name, result in results['scenarios'].items():
+            self.stdout.write(
+                f'{name:<6} {result["ops_per_sec"]:9.1f} оп/с  p50 {result["p50_ms"]:8.2f} мс  '
+                f'p95 {result["p95_ms"]:8.2f} мс  ошибок {result["errors"]}'
+            )
+        if options['output']:
+            write_results(options['output'], results)
+            self.stdout.write(f'Результаты сохранены в {options["output"]}')
+        if options['baseline']:
+            self.compare(results, options['baseline'])
+
+    def run_load(self, options):
+        stop = threading.Event()
+        timings = {'read': [], 'write': []}
+        errors = {'read': [], 'write': []}
+        threads = [
+            threading.Thread(target=self.worker, args=(self.read, stop, timings['read'], errors['read'], seed))
+            for seed in range(options['readers'])
+        ] + [
+            threading.Thread(target=self.worker, args=(self.write, stop, timings['write'], errors['write'], seed))
+            for seed in range(options['writers'])
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(options['duration'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        scenarios = {}
+        for name in ('read', 'write'):
+            summary = summarize(timings[name])
+            summary['ops_per_sec'] = round(len(timings[name]) / options['duration'], 1)
+            summary['errors'] = len(errors[name])
+            scenarios[name] = summary
+            for message in sorted(set(errors[name]))[:3]:
+                self.stderr.write(f'{name}: {message}')
+        return {'meta': {}, 'scenarios': scenarios}
+
+    def worker(self, operation, stop, timings, errors, seed):
+        generator = random.Random(seed)
+        try:
+            while not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    operation(generator)
+                except OperationalError as error:
+                    errors.append(str(error))
+                    continue
+                timings.append(time.perf_counter() - started)
+        finally:
+            close_old_connections()
+            connection.close()
+
+    def read(self, generator):
+        """Лента и страница заметки с комментариями"""
+        list(
+            Note.objects.filter(is_public=True)
+            .order_by('-created_at', '-id')
+            .cards()[:10]
+        )
+        note_id = generator.choice(self.note_ids)
+        note = Note.objects.select_related('author', 'category').get(pk=note_id)
+        list(note.comments.select_related('author'))
+
+    def write(self, generator):
+        """Запись просмотров и, реже, новый комментарий"""
+        note_id = generator.choice(self.note_ids)
+        if generator.random() < 0.8:
+            Note.objects.filter(pk=note_id).update(views_count=F('views_count') + 1)
+        else:
+            Comment.objects.create(
+                note_id=note_id,
+                author_id=generator.choice(self.user_ids),
+                text='Комментарий из нагрузочного теста',
+            )
+
+    def compare(self, results, path):
+        with open(path, encoding='utf-8') as source:
+            baseline = json.load(source)
+        self.stdout.write(f'Сравнение с {path} ({baseline["meta"].get("database")}):')
+        for name, result in results['scenarios'].items():
+            previous = baseline['scenarios'].get(name)
+            if previous and previous['ops_per_sec']:
+                ratio = result['ops_per_sec'] / previous['ops_per_sec']
+                self.stdout.write(
+                    f'{name:<6} {previous["ops_per_sec"]:9.1f} → {result["ops_per_sec"]:9.1f} оп/с (×{ratio:.2f})'
+                )
+        regressions = compare_results(results, baseline)
+        if regressions and baseline['meta'].get('database') == results['meta']['database']:
+            raise CommandError('Регрессии производительности:\n' + '\n'.join(regressions))
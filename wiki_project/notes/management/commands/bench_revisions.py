@@ -0,0 +1,184 @@
+import json
+import random
+import time
+import zlib
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Sum
+from django.db.models.functions import Length
+from django.test import override_settings
+from notes.benchmarks import (
+    benchmark_database, compare_results, environment_info, measure, summarize, write_results,
+)
+from notes.management.commands.populate_db import WORDS
+from notes.models import Note, NoteRevision
+from notes.revisions import (
+    compact_note_revisions, diff_lines, encode_revision, record_revision, revision_text,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет размер хранения ревизий и время записи, восстановления и '
+        'сравнения ревизий для заметок с длинной историей'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--revisions', type=int, default=2000, help='Ревизий на заметку')
+        parser.add_argument('--size', type=int, default=20000, help='Начальная длина текста, символов')
+        parser.add_argument(
+            '--intervals', type=int, nargs='*', default=[1, 10, 20, 50], help='Проверяемые интервалы снимков'
+        )
+        parser.add_argument('--samples', type=int, default=200, help='Замеров восстановления и сравнения')
+        parser.add_argument('--seed', type=int, default=42, help='Зерно генератора правок')
+        parser.add_argument('--output', help='Сохранить результаты в JSON-файл')
+        parser.add_argument('--baseline', help='JSON-файл базового прогона для сравнения')
+        parser.add_argument('--max-ratio', type=float, default=1.25, help='Допустимый рост p95 относительно базы')
+
+    def handle(self, *args, **options):
+        results = {
+            'meta': {
+                'revisions': options['revisions'],
+                'size': options['size'],
+                'seed': options['seed'],
+            },
+            'scenarios': {},
+            'storage': {},
+        }
+        with benchmark_database(), override_settings(SEARCH_INDEX_ASYNC=False, QUERY_INSTRUMENTATION=False):
+            results['meta'].update(environment_info())
+            self.user = User.objects.create_user('bench', password='bench')
+            for interval in options['intervals']:
+                self.stdout.write(f'Интервал {interval}: {options["revisions"]} ревизий...')
+                with override_settings(REVISION_SNAPSHOT_INTERVAL=interval):
+                    self.run_interval(interval, options, results)
+            self.run_compaction(options, results)
+
+        if options['output']:
+            write_results(options['output'], results)
+            self.stdout.write(f'Результаты сохранены в {options["output"]}')
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as source:
+                regressions = compare_results(results, json.load(source), options['max_ratio'])
+            if regressions:
+                raise CommandError('Регрессии производительности:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('Регрессий относительно базового прогона нет'))
+
+    def run_interval(self, interval, options, results):
+        """История одной заметки, записанная через record_revision"""
+        rng = random.Random(options['seed'])
+        note = self.create_note(rng, options['size'])
+        timings, full_bytes, compressed_bytes = [], 0, 0
+        for _ in range(options['revisions']):
+            full_bytes += len(note.content.encode('utf-8'))
+            compressed_bytes += len(zlib.compress(note.content.encode('utf-8'), 6))
+            started = time.perf_counter()
+            record_revision(note, self.user)
+            timings.append(time.perf_counter() - started)
+            note.content = self.edit(rng, note.content)
+
+        storage = self.storage(note, full_bytes, compressed_bytes)
+        results['storage'][f'interval_{interval}'] = storage
+        record = summarize(timings)
+        reconstruct, diff = self.measure_reads(note, options['samples'], rng)
+        for name, result in (('record', record), ('reconstruct', reconstruct), ('diff', diff)):
+            results['scenarios'][f'interval_{interval}:{name}'] = result
+        self.stdout.write(
+            f'  хранение {storage["stored_bytes"] / 1024:10.1f} КиБ '
+            f'(полные копии {full_bytes / 1024:.1f} КиБ, сжатые копии {compressed_bytes / 1024:.1f} КиБ), '
+            f'снимков {storage["snapshots"]}, самая длинная цепочка {storage["longest_chain"]}'
+        )
+        for name, result in (('запись', record), ('восстановление', reconstruct), ('сравнение', diff)):
+            self.stdout.write(
+                f'  {name:<15} p50 {result["p50_ms"]:8.2f} мс  p95 {result["p95_ms"]:8.2f} мс'
+                + (f'  запросов {result["queries"]}' if 'queries' in result else '')
+            )
+
+    def run_compaction(self, options, results):
+        """
+        Цепочка без промежуточных снимков (как после увеличения интервала)
+        до и после compact_revisions.
+        """
+        rng = random.Random(options['seed'])
+        note = self.create_note(rng, options['size'])
+        revisions, previous_text, previous_depth = [], None, 0
+        for number in range(1, options['revisions'] + 1):
+            depth, data = encode_revision(previous_text, note.content, previous_depth, interval=10 ** 9)
+            revisions.append(NoteRevision(
+                note=note, number=number, title=note.title, depth=depth, data=data, size=len(note.content),
+            ))
+            previous_text, previous_depth = note.content, depth
+            note.content = self.edit(rng, note.content)
+        NoteRevision.objects.bulk_create(revisions, batch_size=500)
+
+        latest = NoteRevision.objects.get(note=note, number=options['revisions'])
+        repeat = max(1, options['samples'] // 20)
+        before = measure(lambda: revision_text(latest), repeat)
+        started = time.perf_counter()
+        rewritten = compact_note_revisions(note.pk)
+        elapsed = time.perf_counter() - started
+        latest.refresh_from_db()
+        after = measure(lambda: revision_text(latest), repeat)
+        results['scenarios']['compaction:reconstruct_before'] = before
+        results['scenarios']['compaction:reconstruct_after'] = after
+        results['scenarios']['compaction:compact'] = summarize([elapsed])
+        self.stdout.write(
+            f'Сжатие цепочки из {options["revisions"]} ревизий: {elapsed * 1000:.0f} мс, '
+            f'изменено ревизий {rewritten}; восстановление последней ревизии '
+            f'{before["p50_ms"]:.2f} мс → {after["p50_ms"]:.2f} мс'
+        )
+
+    def measure_reads(self, note, samples, rng):
+        numbers = list(NoteRevision.objects.filter(note=note).values_list('number', flat=True))
+
+        def reconstruct():
+            revision = NoteRevision.objects.get(note=note, number=rng.choice(numbers))
+            revision_text(revision)
+
+        def diff():
+            number = rng.choice(numbers[1:] or numbers)
+            old, new = NoteRevision.objects.filter(note=note, number__in=[number - 1, number]).order_by('number')
+            diff_lines(revision_text(old), revision_text(new))
+
+        return measure(reconstruct, samples, warmup=5), measure(diff, samples, warmup=5)
+
+    def storage(self, note, full_bytes, compressed_bytes):
+        revisions = NoteRevision.objects.filter(note=note)
+        stats = revisions.aggregate(stored=Sum(Length('data')), longest=Max('depth'))
+        return {
+            'revisions': revisions.count(),
+            'snapshots': revisions.filter(depth=0).count(),
+            'longest_chain': stats['longest'] or 0,
+            'stored_bytes': stats['stored'] or 0,
+            'full_copy_bytes': full_bytes,
+            'compressed_copy_bytes': compressed_bytes,
+        }
+
+    def create_note(self, rng, size):
+        note = Note(title='Заметка с длинной историей', author=self.user, content=self.paragraphs(rng, size))
+        # HTML не нужен для замеров ревизий
+        Note.objects.bulk_create([note])
+        return note
+
+    def paragraphs(self, rng, size):
+        lines = []
+        while sum(map(len, lines)) < size:
+            lines.append(self.line(rng))
+        return '\n'.join(lines)
+
+    def line(self, rng):
+        return ' '.join(rng.choices(WORDS, k=rng.randint(8, 20))).capitalize() + '.'
+
+    def edit(self, rng, text):
+        """Типичная правка: замена, вставка или удаление одной-двух строк"""
+        lines = text.split('\n')
+        position = rng.randrange(len(lines))
+        action = rng.random()
+        if action < 0.5:
+            lines[position] = self.line(rng)
+        elif action < 0.8 or len(lines) < 10:
+            lines[position:position] = [self.line(rng) for _ in range(rng.randint(1, 2))]
+        else:
+            del lines[position:position + rng.randint(1, 2)]
+        return '\n'.join(lines)
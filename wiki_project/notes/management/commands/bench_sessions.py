@@ -0,0 +1,79 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from notes.benchmarks import benchmark_database, environment_info, measure, seed_dataset, write_results
+from notes.models import Note
+
+DEFAULT_AUTH_MIDDLEWARE = 'django.contrib.auth.middleware.AuthenticationMiddleware'
+CACHED_AUTH_MIDDLEWARE = 'notes.sessions.CachedAuthenticationMiddleware'
+
+# Стандартные сессии в базе против сессий и пользователя из кэша
+CONFIGURATIONS = {
+    'db': {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+        'MESSAGE_STORAGE': 'django.contrib.messages.storage.fallback.FallbackStorage',
+        'auth_middleware': DEFAULT_AUTH_MIDDLEWARE,
+    },
+    'cached': {
+        'SESSION_ENGINE': 'notes.sessions',
+        'MESSAGE_STORAGE': 'django.contrib.messages.storage.cookie.CookieStorage',
+        'auth_middleware': CACHED_AUTH_MIDDLEWARE,
+    },
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает число SQL-запросов и время страниц авторизованного '
+        'пользователя со стандартными и кэшированными сессиями'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notes', type=int, default=500, help='Размер набора данных')
+        parser.add_argument('--seed', type=int, default=42, help='Зерно генератора данных')
+        parser.add_argument('--repeat', type=int, default=30, help='Число замеров на сценарий')
+        parser.add_argument('--warmup', type=int, default=3, help='Число прогревочных запросов')
+        parser.add_argument('--output', help='Сохранить результаты в JSON-файл')
+
+    def handle(self, *args, **options):
+        results = {'meta': {}, 'scenarios': {}}
+        # Кэш страниц и фрагментов отключен, чтобы сравнивались только сессии
+        with benchmark_database(), override_settings(
+            SEARCH_INDEX_ASYNC=False, QUERY_INSTRUMENTATION=False,
+            PAGE_CACHE_TIMEOUT=0, FRAGMENT_CACHE_TIMEOUT=0,
+        ):
+            self.stdout.write(f'Заполнение базы: {options["notes"]} заметок...')
+            seed_dataset(options['notes'], options['seed'])
+            results['meta'] = {**environment_info(), 'notes': options['notes'], 'seed': options['seed']}
+            user = User.objects.filter(notes__isnull=False).order_by('pk').first()
+            note = Note.objects.filter(author=user).order_by('pk').first()
+            urls = {'home': '/', 'my_notes': '/my-notes/', 'note_detail': f'/note/{note.pk}/'}
+
+            for configuration, config in CONFIGURATIONS.items():
+                middleware = [
+                    config['auth_middleware'] if path in (DEFAULT_AUTH_MIDDLEWARE, CACHED_AUTH_MIDDLEWARE) else path
+                    for path in settings.MIDDLEWARE
+                ]
+                with override_settings(
+                    MIDDLEWARE=middleware,
+                    SESSION_ENGINE=config['SESSION_ENGINE'],
+                    MESSAGE_STORAGE=config['MESSAGE_STORAGE'],
+                ):
+                    client = Client()
+                    client.force_login(user)
+                    for name, url in urls.items():
+                        result = measure(lambda: client.get(url), options['repeat'], options['warmup'])
+                        results['scenarios'][f'{configuration}:{name}'] = result
+
+        self.stdout.write(f'{"страница":<14}{"запросов (db → cached)":>26}{"p50, мс (db → cached)":>28}')
+        for name in urls:
+            before, after = results['scenarios'][f'db:{name}'], results['scenarios'][f'cached:{name}']
+            self.stdout.write(
+                f'{name:<14}{before["queries"]:>14d} → {after["queries"]:<3d} (−{before["queries"] - after["queries"]})'
+                f'{before["p50_ms"]:>14.2f} → {after["p50_ms"]:.2f}'
+            )
+
+        if options['output']:
+            write_results(options['output'], results)
+            self.stdout.write(f'Результаты сохранены в {options["output"]}')
@@ -0,0 +1,120 @@
+import json
+from itertools import count
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from notes.benchmarks import (
+    benchmark_database, compare_results, environment_info, measure, seed_dataset, write_results,
+)
+from notes.models import Category, Note
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет время ответа и число SQL-запросов основных представлений '
+        'на детерминированном наборе данных'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notes', type=int, default=2000, help='Размер набора данных')
+        parser.add_argument('--seed', type=int, default=42, help='Зерно генератора данных')
+        parser.add_argument('--repeat', type=int, default=30, help='Число замеров на сценарий')
+        parser.add_argument('--warmup', type=int, default=3, help='Число прогревочных запросов')
+        parser.add_argument('--only', nargs='*', help='Запустить только перечисленные сценарии')
+        parser.add_argument('--output', help='Сохранить результаты в JSON-файл')
+        parser.add_argument('--baseline', help='JSON-файл базового прогона для сравнения')
+        parser.add_argument('--max-ratio', type=float, default=1.25, help='Допустимый рост p95 относительно базы')
+        parser.add_argument('--max-extra-queries', type=int, default=0, help='Допустимый рост числа запросов')
+        parser.add_argument('--with-cache', action='store_true', help='Не отключать кэш страниц и фрагментов')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as source:
+                baseline = json.load(source)
+
+        cache_settings = {} if options['with_cache'] else {
+            'PAGE_CACHE_TIMEOUT': 0,
+            'FRAGMENT_CACHE_TIMEOUT': 0,
+        }
+        with benchmark_database(), override_settings(
+            SEARCH_INDEX_ASYNC=False, RELATED_NOTES_ASYNC=False, VIEW_COUNTER_DEDUP_TIMEOUT=0,
+            QUERY_INSTRUMENTATION=False, **cache_settings,
+        ):
+            self.stdout.write(f'Заполнение базы: {options["notes"]} заметок...')
+            seed_dataset(options['notes'], options['seed'])
+            results = {
+                'meta': {**environment_info(), 'notes': options['notes'], 'seed': options['seed']},
+                'scenarios': {},
+            }
+            for name, action in self.scenarios():
+                if options['only'] and name not in options['only']:
+                    continue
+                result = measure(action, options['repeat'], options['warmup'])
+                results['scenarios'][name] = result
+                self.stdout.write(
+                    f'{name:<22} p50 {result["p50_ms"]:8.2f} мс  '
+                    f'p95 {result["p95_ms"]:8.2f} мс  запросов {result["queries"]:3d}'
+                )
+
+        if options['output']:
+            write_results(options['output'], results)
+            self.stdout.write(f'Результаты сохранены в {options["output"]}')
+
+        if baseline:
+            regressions = compare_results(
+                results, baseline, options['max_ratio'], options['max_extra_queries']
+            )
+            if regressions:
+                raise CommandError('Регрессии производительности:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('Регрессий относительно базового прогона нет'))
+
+    def scenarios(self):
+        """Пары (имя, действие); действие выполняет один запрос и проверяет ответ"""
+        user = User.objects.filter(notes__isnull=False).order_by('pk').first()
+        note = Note.objects.filter(is_public=True).order_by('-comments_count', 'pk').first()
+        own_note = Note.objects.filter(author=user).order_by('pk').first()
+        category = Category.objects.order_by('-notes_count').first()
+        query = note.title.split()[0]
+
+        anonymous = Client()
+        authenticated = Client()
+        authenticated.force_login(user)
+        sequence = count()
+
+        def request(client, method, url, data=None, expected=(200,), **headers):
+            def action():
+                response = getattr(client, method)(url() if callable(url) else url, data, **headers)
+                if response.status_code not in expected:
+                    raise CommandError(f'{method.upper()} {url}: статус {response.status_code}')
+            return action
+
+        note_data = lambda: {
+            'title': f'Замер {next(sequence)}',
+            'content': 'Текст заметки для замера производительности. ' * 20,
+            'tags': ', '.join(f'bench-{i}' for i in range(10)),
+            'is_public': 'on',
+        }
+
+        return [
+            ('home', request(anonymous, 'get', '/')),
+            ('home_search', request(anonymous, 'get', f'/?query={query}')),
+            ('home_category', request(anonymous, 'get', f'/?category={category.pk}')),
+            ('home_authenticated', request(authenticated, 'get', '/')),
+            ('note_detail', request(anonymous, 'get', f'/note/{note.pk}/')),
+            ('note_not_modified', request(
+                anonymous, 'get', f'/note/{note.pk}/', expected=(304,),
+                HTTP_IF_NONE_MATCH=anonymous.get(f'/note/{note.pk}/')['ETag'],
+            )),
+            ('note_comments', request(anonymous, 'get', f'/note/{note.pk}/comments/')),
+            ('my_notes', request(authenticated, 'get', '/my-notes/')),
+            ('category_notes', request(anonymous, 'get', f'/category/{category.pk}/')),
+            ('note_create', lambda: request(authenticated, 'post', '/note/new/', note_data(), (302,))()),
+            ('note_update', lambda: request(
+                authenticated, 'post', f'/note/{own_note.pk}/edit/', note_data(), (302,)
+            )()),
+            ('add_comment', request(
+                authenticated, 'post', f'/note/{note.pk}/comment/', {'text': 'Комментарий для замера'}, (302,)
+            )),
+        ]
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from notes import assets
+
+
+def kilobytes(size):
+    return f'{size / 1024:.1f} КБ'
+
+
+class Command(BaseCommand):
+    help = (
+        'Собирает статику в STATIC_ROOT: очищает сторонние CSS от '
+        'неиспользуемых правил, добавляет хэши в имена файлов и сохраняет '
+        'сжатые копии .gz и .br'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clear', action='store_true', help='Удалить старые файлы из STATIC_ROOT')
+
+    def handle(self, *args, **options):
+        call_command('collectstatic', interactive=False, clear=options['clear'], verbosity=0)
+        self.stdout.write(f'Статика собрана в {settings.STATIC_ROOT}')
+
+        for name, before, after in getattr(staticfiles_storage, 'purged', ()):
+            self.stdout.write(f'  {name}: {kilobytes(before)} -> {kilobytes(after)}')
+
+        compressed = getattr(staticfiles_storage, 'compressed', ())
+        for suffix in ('.gz', '.br'):
+            files = [(before, after) for name, before, after in compressed if name.endswith(suffix)]
+            if files:
+                self.stdout.write(
+                    f'  {suffix}: файлов {len(files)}, '
+                    f'{kilobytes(sum(before for before, _ in files))} -> '
+                    f'{kilobytes(sum(after for _, after in files))}'
+                )
+        if assets.brotli is None:
+            self.stdout.write(self.style.WARNING('Пакет brotli не установлен: копии .br не созданы'))
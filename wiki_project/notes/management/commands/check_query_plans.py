@@ -0,0 +1,84 @@
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from notes.benchmarks import benchmark_database, seed_dataset
+from notes.models import Category, Note
+from notes.pagination import KeysetPaginator
+
+PUBLIC = 'note_public_created_idx'
+AUTHOR = 'note_author_created_idx'
+CATEGORY = 'note_category_created_idx'
+
+
+class Command(BaseCommand):
+    help = (
+        'Проверяет через EXPLAIN, что запросы списков заметок читают данные '
+        'по индексам и без отдельной сортировки'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notes', type=int, default=2000, help='Размер набора данных')
+        parser.add_argument('--seed', type=int, default=42, help='Зерно генератора данных')
+        parser.add_argument(
+            '--current-db', action='store_true',
+            help='Проверять на рабочей базе вместо временной с синтетическими данными'
+        )
+        parser.add_argument('--show-plans', action='store_true', help='Печатать планы запросов')
+
+    def handle(self, *args, **options):
+        if options['current_db']:
+            failures = self.check_plans(options)
+        else:
+            with benchmark_database():
+                seed_dataset(options['notes'], options['seed'])
+                failures = self.check_plans(options)
+        if failures:
+            raise CommandError('Планы без ожидаемых индексов: ' + ', '.join(failures))
+        self.stdout.write(self.style.SUCCESS('Все запросы используют индексы'))
+
+    def check_plans(self, options):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        user = User.objects.filter(notes__isnull=False).order_by('pk').first()
+        category = Category.objects.order_by('-notes_count').first()
+        if user is None or category is None:
+            raise CommandError('В базе нет заметок с автором и категорией')
+
+        failures = []
+        for name, streams, expected in self.cases(user, category):
+            paginator = KeysetPaginator(streams[0], 10, streams=streams)
+            # Первая страница и страница после курсора
+            last = Note.objects.order_by('-created_at', '-id')[paginator.per_page]
+            for suffix, key in (('', None), (' (курсор)', paginator.key(last))):
+                for number, (queryset, indexes) in enumerate(zip(paginator.stream_querysets(key), expected), 1):
+                    label = f'{name}[{number}]{suffix}'
+                    plan = queryset.explain()
+                    ok = self.uses_index(plan, indexes)
+                    self.stdout.write(
+                        f'{label:<40} ' + (self.style.SUCCESS('OK') if ok else self.style.ERROR('FAIL'))
+                    )
+                    if options['show_plans'] or not ok:
+                        self.stdout.write('    ' + plan.replace('\n', '\n    '))
+                    if not ok:
+                        failures.append(label)
+        return failures
+
+    def cases(self, user, category):
+        """(название, выборки как во view, допустимые индексы для каждой выборки)"""
+        notes = Note.objects.all()
+        in_category = Note.objects.filter(category=category)
+        return [
+            ('home: аноним', notes.visibility_streams(AnonymousUser()), [{PUBLIC}]),
+            ('home: пользователь', notes.visibility_streams(user), [{AUTHOR}, {PUBLIC}]),
+            ('my_notes', [notes.filter(author=user)], [{AUTHOR}]),
+            ('category: аноним', in_category.visibility_streams(AnonymousUser()), [{CATEGORY}]),
+            ('category: пользователь', in_category.visibility_streams(user), [{AUTHOR}, {CATEGORY}]),
+        ]
+
+    def uses_index(self, plan, indexes):
+        if not any(index in plan for index in indexes):
+            return False
+        # Отдельная сортировка означает, что порядок индекса не используется
+        if connection.vendor == 'sqlite':
+            return 'TEMP B-TREE' not in plan
+        return not any(line.strip().startswith(('Sort', '->  Sort')) for line in plan.splitlines())
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from notes.search import find_drift, update_index
+
+
+class Command(BaseCommand):
+    help = 'Проверяет расхождения между поисковым индексом и содержимым заметок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Количество заметок, проверяемых за один проход'
+        )
+        parser.add_argument(
+            '--fix', action='store_true',
+            help='Переиндексировать заметки с расхождениями'
+        )
+        parser.add_argument(
+            '--verbose-terms', action='store_true',
+            help='Выводить расходящиеся термы'
+        )
+
+    def handle(self, *args, **options):
+        drifted = []
+        for note_id, missing, stale, changed in find_drift(chunk_size=options['chunk_size']):
+            drifted.append(note_id)
+            self.stdout.write(
+                f'Заметка {note_id}: отсутствует {len(missing)}, '
+                f'лишних {len(stale)}, с неверным весом {len(changed)}'
+            )
+            if options['verbose_terms']:
+                for label, terms in (('+', missing), ('-', stale), ('~', changed)):
+                    if terms:
+                        self.stdout.write(f'  {label} {", ".join(terms)}')
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('Индекс соответствует данным'))
+            return
+
+        self.stdout.write(self.style.WARNING(f'Заметок с расхождениями: {len(drifted)}'))
+        if options['fix']:
+            created = updated = deleted = 0
+            chunk_size = options['chunk_size']
+            for start in range(0, len(drifted), chunk_size):
+                changes = update_index(drifted[start:start + chunk_size])
+                created, updated, deleted = (
+                    total + count for total, count in zip((created, updated, deleted), changes)
+                )
+            self.stdout.write(self.style.SUCCESS(
+                f'Индекс исправлен: добавлено {created}, обновлено {updated}, удалено {deleted}'
+            ))
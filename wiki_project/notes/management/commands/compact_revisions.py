@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Sum
+from django.db.models.functions import Length
+from notes.models import NoteRevision
+from notes.revisions import compact_revisions, snapshot_interval
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает цепочки ревизий заметок, ставшие длиннее интервала снимков'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=int,
+            help='Интервал снимков (по умолчанию REVISION_SNAPSHOT_INTERVAL)'
+        )
+        parser.add_argument(
+            '--rebalance', action='store_true',
+            help='Обработать все заметки, в том числе заменить лишние снимки разницами'
+        )
+
+    def handle(self, *args, **options):
+        interval = options['interval'] or snapshot_interval()
+        self.stdout.write(f'Интервал снимков: {interval}')
+        self.report('До')
+        notes, rewritten = compact_revisions(
+            interval=interval,
+            rebalance=options['rebalance'],
+            progress=self.progress,
+        )
+        self.report('После')
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: заметок {notes}, изменено ревизий {rewritten}'
+        ))
+
+    def progress(self, count):
+        if count % 100 == 0:
+            self.stdout.write(f'Обработано заметок: {count}')
+
+    def report(self, label):
+        stats = NoteRevision.objects.aggregate(
+            bytes=Sum(Length('data')),
+            longest=Max('depth'),
+        )
+        self.stdout.write(
+            f'{label}: ревизий {NoteRevision.objects.count()}, снимков '
+            f'{NoteRevision.objects.filter(depth=0).count()}, данных {stats["bytes"] or 0} байт, '
+            f'самая длинная цепочка {stats["longest"] or 0}'
+        )
@@ -0,0 +1,42 @@
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from notes.transfer import EXPORT_CHUNK_SIZE, FORMATS, export_queryset, export_stream
+
+
+class Command(BaseCommand):
+    help = 'Потоковый экспорт заметок в JSONL или tar-архив Markdown-файлов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FORMATS, default='jsonl', help='Формат экспорта')
+        parser.add_argument('--user', help='Экспортировать только заметки этого пользователя')
+        parser.add_argument('--output', help='Файл для записи (по умолчанию — стандартный вывод)')
+        parser.add_argument(
+            '--chunk-size', type=int, default=EXPORT_CHUNK_SIZE,
+            help='Количество заметок, читаемых из базы за один запрос'
+        )
+
+    def handle(self, *args, **options):
+        author = None
+        if options['user']:
+            try:
+                author = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f'Пользователь {options["user"]} не найден')
+
+        chunks = export_stream(options['format'], export_queryset(author), options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                written = self.write(chunks, output)
+            self.stderr.write(f'Записано {written} байт в {options["output"]}')
+        else:
+            self.write(chunks, sys.stdout.buffer)
+
+    def write(self, chunks, output):
+        written = 0
+        for chunk in chunks:
+            output.write(chunk)
+            written += len(chunk)
+        output.flush()
+        return written
@@ -0,0 +1,84 @@
+import json
+import os
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from notes.transfer import FORMATS, NoteImporter, TransferError, detect_format, read_records
+
+
+class Command(BaseCommand):
+    help = (
+        'Импорт заметок из JSONL или tar-архива Markdown-файлов пачками с '
+        'продолжением с последней сохраненной пачки'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл .jsonl или .tar')
+        parser.add_argument('--format', choices=FORMATS, help='Формат (по умолчанию — по расширению файла)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Заметок в одной транзакции')
+        parser.add_argument('--user', help='Автор для заметок, чей автор не найден по имени')
+        parser.add_argument(
+            '--state',
+            help='Файл с позицией последней сохраненной пачки (по умолчанию <path>.import-state)'
+        )
+        parser.add_argument('--restart', action='store_true', help='Начать с начала, игнорируя сохраненную позицию')
+        parser.add_argument('--no-index', action='store_true', help='Не обновлять поисковый индекс')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'Файл {path} не найден')
+        source_format = options['format'] or detect_format(path)
+        state_path = options['state'] or f'{path}.import-state'
+
+        default_author = None
+        if options['user']:
+            try:
+                default_author = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f'Пользователь {options["user"]} не найден')
+
+        offset = 0 if options['restart'] else self.load_offset(state_path, path)
+        if offset:
+            self.stdout.write(f'Продолжение с позиции {offset} байт')
+
+        importer = NoteImporter(
+            batch_size=options['batch_size'],
+            default_author=default_author,
+            index=not options['no_index'],
+        )
+
+        def on_commit(position):
+            self.save_offset(state_path, path, position)
+            self.stdout.write(
+                f'Сохранено: {importer.stats["created"]} заметок, позиция {position} байт'
+            )
+
+        try:
+            with open(path, 'rb') as source:
+                stats = importer.run(read_records(source, source_format, offset), on_commit=on_commit)
+        except TransferError as error:
+            raise CommandError(f'Ошибка в источнике: {error}. Сохраненные пачки останутся, запуск можно продолжить')
+
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: создано {stats["created"]}, пропущено {stats["skipped"]}, '
+            f'уже импортировано {stats["duplicates"]}, новых категорий {stats["categories"]}'
+        ))
+
+    def load_offset(self, state_path, path):
+        if not os.path.exists(state_path):
+            return 0
+        with open(state_path, encoding='utf-8') as state_file:
+            state = json.load(state_file)
+        if state.get('source') != os.path.abspath(path):
+            raise CommandError(f'{state_path} относится к другому файлу; используйте --restart или --state')
+        return state['offset']
+
+    def save_offset(self, state_path, path, offset):
+        # Запись через временный файл: состояние не повреждается при сбое
+        temporary = f'{state_path}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as state_file:
+            json.dump({'source': os.path.abspath(path), 'offset': offset}, state_file)
+        os.replace(temporary, state_path)
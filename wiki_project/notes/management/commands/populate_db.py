@@ -1,12 +1,73 @@
-from django.core.management.base import BaseCommand
+import math
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
-from notes.models import Category, Note, Tag, NoteTag, Comment
+from django.db import transaction
+from django.utils import timezone
+from notes.caching import bump_version
+from notes.counters import repair_counters
+from notes.models import Category, Note, NoteRevision, NoteTag, Comment
+from notes.related import rebuild_related
+from notes.revisions import initial_revision, record_revision
+from notes.search import rebuild_index
+from notes.tags import resolve_tags, set_note_tags
+
+# Словарь для генерации текста синтетических заметок
+WORDS = '''
+    заметка проект задача python django база данных запрос индекс сервер клиент
+    функция модель шаблон представление страница список поиск категория тег
+    комментарий пользователь автор версия релиз тест ошибка исправление план
+    идея архитектура кэш очередь поток процесс память диск сеть протокол api
+    документация настройка развертывание мониторинг метрика нагрузка профиль
+    оптимизация алгоритм структура массив словарь строка число время дата год
+    неделя встреча команда работа обучение курс книга статья пример код модуль
+    пакет библиотека фреймворк backend frontend web http json sql postgresql
+    sqlite миграция схема таблица колонка транзакция блокировка реплика шард
+    the of and to in is for on with as by this that from it at be are was data
+    system user request response cache query index table value result method
+'''.split()
+
+
+def chunked(total, size):
+    """Размеры последовательных пачек"""
+    for start in range(0, total, size):
+        yield min(size, total - start)
 
 
 class Command(BaseCommand):
-    help = 'Заполняет базу данных тестовыми данными'
+    help = (
+        'Заполняет базу данных тестовыми данными; с --notes генерирует '
+        'синтетический набор заданного объема'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='Число синтетических пользователей')
+        parser.add_argument('--notes', type=int, default=0, help='Число синтетических заметок (0 — только демо-данные)')
+        parser.add_argument('--tags', type=int, default=500, help='Размер словаря тегов')
+        parser.add_argument('--categories', type=int, default=20, help='Число синтетических категорий')
+        parser.add_argument('--comments', type=int, default=None, help='Общее число комментариев (по умолчанию 2 на заметку)')
+        parser.add_argument('--max-tags-per-note', type=int, default=6, help='Максимум тегов у заметки')
+        parser.add_argument('--public-ratio', type=float, default=0.7, help='Доля публичных заметок')
+        parser.add_argument('--content-median', type=int, default=800, help='Медианный размер заметки в символах')
+        parser.add_argument('--days', type=int, default=730, help='Глубина истории дат создания в днях')
+        parser.add_argument('--seed', type=int, default=42, help='Зерно генератора случайных чисел')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Размер пачки для bulk_create')
+        parser.add_argument('--index', action='store_true', help='Перестроить поисковый индекс после загрузки')
+        parser.add_argument('--related', action='store_true', help='Пересчитать похожие заметки после загрузки')
+        parser.add_argument('--skip-demo', action='store_true', help='Не создавать демо-данные')
 
-    def handle(self, *args, **kwargs):
+    def handle(self, *args, **options):
+        if not options['skip_demo']:
+            self.create_demo_data()
+        if options['notes'] > 0:
+            self.generate(options)
+        self.stdout.write(self.style.SUCCESS('База данных успешно заполнена!'))
+
+    def create_demo_data(self):
         self.stdout.write('Начало заполнения базы данных...')
 
         # Создание тестовых пользователей
@@ -47,12 +108,9 @@ class Command(BaseCommand):
         # Создание тегов
         tags_names = ['python', 'django', 'web', 'backend', 'frontend', 'база-данных', 
                       'api', 'tutorial', 'заметка', 'важно']
-        tags = []
-        for tag_name in tags_names:
-            tag, created = Tag.objects.get_or_create(name=tag_name)
-            if created:
-                self.stdout.write(f'Создан тег: {tag.name}')
-            tags.append(tag)
+        tags_by_name = resolve_tags(tags_names)
+        tags = [tags_by_name[tag_name] for tag_name in tags_names]
+        self.stdout.write(f'Тегов: {len(tags)}')
 
         # Создание заметок
         notes_data = [
@@ -179,9 +237,9 @@ asyncio.run(main())
                 }
             )
             if created:
+                record_revision(note, note.author)
                 # Добавление тегов
-                for tag in note_data['tags']:
-                    NoteTag.objects.create(note=note, tag=tag)
+                set_note_tags(note, [tag.name for tag in note_data['tags']])
                 
                 self.stdout.write(f'Создана заметка: {note.title}')
                 
@@ -193,4 +251,140 @@ asyncio.run(main())
                         text='Отличная заметка! Очень полезная информация.'
                     )
 
-        self.stdout.write(self.style.SUCCESS('База данных успешно заполнена!'))
\ No newline at end of file
+    # --- Синтетический набор данных -----------------------------------------
+
+    def progress(self, label, done, total, started):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(f'{label}: {done}/{total} ({done / elapsed:.0f}/с)')
+
+    def generate(self, options):
+        rng = random.Random(options['seed'])
+        chunk_size = options['chunk_size']
+        if options['users'] < 1:
+            raise CommandError('Для генерации заметок нужен хотя бы один пользователь')
+        if not 0 <= options['public_ratio'] <= 1:
+            raise CommandError('--public-ratio должен быть от 0 до 1')
+
+        user_ids = self.generate_users(options['users'], options['seed'], chunk_size)
+        category_ids = self.generate_categories(options['categories'])
+        tag_ids = self.generate_tags(rng, options['tags'])
+        # Популярность тегов распределена по закону Ципфа
+        tag_weights = [1 / (rank + 1) for rank in range(len(tag_ids))]
+
+        total_notes = options['notes']
+        total_comments = options['comments']
+        if total_comments is None:
+            total_comments = total_notes * 2
+        comments_per_note = total_comments / total_notes
+        # Логнормальное распределение размера заметки с заданной медианой
+        content_mu = math.log(max(options['content_median'], 1))
+        now = timezone.now()
+        horizon = options['days'] * 86400
+
+        self.stdout.write(f'Генерация {total_notes} заметок пачками по {chunk_size}...')
+        started = time.monotonic()
+        done = comments_done = 0
+        for size in chunked(total_notes, chunk_size):
+            notes = [
+                Note(
+                    title=self.sentence(rng, rng.randint(2, 8)).capitalize(),
+                    content=self.text(rng, int(rng.lognormvariate(content_mu, 1.0)) + 20),
+                    author_id=rng.choice(user_ids),
+                    category_id=rng.choice(category_ids) if rng.random() < 0.85 else None,
+                    created_at=now - timedelta(seconds=rng.randrange(horizon)),
+                    is_public=rng.random() < options['public_ratio'],
+                    views_count=int(rng.paretovariate(1.2)) - 1,
+                )
+                for _ in range(size)
+            ]
+            # bulk_create не вызывает save(), HTML и анонс считаются здесь
+            for note in notes:
+                note.render_content()
+            # Число комментариев к пачке пропорционально ее размеру
+            chunk_comments = int(round((done + size) * comments_per_note)) - comments_done
+            with transaction.atomic():
+                Note.objects.bulk_create(notes, batch_size=chunk_size)
+                NoteRevision.objects.bulk_create([initial_revision(note) for note in notes], batch_size=chunk_size)
+                links = []
+                for note in notes:
+                    count = rng.randint(0, options['max_tags_per_note'])
+                    chosen = set(rng.choices(tag_ids, weights=tag_weights, k=count)) if tag_ids else ()
+                    links.extend(NoteTag(note_id=note.pk, tag_id=tag_id) for tag_id in chosen)
+                NoteTag.objects.bulk_create(links, batch_size=chunk_size)
+                Comment.objects.bulk_create(
+                    [
+                        Comment(
+                            note_id=note.pk,
+                            author_id=rng.choice(user_ids),
+                            text=self.text(rng, int(rng.lognormvariate(4.5, 0.8)) + 5),
+                        )
+                        # Обсуждаемость заметок неравномерна: часть собирает много комментариев
+                        for note in rng.choices(notes, weights=[rng.paretovariate(1.5) for _ in notes], k=chunk_comments)
+                    ],
+                    batch_size=chunk_size,
+                )
+            done += size
+            comments_done += chunk_comments
+            self.progress('Заметки', done, total_notes, started)
+
+        self.stdout.write('Пересчет счетчиков...')
+        repair_counters()
+        bump_version('notes', 'categories')
+        if options['index']:
+            self.stdout.write('Построение поискового индекса...')
+            rebuild_index(progress=lambda count: self.progress('Индекс', count, total_notes, started))
+        if options['related']:
+            self.stdout.write('Расчет похожих заметок...')
+            rebuild_related()
+        self.stdout.write(
+            f'Сгенерировано: заметок {total_notes}, комментариев {comments_done} '
+            f'за {time.monotonic() - started:.1f} с'
+        )
+
+    def generate_users(self, count, seed, chunk_size):
+        prefix = f'load{seed}_'
+        password = make_password('password123')
+        for start in range(0, count, chunk_size):
+            User.objects.bulk_create(
+                [
+                    User(username=f'{prefix}{i}', email=f'{prefix}{i}@example.com', password=password)
+                    for i in range(start, min(start + chunk_size, count))
+                ],
+                ignore_conflicts=True,
+            )
+        user_ids = list(
+            User.objects.filter(username__startswith=prefix).order_by('pk').values_list('pk', flat=True)[:count]
+        )
+        self.stdout.write(f'Пользователей: {len(user_ids)}')
+        return user_ids
+
+    def generate_categories(self, count):
+        Category.objects.bulk_create(
+            [Category(name=f'Категория {i}') for i in range(1, count + 1)],
+            ignore_conflicts=True,
+        )
+        category_ids = list(Category.objects.values_list('pk', flat=True))
+        self.stdout.write(f'Категорий: {len(category_ids)}')
+        return category_ids
+
+    def generate_tags(self, rng, count):
+        names = set()
+        while len(names) < count:
+            names.add('-'.join(rng.sample(WORDS, rng.randint(1, 2))))
+        tags = resolve_tags(sorted(names))
+        self.stdout.write(f'Тегов: {len(tags)}')
+        return [tag.pk for tag in tags.values()]
+
+    def sentence(self, rng, words):
+        return ' '.join(rng.choices(WORDS, k=words))
+
+    def text(self, rng, length):
+        """Текст примерно заданной длины из абзацев по 40–120 слов"""
+        words = rng.choices(WORDS, k=max(1, length // 7))
+        paragraphs = []
+        start = 0
+        while start < len(words):
+            end = start + rng.randint(40, 120)
+            paragraphs.append(' '.join(words[start:end]).capitalize() + '.')
+            start = end
+        return '\n\n'.join(paragraphs)
\ No newline at end of file
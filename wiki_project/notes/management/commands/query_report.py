@@ -0,0 +1,47 @@
+import json
+
+from django.core.management.base import BaseCommand
+from notes.instrumentation import get_report, reset_report
+
+
+class Command(BaseCommand):
+    help = 'Показывает накопленную статистику SQL-запросов по маршрутам'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sort', default='avg_queries',
+            choices=['avg_queries', 'max_queries', 'avg_sql_ms', 'avg_render_ms', 'avg_total_ms', 'requests'],
+            help='Поле для сортировки'
+        )
+        parser.add_argument('--duplicates', action='store_true', help='Показать повторяющиеся запросы')
+        parser.add_argument('--json', action='store_true', help='Вывести отчет в JSON')
+        parser.add_argument('--reset', action='store_true', help='Очистить накопленную статистику')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            reset_report()
+            self.stdout.write(self.style.SUCCESS('Статистика очищена'))
+            return
+
+        report = get_report()
+        if options['json']:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+            return
+        if not report:
+            self.stdout.write('Статистики нет: включите QUERY_INSTRUMENTATION и общий кэш (file/redis)')
+            return
+
+        self.stdout.write(
+            f'{"маршрут":<36} {"запросов":>8} {"ср.":>7} {"макс":>5} {"SQL мс":>8} '
+            f'{"шаблон мс":>9} {"всего мс":>9} {"повторы":>8} {"бюджет":>7}'
+        )
+        for name, stats in sorted(report.items(), key=lambda item: -item[1][options['sort']]):
+            line = (
+                f'{name:<36} {stats["requests"]:>8} {stats["avg_queries"]:>7.1f} '
+                f'{stats["max_queries"]:>5} {stats["avg_sql_ms"]:>8.2f} {stats["avg_render_ms"]:>9.2f} '
+                f'{stats["avg_total_ms"]:>9.2f} {stats["duplicated_queries"]:>8} {stats["budget"]:>7}'
+            )
+            self.stdout.write(self.style.WARNING(line) if stats['over_budget'] else line)
+            if options['duplicates']:
+                for signature, n in stats['top_duplicates'].items():
+                    self.stdout.write(f'    {n}× {signature[:160]}')
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from notes import related
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает похожие заметки по общим тегам: матрица «заметка × тег», '
+        'сходство всех пар и лучшие соседи каждой заметки'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--metric', choices=related.METRICS, help='Мера сходства (по умолчанию из настроек)')
+        parser.add_argument(
+            '--engine', choices=('numpy', 'python'),
+            help='Способ расчета; по умолчанию NumPy/SciPy, если установлены'
+        )
+
+    def handle(self, *args, **options):
+        if options['engine'] == 'numpy' and related.np is None:
+            raise CommandError('Для --engine numpy нужны пакеты numpy и scipy')
+        started = time.perf_counter()
+        result = related.rebuild_related(options['metric'], options['engine'])
+        self.stdout.write(
+            f'Похожие заметки пересчитаны за {time.perf_counter() - started:.2f} с '
+            f'({result["engine"]}): заметок {result["notes"]}, строк {result["rows"]}'
+        )
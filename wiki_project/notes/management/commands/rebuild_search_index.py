@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from notes.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает поисковый индекс заметок с нуля'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Количество заметок в одной транзакции перестройки'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Количество записей индекса в одном INSERT'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Перестройка поискового индекса...')
+        total = rebuild_index(
+            chunk_size=options['chunk_size'],
+            batch_size=options['batch_size'],
+            progress=lambda count: self.stdout.write(f'Проиндексировано заметок: {count}'),
+        )
+        self.stdout.write(self.style.SUCCESS(f'Индекс перестроен, заметок: {total}'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from notes.counters import repair_counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает денормализованные счетчики заметок, категорий и тегов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать число расходящихся записей'
+        )
+
+    def handle(self, *args, **options):
+        report = repair_counters(dry_run=options['dry_run'])
+        label = 'расходящихся записей' if options['dry_run'] else 'исправлено записей'
+        for counter, rows in report.items():
+            self.stdout.write(f'{counter}: {label}: {rows}')
+        if options['dry_run'] and any(report.values()):
+            self.stdout.write(self.style.WARNING('Найдены расхождения, запустите команду без --dry-run'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Счетчики соответствуют данным'))
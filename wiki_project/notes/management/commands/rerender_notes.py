@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from notes.caching import bump_version
+from notes.rendering import RENDERER_VERSION, rerender_notes
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает сохраненный HTML и анонсы заметок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Обработать все заметки, а не только с устаревшей версией разметки'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Количество заметок, обрабатываемых за один проход'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Версия разметки: {RENDERER_VERSION}')
+        total = rerender_notes(
+            force=options['all'],
+            chunk_size=options['chunk_size'],
+            progress=lambda count: self.stdout.write(f'Обработано заметок: {count}'),
+        )
+        if total:
+            # Карточки в кэше фрагментов зависят от анонса
+            bump_version('notes')
+        self.stdout.write(self.style.SUCCESS(f'Готово, обновлено заметок: {total}'))
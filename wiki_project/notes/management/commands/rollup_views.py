@@ -0,0 +1,53 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from notes.analytics import rollup_views, top_viewed
+from notes.models import Category, Note, ViewStat
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает почасовые и дневные сводки просмотров по журналу '
+        'ViewEvent, обновляет популярные заметки и удаляет старые события'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Повторять пересчет с заданным интервалом в секундах'
+        )
+        parser.add_argument('--report', action='store_true', help='Показать самые просматриваемые объекты')
+        parser.add_argument('--days', type=int, default=7, help='Период отчета в днях')
+        parser.add_argument('--limit', type=int, default=10, help='Строк в каждом разделе отчета')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            result = rollup_views()
+            self.stdout.write(
+                f'Сводки обновлены за {time.perf_counter() - started:.2f} с: '
+                f'почасовых строк {result["hourly"]}, дневных {result["daily"]}, '
+                f'популярных заметок {result["trending"]}; удалено событий '
+                f'{result["purged_events"]}, почасовых строк {result["purged_hourly"]}'
+            )
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+        if options['report']:
+            self.report(options['days'], options['limit'])
+
+    def report(self, days, limit):
+        sections = (
+            ('Заметки', ViewStat.NOTE, Note.objects, 'title'),
+            ('Категории', ViewStat.CATEGORY, Category.objects, 'name'),
+            ('Авторы', ViewStat.AUTHOR, User.objects, 'username'),
+        )
+        for label, dimension, manager, field in sections:
+            top = top_viewed(dimension, days, limit)
+            names = manager.only(field).in_bulk([object_id for object_id, _ in top])
+            self.stdout.write(f'{label} за {days} дн.:')
+            for object_id, views in top:
+                name = getattr(names[object_id], field) if object_id in names else f'#{object_id} (удален)'
+                self.stdout.write(f'  {views:8d}  {name}')
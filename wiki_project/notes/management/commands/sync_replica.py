@@ -0,0 +1,42 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = (
+        'Копирует основную базу SQLite в реплики (DATABASE_REPLICAS) — '
+        'для локальной проверки чтения с реплик'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Повторять копирование с заданным интервалом в секундах (имитация отставания реплики)'
+        )
+
+    def handle(self, *args, **options):
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != 'sqlite':
+            raise CommandError('Команда работает только с SQLite; для PostgreSQL используйте потоковую репликацию')
+        aliases = getattr(settings, 'DATABASE_REPLICAS', [])
+        if not aliases:
+            raise CommandError('Реплики не настроены: задайте переменную окружения WIKI_DB_REPLICAS')
+
+        while True:
+            started = time.perf_counter()
+            primary.ensure_connection()
+            for alias in aliases:
+                with sqlite3.connect(connections[alias].settings_dict['NAME']) as target:
+                    # Онлайн-копия: backup API читает согласованный снимок базы
+                    primary.connection.backup(target)
+                target.close()
+            self.stdout.write(
+                f'Реплики обновлены ({", ".join(aliases)}) за {time.perf_counter() - started:.2f} с'
+            )
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchIndexEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64, verbose_name='Терм')),
+                ('weight', models.PositiveIntegerField(default=1, verbose_name='Вес')),
+                ('note', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_entries', to='notes.note', verbose_name='Заметка')),
+            ],
+            options={
+                'verbose_name': 'Запись поискового индекса',
+                'verbose_name_plural': 'Поисковый индекс',
+                'unique_together': {('term', 'note')},
+            },
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:41
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def actual_count(related_model, fk_name):
+    """Подзапрос с числом связанных записей (копия notes.counters.actual_count)"""
+    return Coalesce(
+        Subquery(
+            related_model.objects.filter(**{fk_name: OuterRef('pk')})
+            .order_by()
+            .values(fk_name)
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        Value(0),
+    )
+
+
+def fill_counters(apps, schema_editor):
+    Note, Category, Tag, Comment, NoteTag = (
+        apps.get_model('notes', name) for name in ('Note', 'Category', 'Tag', 'Comment', 'NoteTag')
+    )
+    Note.objects.update(comments_count=actual_count(Comment, 'note'))
+    Category.objects.update(notes_count=actual_count(Note, 'category'))
+    Tag.objects.update(notes_count=actual_count(NoteTag, 'tag'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0002_searchindexentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='notes_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество заметок'),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество комментариев'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='notes_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество заметок'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
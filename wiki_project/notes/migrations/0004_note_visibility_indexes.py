@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0003_counters'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='note',
+            name='notes_note_author__7881a1_idx',
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(condition=models.Q(('is_public', True)), fields=['-created_at', '-id'], name='note_public_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['author', '-created_at', '-id'], name='note_author_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(condition=models.Q(('is_public', True)), fields=['category', '-created_at', '-id'], name='note_category_created_idx'),
+        ),
+    ]
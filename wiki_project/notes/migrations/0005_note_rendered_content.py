@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:13
+
+from django.db import migrations, models
+
+
+# Существующие заметки остаются с rendered_version = 0: HTML заполняет
+# команда rerender_notes текущей разметкой, а до нее — первое открытие заметки
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0004_note_visibility_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='content_html',
+            field=models.TextField(blank=True, editable=False, verbose_name='HTML содержимого'),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='excerpt',
+            field=models.TextField(blank=True, editable=False, verbose_name='Анонс'),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='rendered_version',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Версия разметки'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:18
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import zlib
+
+
+def create_initial_revisions(apps, schema_editor):
+    # Копия notes.revisions.create_initial_revisions: снимок текущего текста
+    # каждой заметки, сжатый zlib
+    Note = apps.get_model('notes', 'Note')
+    NoteRevision = apps.get_model('notes', 'NoteRevision')
+    note_ids = list(Note.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(note_ids), 500):
+        notes = Note.objects.filter(pk__in=note_ids[start:start + 500]).only(
+            'pk', 'author_id', 'title', 'content', 'created_at', 'updated_at',
+        )
+        NoteRevision.objects.bulk_create([
+            NoteRevision(
+                note_id=note.pk,
+                number=1,
+                author_id=note.author_id,
+                created_at=note.updated_at or note.created_at or django.utils.timezone.now(),
+                title=note.title,
+                depth=0,
+                data=zlib.compress(note.content.encode('utf-8'), 6),
+                size=len(note.content),
+            )
+            for note in notes
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notes', '0005_note_rendered_content'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoteRevision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField(verbose_name='Номер')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата')),
+                ('title', models.CharField(max_length=200, verbose_name='Заголовок')),
+                ('depth', models.PositiveSmallIntegerField(default=0, verbose_name='Глубина')),
+                ('data', models.BinaryField(verbose_name='Данные')),
+                ('size', models.PositiveIntegerField(default=0, verbose_name='Длина текста')),
+                ('author', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Автор изменений')),
+                ('note', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revisions', to='notes.note', verbose_name='Заметка')),
+            ],
+            options={
+                'verbose_name': 'Ревизия заметки',
+                'verbose_name_plural': 'Ревизии заметок',
+                'ordering': ['-number'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='noterevision',
+            constraint=models.UniqueConstraint(fields=('note', 'number'), name='note_revision_number_unique'),
+        ),
+        migrations.RunPython(create_initial_revisions, migrations.RunPython.noop),
+    ]
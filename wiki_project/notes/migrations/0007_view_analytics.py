@@ -0,0 +1,83 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0006_note_revisions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyViewStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('note', 'Заметка'), ('category', 'Категория'), ('author', 'Автор')], max_length=10, verbose_name='Разрез')),
+                ('object_id', models.PositiveBigIntegerField(verbose_name='Объект')),
+                ('views', models.PositiveIntegerField(default=0, verbose_name='Просмотров')),
+                ('day', models.DateField(verbose_name='День')),
+            ],
+            options={
+                'verbose_name': 'Просмотры за день',
+                'verbose_name_plural': 'Просмотры по дням',
+            },
+        ),
+        migrations.CreateModel(
+            name='ViewEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('note_id', models.PositiveBigIntegerField(verbose_name='Заметка')),
+                ('day', models.DateField(verbose_name='День')),
+                ('viewed_at', models.DateTimeField(verbose_name='Минута просмотров')),
+                ('views', models.PositiveIntegerField(default=1, verbose_name='Просмотров')),
+            ],
+            options={
+                'verbose_name': 'Событие просмотра',
+                'verbose_name_plural': 'Журнал просмотров',
+                'indexes': [models.Index(fields=['day', 'viewed_at'], name='view_event_day_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TrendingNote',
+            fields=[
+                ('rank', models.PositiveSmallIntegerField(primary_key=True, serialize=False, verbose_name='Место')),
+                ('views', models.PositiveIntegerField(verbose_name='Просмотров')),
+                ('note', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='notes.note', verbose_name='Заметка')),
+            ],
+            options={
+                'verbose_name': 'Популярная заметка',
+                'verbose_name_plural': 'Популярные заметки',
+                'ordering': ['rank'],
+            },
+        ),
+        migrations.CreateModel(
+            name='HourlyViewStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('note', 'Заметка'), ('category', 'Категория'), ('author', 'Автор')], max_length=10, verbose_name='Разрез')),
+                ('object_id', models.PositiveBigIntegerField(verbose_name='Объект')),
+                ('views', models.PositiveIntegerField(default=0, verbose_name='Просмотров')),
+                ('bucket', models.DateTimeField(verbose_name='Час')),
+            ],
+            options={
+                'verbose_name': 'Просмотры за час',
+                'verbose_name_plural': 'Просмотры по часам',
+                'indexes': [models.Index(fields=['bucket', 'dimension'], name='hourly_view_stat_bucket_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='hourlyviewstat',
+            constraint=models.UniqueConstraint(fields=('dimension', 'object_id', 'bucket'), name='hourly_view_stat_unique'),
+        ),
+        migrations.AddIndex(
+            model_name='dailyviewstat',
+            index=models.Index(fields=['day', 'dimension'], name='daily_view_stat_day_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyviewstat',
+            constraint=models.UniqueConstraint(fields=('dimension', 'object_id', 'day'), name='daily_view_stat_unique'),
+        ),
+    ]
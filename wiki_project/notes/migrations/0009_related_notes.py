@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0008_comment_keyset_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedNote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField(verbose_name='Место')),
+                ('score', models.FloatField(verbose_name='Сходство')),
+                ('note', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_notes', to='notes.note', verbose_name='Заметка')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='notes.note', verbose_name='Похожая заметка')),
+            ],
+            options={
+                'verbose_name': 'Похожая заметка',
+                'verbose_name_plural': 'Похожие заметки',
+                'ordering': ['note', 'rank'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='relatednote',
+            constraint=models.UniqueConstraint(fields=('note', 'rank'), name='related_note_rank_unique'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+from collections import defaultdict
+
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def normalize_tag_name(name):
+    # Копия notes.tags.normalize_tag_name на момент миграции
+    return ' '.join(name.split()).lower()[:50].strip()
+
+
+def actual_count(related_model, fk_name):
+    """Подзапрос с числом связанных записей (копия notes.counters.actual_count)"""
+    return Coalesce(
+        Subquery(
+            related_model.objects.filter(**{fk_name: OuterRef('pk')})
+            .order_by()
+            .values(fk_name)
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        Value(0),
+    )
+
+
+def merge_tags(apps, schema_editor):
+    """
+    Сливает теги, имена которых различаются только регистром или пробелами:
+    новые имена всегда нормализуются, и такие дубликаты больше не найти
+    по имени. Остается тег с меньшим id.
+
+    Счетчики пересчитываются для всех тегов, как в ``repair_counters``.
+    Похожие заметки миграция не обновляет: после нее нужен ``rebuild_related``.
+    """
+    Tag = apps.get_model('notes', 'Tag')
+    NoteTag = apps.get_model('notes', 'NoteTag')
+
+    groups = defaultdict(list)
+    for pk, name in Tag.objects.order_by('pk').values_list('pk', 'name'):
+        groups[normalize_tag_name(name)].append((pk, name))
+
+    for name, tags in groups.items():
+        keeper_id, keeper_name = tags[0]
+        duplicate_ids = [pk for pk, _ in tags[1:]]
+        for duplicate_id in duplicate_ids:
+            # Связи переносятся, кроме заметок, у которых уже есть оставшийся тег
+            tagged = NoteTag.objects.filter(tag_id=keeper_id).values('note_id')
+            NoteTag.objects.filter(tag_id=duplicate_id).exclude(note_id__in=tagged).update(tag_id=keeper_id)
+        if duplicate_ids:
+            Tag.objects.filter(pk__in=duplicate_ids).delete()
+        if keeper_name != name:
+            Tag.objects.filter(pk=keeper_id).update(name=name)
+
+    Tag.objects.update(notes_count=actual_count(NoteTag, 'tag'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0009_related_notes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_tags, migrations.RunPython.noop),
+    ]
@@ -1,14 +1,50 @@
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models.query import ValuesIterable
 from django.contrib.auth.models import User
 from django.urls import reverse
 from django.utils import timezone
 
+from .rendering import RENDERED_FIELDS, RENDERER_VERSION, render_note
+
+
+class TrackedModel(models.Model):
+    """
+    Базовая модель для записей, от которых зависят денормализованные счетчики.
+    
+    Сохранение выполняется в транзакции вместе с обработчиками post_save,
+    а значения полей, загруженные из базы, доступны через ``loaded_value``.
+    """
+    
+    class Meta:
+        abstract = True
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+    
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+        self._loaded_values = {
+            field.attname: self.__dict__[field.attname]
+            for field in self._meta.concrete_fields
+            if field.attname in self.__dict__
+        }
+    
+    def loaded_value(self, attname, default=None):
+        """Значение поля на момент загрузки или последнего сохранения"""
+        return getattr(self, '_loaded_values', {}).get(attname, default)
+
 
 class Category(models.Model):
     """Модель категории для организации заметок"""
     name = models.CharField('Название категории', max_length=100, unique=True)
     description = models.TextField('Описание', blank=True)
     created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    notes_count = models.PositiveIntegerField('Количество заметок', default=0)
     
     class Meta:
         verbose_name = 'Категория'
@@ -19,7 +55,86 @@ class Category(models.Model):
         return self.name
 
 
-class Note(models.Model):
+# Поля заметки, которые показываются в карточках списков
+CARD_FIELDS = (
+    'id', 'title', 'excerpt', 'is_public', 'created_at', 'updated_at',
+    'views_count', 'comments_count', 'author_id', 'category_id',
+)
+
+
+class NoteCard:
+    """
+    Строка списка заметок из ``NoteQuerySet.cards``.
+
+    Содержит только поля карточки; автор и категория представлены
+    именами, а не моделями.
+    """
+
+    __slots__ = CARD_FIELDS + ('author_username', 'category_name', 'search_rank')
+
+    def __init__(self, search_rank=None, **values):
+        self.search_rank = search_rank
+        for name, value in values.items():
+            setattr(self, name, value)
+
+    @property
+    def pk(self):
+        return self.id
+
+    def get_absolute_url(self):
+        return reverse('note_detail', kwargs={'pk': self.id})
+
+    def __repr__(self):
+        return f'<NoteCard {self.id}: {self.title}>'
+
+
+class NoteCardIterable(ValuesIterable):
+    """Строки values() в виде NoteCard"""
+
+    def __iter__(self):
+        for row in super().__iter__():
+            yield NoteCard(**row)
+
+
+class NoteQuerySet(models.QuerySet):
+    def visible_to(self, user):
+        """Заметки, доступные пользователю: свои и публичные"""
+        if user.is_authenticated:
+            return self.filter(models.Q(author=user) | models.Q(is_public=True))
+        return self.filter(is_public=True)
+
+    def cards(self):
+        """
+        Проекция для списков: только поля карточки и анонс, без текста
+        заметки и полных строк автора и категории.
+
+        Вызывается последней в цепочке; аннотации, добавленные раньше
+        (например, ``search_rank``), попадают в карточку.
+        """
+        fields = list(CARD_FIELDS)
+        fields.extend(name for name in self.query.annotations if name in NoteCard.__slots__)
+        queryset = self.values(
+            *fields,
+            author_username=models.F('author__username'),
+            category_name=models.F('category__name'),
+        )
+        queryset._iterable_class = NoteCardIterable
+        return queryset
+
+    def visibility_streams(self, user):
+        """
+        Те же заметки, что и ``visible_to``, в виде непересекающихся выборок.
+
+        Каждая выборка читается в порядке ``-created_at`` по своему индексу
+        (``note_author_created_idx`` и частичный ``note_public_created_idx``),
+        тогда как условие с OR не покрывается ни одним индексом.
+        """
+        if user.is_authenticated:
+            return [self.filter(author=user), self.filter(is_public=True).exclude(author=user)]
+        return [self.filter(is_public=True)]
+
+
+class Note(TrackedModel):
     """Основная модель для заметок"""
     title = models.CharField('Заголовок', max_length=200)
     content = models.TextField('Содержание')
@@ -41,6 +156,13 @@ class Note(models.Model):
     updated_at = models.DateTimeField('Дата обновления', auto_now=True)
     is_public = models.BooleanField('Публичная заметка', default=False)
     views_count = models.PositiveIntegerField('Количество просмотров', default=0)
+    comments_count = models.PositiveIntegerField('Количество комментариев', default=0)
+    # Результат rendering.render_note, пересчитывается при изменении текста
+    content_html = models.TextField('HTML содержимого', blank=True, editable=False)
+    excerpt = models.TextField('Анонс', blank=True, editable=False)
+    rendered_version = models.PositiveSmallIntegerField('Версия разметки', default=0, editable=False)
+
+    objects = NoteQuerySet.as_manager()
     
     class Meta:
         verbose_name = 'Заметка'
@@ -48,7 +170,18 @@ class Note(models.Model):
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['-created_at']),
-            models.Index(fields=['author']),
+            # Индексы под ключ курсорной пагинации (-created_at, -id)
+            models.Index(
+                fields=['-created_at', '-id'],
+                condition=models.Q(is_public=True),
+                name='note_public_created_idx',
+            ),
+            models.Index(fields=['author', '-created_at', '-id'], name='note_author_created_idx'),
+            models.Index(
+                fields=['category', '-created_at', '-id'],
+                condition=models.Q(is_public=True),
+                name='note_category_created_idx',
+            ),
         ]
     
     def __str__(self):
@@ -57,15 +190,43 @@ class Note(models.Model):
     def get_absolute_url(self):
         return reverse('note_detail', kwargs={'pk': self.pk})
     
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if (update_fields is None or 'content' in update_fields) and self.needs_render():
+            self.render_content()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, *RENDERED_FIELDS}
+        super().save(*args, **kwargs)
+    
+    def needs_render(self):
+        """Текст изменился с момента загрузки или устарела версия разметки"""
+        return (
+            self.rendered_version != RENDERER_VERSION
+            or self.content != self.loaded_value('content')
+        )
+    
+    def render_content(self):
+        self.content_html, self.excerpt = render_note(self.content, self.author_id)
+        self.rendered_version = RENDERER_VERSION
+    
+    def ensure_rendered(self):
+        """Рендерит при чтении заметку без HTML или с устаревшей версией разметки"""
+        if self.rendered_version == RENDERER_VERSION:
+            return
+        self.render_content()
+        # Без save(): дата изменения и версии кэша остаются прежними
+        Note.objects.filter(pk=self.pk).update(**{field: getattr(self, field) for field in RENDERED_FIELDS})
+    
     def increment_views(self):
-        """Увеличение счетчика просмотров"""
+        """Атомарное увеличение счетчика просмотров"""
+        Note.objects.filter(pk=self.pk).update(views_count=models.F('views_count') + 1)
         self.views_count += 1
-        self.save(update_fields=['views_count'])
 
 
 class Tag(models.Model):
     """Модель тегов для заметок"""
     name = models.CharField('Название тега', max_length=50, unique=True)
+    notes_count = models.PositiveIntegerField('Количество заметок', default=0)
     
     class Meta:
         verbose_name = 'Тег'
@@ -76,7 +237,7 @@ class Tag(models.Model):
         return self.name
 
 
-class NoteTag(models.Model):
+class NoteTag(TrackedModel):
     """Связь между заметками и тегами"""
     note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='note_tags')
     tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='note_tags')
@@ -87,7 +248,7 @@ class NoteTag(models.Model):
         verbose_name_plural = 'Теги заметок'
 
 
-class Comment(models.Model):
+class Comment(TrackedModel):
     """Модель комментариев к заметкам"""
     note = models.ForeignKey(
         Note,
@@ -107,6 +268,180 @@ class Comment(models.Model):
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
         ordering = ['created_at']
+        indexes = [
+            # Ключ курсорной пагинации комментариев заметки
+            models.Index(fields=['note', 'created_at', 'id'], name='comment_note_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f'Комментарий от {self.author.username} к "{self.note.title}"'
+
+
+class SearchIndexEntry(models.Model):
+    """Запись инвертированного поискового индекса: терм → заметка"""
+    term = models.CharField('Терм', max_length=64)
+    note = models.ForeignKey(
+        Note,
+        on_delete=models.CASCADE,
+        related_name='search_entries',
+        verbose_name='Заметка'
+    )
+    weight = models.PositiveIntegerField('Вес', default=1)
+    
+    class Meta:
+        unique_together = ('term', 'note')
+        verbose_name = 'Запись поискового индекса'
+        verbose_name_plural = 'Поисковый индекс'
+    
+    def __str__(self):
+        return f'{self.term} → {self.note_id}'
+
+
+class NoteRevision(models.Model):
+    """Ревизия заметки: снимок или сжатая разница с предыдущей (см. revisions.py)"""
+    note = models.ForeignKey(
+        Note,
+        on_delete=models.CASCADE,
+        related_name='revisions',
+        verbose_name='Заметка'
+    )
+    number = models.PositiveIntegerField('Номер')
+    author = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        verbose_name='Автор изменений'
+    )
+    created_at = models.DateTimeField('Дата', default=timezone.now)
+    title = models.CharField('Заголовок', max_length=200)
+    # 0 — снимок, иначе число разниц от ближайшего снимка
+    depth = models.PositiveSmallIntegerField('Глубина', default=0)
+    data = models.BinaryField('Данные')
+    size = models.PositiveIntegerField('Длина текста', default=0)
+    
+    class Meta:
+        verbose_name = 'Ревизия заметки'
+        verbose_name_plural = 'Ревизии заметок'
+        ordering = ['-number']
+        constraints = [
+            models.UniqueConstraint(fields=['note', 'number'], name='note_revision_number_unique'),
+        ]
+    
+    def __str__(self):
+        return f'{self.note_id} #{self.number}'
+    
+    @property
+    def is_snapshot(self):
+        return self.depth == 0
+
+
+class ViewEvent(models.Model):
+    """
+    Журнал просмотров (только добавление): просмотры заметки за минуту,
+    накопленные одним процессом. Заметка хранится без внешнего ключа,
+    чтобы удаление заметок не затрагивало журнал.
+    """
+    note_id = models.PositiveBigIntegerField('Заметка')
+    # Ключ секционирования: очистка и выборки идут по дням
+    day = models.DateField('День')
+    viewed_at = models.DateTimeField('Минута просмотров')
+    views = models.PositiveIntegerField('Просмотров', default=1)
+    
+    class Meta:
+        verbose_name = 'Событие просмотра'
+        verbose_name_plural = 'Журнал просмотров'
+        indexes = [
+            models.Index(fields=['day', 'viewed_at'], name='view_event_day_idx'),
+        ]
+    
+    def __str__(self):
+        return f'{self.note_id} @ {self.viewed_at:%Y-%m-%d %H:%M}: {self.views}'
+
+
+class ViewStat(models.Model):
+    """Просмотры за период по заметке, категории или автору"""
+    NOTE = 'note'
+    CATEGORY = 'category'
+    AUTHOR = 'author'
+    DIMENSIONS = [
+        (NOTE, 'Заметка'),
+        (CATEGORY, 'Категория'),
+        (AUTHOR, 'Автор'),
+    ]
+    
+    dimension = models.CharField('Разрез', max_length=10, choices=DIMENSIONS)
+    object_id = models.PositiveBigIntegerField('Объект')
+    views = models.PositiveIntegerField('Просмотров', default=0)
+    
+    class Meta:
+        abstract = True
+
+
+class HourlyViewStat(ViewStat):
+    """Почасовая сводка просмотров"""
+    bucket = models.DateTimeField('Час')
+    
+    class Meta:
+        verbose_name = 'Просмотры за час'
+        verbose_name_plural = 'Просмотры по часам'
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'object_id', 'bucket'], name='hourly_view_stat_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['bucket', 'dimension'], name='hourly_view_stat_bucket_idx'),
+        ]
+
+
+class DailyViewStat(ViewStat):
+    """Дневная сводка просмотров"""
+    day = models.DateField('День')
+    
+    class Meta:
+        verbose_name = 'Просмотры за день'
+        verbose_name_plural = 'Просмотры по дням'
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'object_id', 'day'], name='daily_view_stat_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['day', 'dimension'], name='daily_view_stat_day_idx'),
+        ]
+
+
+class TrendingNote(models.Model):
+    """Популярные заметки за последние дни; пересчитываются вместе со сводками"""
+    rank = models.PositiveSmallIntegerField('Место', primary_key=True)
+    note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='+', verbose_name='Заметка')
+    views = models.PositiveIntegerField('Просмотров')
+    
+    class Meta:
+        verbose_name = 'Популярная заметка'
+        verbose_name_plural = 'Популярные заметки'
+        ordering = ['rank']
+    
+    def __str__(self):
+        return f'{self.rank}. {self.note_id}'
+
+
+class RelatedNote(models.Model):
+    """
+    Похожие заметки по общим тегам: до ``RELATED_NOTES_STORED`` соседей на
+    заметку в порядке убывания сходства (см. ``related.py``). Видимость
+    соседей проверяется при чтении.
+    """
+    note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='related_notes', verbose_name='Заметка')
+    rank = models.PositiveSmallIntegerField('Место')
+    related = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='+', verbose_name='Похожая заметка')
+    score = models.FloatField('Сходство')
+    
+    class Meta:
+        verbose_name = 'Похожая заметка'
+        verbose_name_plural = 'Похожие заметки'
+        ordering = ['note', 'rank']
+        constraints = [
+            # Индекс для выборки соседей заметки по порядку
+            models.UniqueConstraint(fields=['note', 'rank'], name='related_note_rank_unique'),
+        ]
     
     def __str__(self):
-        return f'Комментарий от {self.author.username} к "{self.note.title}"'
\ No newline at end of file
+        return f'{self.note_id} -> {self.related_id} ({self.score:.3f})'
@@ -0,0 +1,393 @@
+"""
+Курсорная (keyset) пагинация списков заметок.
+
+Вместо ``OFFSET n`` следующая страница выбирается условием «строго после
+последней показанной записи» по ключу сортировки (по умолчанию
+``(-created_at, -id)``), поэтому глубокие страницы не медленнее первой.
+Позиция передается в непрозрачном токене ``?cursor=...``. Общее число
+записей считается по желанию и кэшируется на ``PAGINATION_COUNT_TIMEOUT``
+секунд.
+
+Список может собираться из нескольких непересекающихся выборок
+(``streams``): каждая читается по своему индексу с тем же условием и
+лимитом, а результаты сливаются по ключу сортировки.
+
+``EstimatedCountPaginator`` — обычный постраничный пагинатор для
+админки, который вместо точного ``COUNT(*)`` по большим таблицам берет
+оценку из статистики базы.
+"""
+import asyncio
+import base64
+import binascii
+import hashlib
+import heapq
+import json
+import math
+from datetime import date, datetime
+from functools import cmp_to_key
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from django.http import Http404
+from django.utils.functional import cached_property
+
+FIRST = 'first'
+LAST = 'last'
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(direction, key=None, number=None):
+    """Упаковка позиции в непрозрачный токен"""
+    values = [value.isoformat() if isinstance(value, (date, datetime)) else value for value in key or ()]
+    payload = json.dumps([direction, values, number], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Распаковка токена; возвращает (направление, ключ, номер страницы)"""
+    if token in (FIRST, LAST):
+        return token, None, None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        direction, key, number = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidCursor(token)
+    if direction not in (NEXT, PREVIOUS) or not isinstance(key, list):
+        raise InvalidCursor(token)
+    return direction, key, number
+
+
+class KeysetPaginator:
+    """Пагинатор по ключу сортировки без OFFSET и обязательного COUNT(*)"""
+
+    def __init__(self, queryset, per_page, ordering=('-created_at', '-id'), count_timeout=None, streams=None):
+        self.queryset = queryset
+        self.streams = streams or [queryset]
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        if count_timeout is None:
+            count_timeout = getattr(settings, 'PAGINATION_COUNT_TIMEOUT', 60)
+        self.count_timeout = count_timeout
+
+    @cached_property
+    def fields(self):
+        """Пары (поле, по убыванию) ключа сортировки"""
+        return [(field.lstrip('-'), field.startswith('-')) for field in self.ordering]
+
+    @cached_property
+    def count(self):
+        """Общее число записей из кэша; None, если подсчет отключен"""
+        if not self.count_timeout:
+            return None
+        # У пустой выборки (queryset.none()) нет SQL для ключа кэша
+        if self.queryset.query.is_empty():
+            return 0
+        return cache.get_or_set(
+            self._count_cache_key(),
+            lambda: self.queryset.order_by().count(),
+            self.count_timeout,
+        )
+
+    def _count_cache_key(self):
+        query_hash = hashlib.md5(str(self.queryset.query).encode()).hexdigest()
+        return f'notes:count:{query_hash}'
+
+    @cached_property
+    def num_pages(self):
+        if self.count is None:
+            return None
+        return max(1, math.ceil(self.count / self.per_page))
+
+    def key(self, obj):
+        """Значения ключа сортировки для записи"""
+        return [getattr(obj, field) for field, _ in self.fields]
+
+    def _seek(self, key, forward):
+        """Условие «строго после ключа» в направлении обхода"""
+        condition = Q()
+        for i, (field, descending) in enumerate(self.fields):
+            lookup = 'lt' if descending == forward else 'gt'
+            step = Q(**{f'{field}__{lookup}': key[i]})
+            for j, (prior, _) in enumerate(self.fields[:i]):
+                step &= Q(**{prior: key[j]})
+            condition |= step
+        return condition
+
+    def _reversed_ordering(self):
+        return [field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering]
+
+    def _merge(self, streams, forward, limit):
+        """Слияние упорядоченных выборок в порядке обхода"""
+        if len(streams) == 1:
+            return streams[0][:limit]
+
+        def compare(a, b):
+            for value_a, value_b, (_, descending) in zip(self.key(a), self.key(b), self.fields):
+                if value_a != value_b:
+                    before = value_a > value_b if descending == forward else value_a < value_b
+                    return -1 if before else 1
+            return 0
+
+        return list(islice(heapq.merge(*streams, key=cmp_to_key(compare)), limit))
+
+    def stream_querysets(self, key=None, forward=True):
+        """Запросы страницы после ключа ``key`` — по одному на выборку"""
+        querysets = []
+        for queryset in self.streams:
+            queryset = queryset.order_by(*(self.ordering if forward else self._reversed_ordering()))
+            if key is not None:
+                queryset = queryset.filter(self._seek(key, forward))
+            querysets.append(queryset[:self.per_page + 1])
+        return querysets
+
+    def _parse_cursor(self, cursor):
+        try:
+            direction, key, number = decode_cursor(cursor) if cursor else (FIRST, None, 1)
+            if key is not None:
+                key = self._clean_key(key)
+        except (InvalidCursor, ValidationError, ValueError, TypeError):
+            raise Http404('Неверный курсор страницы')
+        if number is not None and (type(number) is not int or number < 1):
+            raise Http404('Неверный курсор страницы')
+        return direction, key, number
+
+    def _clean_key(self, key):
+        """Значения ключа из токена, приведенные к типам полей сортировки"""
+        if len(key) != len(self.fields) or None in key:
+            raise InvalidCursor(key)
+        # clean() отвергает неверные типы и значения вне диапазона поля
+        values = [self._key_field(field).clean(value, None) for value, (field, _) in zip(key, self.fields)]
+        # SQLite не ограничивает диапазон полей, но не принимает числа больше 64 бит
+        if any(isinstance(value, int) and not -2 ** 63 <= value < 2 ** 63 for value in values):
+            raise InvalidCursor(key)
+        return values
+
+    def _key_field(self, name):
+        # Ключ может включать аннотацию (например, ранг поиска)
+        annotation = self.queryset.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        return self.queryset.model._meta.get_field(name)
+
+    def page(self, cursor=None):
+        """Страница по токену курсора (None — первая страница)"""
+        direction, key, number = self._parse_cursor(cursor)
+        forward = direction in (FIRST, NEXT)
+        streams = [list(queryset) for queryset in self.stream_querysets(key, forward)]
+        return self._build_page(streams, direction, number)
+
+    async def apage(self, cursor=None):
+        """
+        Асинхронный вариант ``page``: выборки и подсчет запускаются
+        одновременно, число страниц вычисляется заранее для шаблона.
+        """
+        direction, key, number = self._parse_cursor(cursor)
+        forward = direction in (FIRST, NEXT)
+
+        async def fetch(queryset):
+            return [obj async for obj in queryset]
+
+        *streams, _ = await asyncio.gather(
+            *(fetch(queryset) for queryset in self.stream_querysets(key, forward)),
+            self.acount(),
+        )
+        return self._build_page(streams, direction, number)
+
+    async def acount(self):
+        """Асинхронный вариант ``count``"""
+        if 'count' not in self.__dict__:
+            count = None
+            if self.count_timeout and self.queryset.query.is_empty():
+                count = 0
+            elif self.count_timeout:
+                key = self._count_cache_key()
+                count = await cache.aget(key)
+                if count is None:
+                    count = await self.queryset.order_by().acount()
+                    await cache.aset(key, count, self.count_timeout)
+            self.__dict__['count'] = count
+        return self.count
+
+    def _build_page(self, streams, direction, number):
+        forward = direction in (FIRST, NEXT)
+        rows = self._merge(streams, forward, self.per_page + 1)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+
+        if direction == FIRST:
+            number, has_previous, has_next = 1, False, has_more
+        elif direction == LAST:
+            number, has_previous, has_next = self.num_pages, has_more, False
+        elif direction == NEXT:
+            has_previous, has_next = True, has_more
+        else:
+            has_previous, has_next = has_more, True
+        return KeysetPage(rows, self, number, has_previous, has_next)
+
+
+class KeysetPage:
+    """Страница курсорной пагинации с интерфейсом, близким к django Page"""
+
+    def __init__(self, object_list, paginator, number, has_previous, has_next):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.number = number
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    def _neighbour_number(self, step):
+        return self.number + step if self.number is not None else None
+
+    @property
+    def next_cursor(self):
+        if not self._has_next or not self.object_list:
+            return None
+        return encode_cursor(NEXT, self.paginator.key(self.object_list[-1]), self._neighbour_number(1))
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous or not self.object_list:
+            return None
+        return encode_cursor(PREVIOUS, self.paginator.key(self.object_list[0]), self._neighbour_number(-1))
+
+    @property
+    def first_cursor(self):
+        return FIRST
+
+    @property
+    def last_cursor(self):
+        return LAST
+
+
+class KeysetPaginationMixin:
+    """Подключает курсорную пагинацию к ListView"""
+    paginate_by = 10
+    cursor_kwarg = 'cursor'
+    keyset_ordering = ('-created_at', '-id')
+
+    def get_keyset_ordering(self):
+        return self.keyset_ordering
+
+    def get_keyset_streams(self, queryset):
+        """Непересекающиеся выборки, из которых собирается список (None — одна)"""
+        return None
+
+    def get_keyset_paginator(self, queryset, page_size):
+        return KeysetPaginator(
+            queryset, page_size,
+            ordering=self.get_keyset_ordering(),
+            streams=self.get_keyset_streams(queryset),
+        )
+
+    def paginate_queryset(self, queryset, page_size):
+        # Страница, загруженная заранее асинхронным представлением
+        if getattr(self, 'prefetched_page', None):
+            return self.prefetched_page
+        paginator = self.get_keyset_paginator(queryset, page_size)
+        page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    async def apaginate_queryset(self, queryset, page_size):
+        """Асинхронная загрузка страницы; результат вернет ``paginate_queryset``"""
+        paginator = self.get_keyset_paginator(queryset, page_size)
+        page = await paginator.apage(self.request.GET.get(self.cursor_kwarg))
+        self.prefetched_page = paginator, page, page.object_list, page.has_other_pages()
+        return self.prefetched_page
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Параметры текущего запроса (поиск, категория) для ссылок пагинации
+        params = self.request.GET.copy()
+        params.pop(self.cursor_kwarg, None)
+        params.pop('page', None)
+        context['pagination_query'] = params.urlencode()
+        return context
+
+
+def estimate_rows(model, using):
+    """
+    Оценка числа строк таблицы по статистике планировщика (None — нет данных).
+
+    PostgreSQL обновляет ``pg_class.reltuples`` при VACUUM/ANALYZE, SQLite
+    хранит число строк в ``sqlite_stat1`` после ``ANALYZE``.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql, params = 'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table]
+    elif connection.vendor == 'sqlite':
+        sql, params = 'SELECT MAX(CAST(stat AS INTEGER)) FROM sqlite_stat1 WHERE tbl = %s', [table]
+    else:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+    except DatabaseError:
+        # sqlite_stat1 не существует, пока не выполнялся ANALYZE
+        return None
+    estimate = row[0] if row else None
+    # reltuples = -1 у таблиц, которые ещё не анализировались
+    return estimate if estimate is not None and estimate >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор без полного ``COUNT(*)``.
+
+    Без фильтров число строк берется из статистики таблицы, если оно больше
+    ``ADMIN_COUNT_LIMIT``. Иначе строки считаются с пределом: не меньше
+    ``ADMIN_COUNT_LIMIT`` и до следующей страницы после запрошенной
+    (``number``). Если предел достигнут, ``count`` — нижняя граница:
+    последняя из показанных страниц не последняя, и переход на нее
+    сдвигает предел дальше, поэтому любая строка достижима.
+    """
+
+    def __init__(self, *args, number=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        try:
+            self.number = max(int(number), 1)
+        except (TypeError, ValueError):
+            self.number = 1
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        limit = max(getattr(settings, 'ADMIN_COUNT_LIMIT', 10000), (self.number + 1) * self.per_page)
+        if not queryset.query.where:
+            estimate = estimate_rows(queryset.model, queryset.db)
+            if estimate is not None and estimate > limit:
+                return estimate
+        # COUNT по подзапросу с LIMIT останавливается на пороге; лишняя строка
+        # показывает, что за пределом есть еще записи
+        return queryset.order_by()[:limit + 1].count()
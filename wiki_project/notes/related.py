@@ -0,0 +1,287 @@
+"""
+Похожие заметки по общим тегам.
+
+Сходство двух заметок считается по их наборам тегов — коэффициент
+Жаккара (общие теги / все теги двух заметок) или косинусная мера (общие
+теги / корень из произведения размеров), ``RELATED_NOTES_METRIC``. Для
+каждой заметки в таблице ``RelatedNote`` хранятся ``RELATED_NOTES_STORED``
+лучших соседей, страница заметки читает их одним запросом по индексу
+(note, rank) и отбрасывает недоступные пользователю.
+
+* ``rebuild_related`` (команда ``rebuild_related``) пересчитывает таблицу
+  целиком. С NumPy и SciPy пересечения считаются произведением
+  разреженной матрицы «заметка × тег» на транспонированную порциями по
+  ``RELATED_NOTES_CHUNK_SIZE`` строк, без них — по обратному индексу
+  «тег → заметки» на чистом Python. Результаты совпадают.
+* ``schedule_related_update`` после изменения тегов заметки ставит её в
+  фоновую очередь. ``update_related`` пересчитывает соседей заметки одним
+  запросом, добавляет её в списки заметок, которым она теперь подходит, и
+  пересчитывает списки, где она уже была.
+
+Теги, которыми отмечено больше ``RELATED_NOTES_MAX_TAG_NOTES`` заметок, не
+учитываются: они почти ничего не говорят о сходстве, а число пар растет
+квадратично.
+"""
+import heapq
+import math
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .background import BatchWorker
+from .caching import bump_version
+from .models import NoteTag, RelatedNote
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # расчет на чистом Python
+    np = sparse = None
+
+METRICS = ('jaccard', 'cosine')
+
+
+def setting(name, default):
+    return getattr(settings, name, default)
+
+
+def similarity(shared, size, other_size, metric):
+    if metric == 'cosine':
+        return shared / math.sqrt(size * other_size)
+    return shared / (size + other_size - shared)
+
+
+def rank_key(item):
+    # По убыванию сходства, при равенстве — сначала более новые заметки
+    related_id, score = item
+    return -score, -related_id
+
+
+def top_neighbors(scores, limit):
+    """Лучшие ``limit`` пар (id, сходство) из словаря {id: сходство}"""
+    return heapq.nsmallest(limit, scores.items(), key=rank_key)
+
+
+def counted_links():
+    """Связи заметка–тег без слишком частых тегов"""
+    return NoteTag.objects.filter(tag__notes_count__lte=setting('RELATED_NOTES_MAX_TAG_NOTES', 2000))
+
+
+def related_rows(note_id, neighbors):
+    return [
+        RelatedNote(note_id=note_id, rank=rank, related_id=related_id, score=score)
+        for rank, (related_id, score) in enumerate(neighbors, 1)
+    ]
+
+
+# --- Полный пересчет ------------------------------------------------------
+
+def neighbors_numpy(links, metric, limit, chunk_size):
+    """Пары (заметка, соседи) через разреженную матрицу инцидентности"""
+    pairs = np.fromiter(
+        (value for link in links for value in link), dtype=np.int64,
+    ).reshape(-1, 2)
+    if not len(pairs):
+        return
+    note_ids, rows = np.unique(pairs[:, 0], return_inverse=True)
+    _, columns = np.unique(pairs[:, 1], return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(pairs), dtype=np.int32), (rows, columns)),
+        shape=(len(note_ids), columns.max() + 1),
+    )
+    sizes = np.diff(matrix.indptr).astype(np.float64)
+    transposed = matrix.T.tocsc()
+
+    for start in range(0, len(note_ids), chunk_size):
+        # Число общих тегов строк порции со всеми заметками
+        shared = (matrix[start:start + chunk_size] @ transposed).tocsr()
+        for offset in range(shared.shape[0]):
+            row = start + offset
+            begin, end = shared.indptr[offset], shared.indptr[offset + 1]
+            others = shared.indices[begin:end]
+            counts = shared.data[begin:end].astype(np.float64)
+            keep = others != row
+            others, counts = others[keep], counts[keep]
+            if metric == 'cosine':
+                scores = counts / np.sqrt(sizes[row] * sizes[others])
+            else:
+                scores = counts / (sizes[row] + sizes[others] - counts)
+            related = note_ids[others]
+            order = np.lexsort((-related, -scores))[:limit]
+            yield int(note_ids[row]), list(zip(related[order].tolist(), scores[order].tolist()))
+
+
+def neighbors_python(links, metric, limit):
+    """Пары (заметка, соседи) через обратный индекс «тег → заметки»"""
+    note_tags, tag_notes = defaultdict(list), defaultdict(list)
+    for note_id, tag_id in links:
+        note_tags[note_id].append(tag_id)
+        tag_notes[tag_id].append(note_id)
+    for note_id in sorted(note_tags):
+        shared = defaultdict(int)
+        for tag_id in note_tags[note_id]:
+            for other_id in tag_notes[tag_id]:
+                shared[other_id] += 1
+        del shared[note_id]
+        size = len(note_tags[note_id])
+        scores = {
+            other_id: similarity(count, size, len(note_tags[other_id]), metric)
+            for other_id, count in shared.items()
+        }
+        yield note_id, top_neighbors(scores, limit)
+
+
+def rebuild_related(metric=None, engine=None, batch_size=1000):
+    """
+    Пересчитывает таблицу похожих заметок целиком.
+
+    ``engine`` — ``numpy`` или ``python``; по умолчанию NumPy, если он
+    установлен. Возвращает словарь с числом заметок и строк и движком.
+    """
+    metric = metric or setting('RELATED_NOTES_METRIC', 'jaccard')
+    limit = setting('RELATED_NOTES_STORED', 10)
+    engine = engine or ('numpy' if np is not None else 'python')
+    links = counted_links().values_list('note_id', 'tag_id').iterator(chunk_size=10000)
+    if engine == 'numpy':
+        neighbors = neighbors_numpy(links, metric, limit, setting('RELATED_NOTES_CHUNK_SIZE', 2000))
+    else:
+        neighbors = neighbors_python(links, metric, limit)
+
+    notes = rows = 0
+    with transaction.atomic():
+        RelatedNote.objects.all().delete()
+        batch = []
+        for note_id, note_neighbors in neighbors:
+            notes += 1
+            batch.extend(related_rows(note_id, note_neighbors))
+            if len(batch) >= batch_size:
+                RelatedNote.objects.bulk_create(batch)
+                rows += len(batch)
+                batch = []
+        RelatedNote.objects.bulk_create(batch)
+        rows += len(batch)
+    bump_version('related')
+    return {'notes': notes, 'rows': rows, 'engine': engine}
+
+
+# --- Инкрементальное обновление -------------------------------------------
+
+def note_scores(note_id, metric):
+    """Сходство заметки со всеми заметками, у которых есть общие теги"""
+    links = counted_links()
+    tag_ids = links.filter(note_id=note_id).values('tag_id')
+    # Заметки с общими тегами: число всех их тегов и число общих
+    rows = (
+        links.filter(note_id__in=links.filter(tag_id__in=tag_ids).values('note_id'))
+        .values('note_id')
+        .annotate(size=Count('tag_id'), shared=Count('tag_id', filter=Q(tag_id__in=tag_ids)))
+        .values_list('note_id', 'size', 'shared')
+    )
+    sizes, shared = {}, {}
+    for other_id, size, count in rows:
+        sizes[other_id], shared[other_id] = size, count
+    size = sizes.pop(note_id, 0)
+    shared.pop(note_id, None)
+    return {
+        other_id: similarity(count, size, sizes[other_id], metric)
+        for other_id, count in shared.items()
+    }
+
+
+def stored_neighbors(note_ids):
+    """Сохраненные соседи {заметка: [(id, сходство), ...]} по порядку"""
+    stored = defaultdict(list)
+    rows = RelatedNote.objects.filter(note_id__in=note_ids).order_by('note_id', 'rank')
+    for note_id, related_id, score in rows.values_list('note_id', 'related_id', 'score'):
+        stored[note_id].append((related_id, score))
+    return stored
+
+
+def update_related(note_ids):
+    """
+    Обновляет похожие заметки после изменения тегов ``note_ids``.
+
+    Списки самих заметок и списки, где они были, пересчитываются
+    полностью, в остальные списки заметка добавляется, если теперь
+    проходит в них по сходству. Возвращает число измененных списков.
+    """
+    metric = setting('RELATED_NOTES_METRIC', 'jaccard')
+    limit = setting('RELATED_NOTES_STORED', 10)
+    note_ids = set(note_ids)
+    changed = {}
+
+    scores = {note_id: note_scores(note_id, metric) for note_id in note_ids}
+    listing = set(
+        RelatedNote.objects.filter(related_id__in=note_ids).values_list('note_id', flat=True)
+    ) - note_ids
+    for note_id in note_ids | listing:
+        changed[note_id] = top_neighbors(
+            scores[note_id] if note_id in note_ids else note_scores(note_id, metric), limit,
+        )
+
+    candidates = {other_id for note_scores_ in scores.values() for other_id in note_scores_}
+    candidates -= note_ids | listing
+    stored = stored_neighbors(candidates)
+    for other_id in candidates:
+        current = stored.get(other_id, [])
+        merged = dict(current)
+        merged.update(
+            (note_id, scores[note_id][other_id]) for note_id in note_ids if other_id in scores[note_id]
+        )
+        neighbors = top_neighbors(merged, limit)
+        if neighbors != current:
+            changed[other_id] = neighbors
+
+    if changed:
+        with transaction.atomic():
+            RelatedNote.objects.filter(note_id__in=changed).delete()
+            RelatedNote.objects.bulk_create(
+                [row for note_id, neighbors in changed.items() for row in related_rows(note_id, neighbors)],
+                batch_size=1000,
+            )
+        bump_version('related')
+    return len(changed)
+
+
+related_queue = BatchWorker(
+    update_related,
+    batch_size=getattr(settings, 'RELATED_NOTES_BATCH_SIZE', 50),
+    interval=getattr(settings, 'RELATED_NOTES_INTERVAL', 2.0),
+    name='related-notes',
+)
+
+
+def schedule_related_update(note_ids):
+    """
+    Ставит заметки с измененными тегами в очередь после фиксации транзакции.
+
+    При ``RELATED_NOTES_ASYNC = False`` список обновляется сразу после
+    коммита в текущем потоке.
+    """
+    note_ids = list(note_ids)
+    if not note_ids:
+        return
+    if getattr(settings, 'RELATED_NOTES_ASYNC', True):
+        transaction.on_commit(lambda: related_queue.submit(note_ids))
+    else:
+        transaction.on_commit(lambda: update_related(note_ids))
+
+
+# --- Чтение ---------------------------------------------------------------
+
+def related_notes(note, user, limit=None):
+    """
+    Похожие заметки, доступные пользователю: один запрос по индексу
+    (note, rank) с присоединением заметок-соседей.
+    """
+    visible = Q(related__is_public=True)
+    if user.is_authenticated:
+        visible |= Q(related__author=user)
+    return (
+        RelatedNote.objects.filter(visible, note=note)
+        .select_related('related')
+        .only('rank', 'score', 'related__title', 'related__is_public')
+        .order_by('rank')[:limit or setting('RELATED_NOTES_COUNT', 5)]
+    )
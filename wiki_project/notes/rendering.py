@@ -0,0 +1,260 @@
+"""
+Преобразование текста заметок в HTML.
+
+Поддерживается подмножество Markdown: заголовки (``#``), абзацы с
+переносами строк, списки, цитаты, горизонтальная линия, блоки кода
+(```` ``` ````), встроенный код, **полужирный**, *курсив*, ссылки
+``[текст](url)`` и вики-ссылки на другие заметки ``[[Заголовок]]`` или
+``[[Заголовок|текст]]``.
+
+Весь пользовательский текст экранируется до разметки, поэтому результат
+безопасен для вывода без дополнительной очистки. HTML и анонс заметки
+вычисляются при сохранении (см. ``Note.save``) и хранятся в модели;
+``RENDERER_VERSION`` увеличивается при изменении правил разметки, после
+чего команда ``rerender_notes`` обновляет сохраненные значения.
+"""
+import re
+
+from django.db.models import Q
+from django.urls import NoReverseMatch, reverse
+from django.utils.html import escape
+
+RENDERER_VERSION = 1
+RENDERED_FIELDS = ('content_html', 'excerpt', 'rendered_version')
+
+EXCERPT_WORDS = 30
+# Для анонса просматривается только начало текста
+EXCERPT_SCAN_CHARS = 2000
+
+FENCE = re.compile(r'^\s*```\s*([\w+#.-]*)\s*$')
+HEADING = re.compile(r'^(#{1,6})\s+(.+?)\s*#*\s*$')
+RULE = re.compile(r'^\s*(?:-{3,}|\*{3,}|_{3,})\s*$')
+QUOTE = re.compile(r'^\s*>\s?(.*)$')
+UNORDERED_ITEM = re.compile(r'^\s*[-*+]\s+(.*)$')
+ORDERED_ITEM = re.compile(r'^\s*\d+[.)]\s+(.*)$')
+
+CODE_SPAN = re.compile(r'(`[^`\n]+`)')
+WIKI_LINK = re.compile(r'\[\[([^\[\]|\n]+)(?:\|([^\[\]\n]+))?\]\]')
+LINK = re.compile(r'\[([^\[\]\n]+)\]\(([^()\s]+)\)')
+STRONG = re.compile(r'\*\*(?=\S)(.+?)(?<=\S)\*\*')
+EMPHASIS = re.compile(r'(?<![*\w])\*(?=[^\s*])(.+?)(?<=[^\s*])\*(?![*\w])')
+PLACEHOLDER = re.compile('\x00(\\d+)\x00')
+
+SAFE_URL_PREFIXES = ('http://', 'https://', 'mailto:', '/', '#')
+
+
+def normalize_title(title):
+    return ' '.join(title.split())
+
+
+def wiki_link_titles(text):
+    """Заголовки заметок, на которые ссылается текст"""
+    return {normalize_title(match.group(1)) for match in WIKI_LINK.finditer(text)}
+
+
+def resolve_wiki_links(titles, author_id=None, note_model=None):
+    """
+    {заголовок: id заметки} среди публичных заметок и заметок автора
+    ``author_id``: чужие личные заметки не должны выдавать себя ссылкой.
+    При совпадении заголовков — публичная и более ранняя.
+    """
+    return resolve_wiki_links_by_author(titles, [author_id], note_model)[author_id]
+
+
+def resolve_wiki_links_by_author(titles, author_ids, note_model=None):
+    """``resolve_wiki_links`` для нескольких авторов одним запросом: {автор: ссылки}"""
+    resolved = {author_id: {} for author_id in author_ids}
+    if not titles:
+        return resolved
+    if note_model is None:
+        from .models import Note as note_model
+    owners = [author_id for author_id in author_ids if author_id is not None]
+    rows = (
+        note_model.objects.filter(title__in=titles)
+        .filter(Q(is_public=True) | Q(author_id__in=owners))
+        .order_by('-is_public', 'pk')
+        .values_list('title', 'pk', 'author_id', 'is_public')
+    )
+    for title, pk, owner_id, is_public in rows:
+        for author_id, links in resolved.items():
+            if is_public or owner_id == author_id:
+                links.setdefault(title, pk)
+    return resolved
+
+
+class Renderer:
+    """Однопроходный преобразователь; ``links`` — результат ``resolve_wiki_links``"""
+
+    def __init__(self, links=None):
+        self.links = links or {}
+
+    def render(self, text):
+        # Нулевой символ служит меткой фрагментов в formatted()
+        text = text.replace('\x00', '')
+        lines = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+        return '\n'.join(self.blocks(lines))
+
+    def blocks(self, lines):
+        paragraph = []
+        i = 0
+        while i < len(lines):
+            line = lines[i]
+            fence = FENCE.match(line)
+            heading = HEADING.match(line)
+            starts_block = (
+                fence or heading or RULE.match(line) or QUOTE.match(line)
+                or UNORDERED_ITEM.match(line) or ORDERED_ITEM.match(line)
+            )
+            if paragraph and (not line.strip() or starts_block):
+                yield self.paragraph(paragraph)
+                paragraph = []
+
+            if fence:
+                code = []
+                i += 1
+                while i < len(lines) and not FENCE.match(lines[i]):
+                    code.append(lines[i])
+                    i += 1
+                language = f' class="language-{escape(fence.group(1))}"' if fence.group(1) else ''
+                yield f'<pre><code{language}>{escape(chr(10).join(code))}</code></pre>'
+            elif heading:
+                level = min(len(heading.group(1)) + 1, 6)  # h1 — заголовок заметки
+                yield f'<h{level}>{self.inline(heading.group(2))}</h{level}>'
+            elif RULE.match(line):
+                yield '<hr>'
+            elif QUOTE.match(line):
+                quoted = []
+                while i < len(lines) and QUOTE.match(lines[i]):
+                    quoted.append(QUOTE.match(lines[i]).group(1))
+                    i += 1
+                yield '<blockquote>' + '\n'.join(self.blocks(quoted)) + '</blockquote>'
+                continue
+            elif UNORDERED_ITEM.match(line) or ORDERED_ITEM.match(line):
+                pattern, tag = (UNORDERED_ITEM, 'ul') if UNORDERED_ITEM.match(line) else (ORDERED_ITEM, 'ol')
+                items = []
+                while i < len(lines) and pattern.match(lines[i]):
+                    items.append(f'<li>{self.inline(pattern.match(lines[i]).group(1))}</li>')
+                    i += 1
+                yield f'<{tag}>' + ''.join(items) + f'</{tag}>'
+                continue
+            elif line.strip():
+                paragraph.append(line.strip())
+            i += 1
+        if paragraph:
+            yield self.paragraph(paragraph)
+
+    def paragraph(self, lines):
+        # Переносы строк внутри абзаца сохраняются, как раньше в linebreaks
+        return '<p>' + '<br>'.join(self.inline(line) for line in lines) + '</p>'
+
+    def inline(self, text):
+        parts = []
+        for chunk in CODE_SPAN.split(text):
+            if chunk.startswith('`') and chunk.endswith('`') and len(chunk) > 1:
+                parts.append(f'<code>{escape(chunk[1:-1])}</code>')
+            else:
+                parts.append(self.formatted(chunk))
+        return ''.join(parts)
+
+    def formatted(self, text):
+        # Готовые фрагменты HTML заменяются метками, чтобы их не задело выделение
+        fragments = []
+
+        def keep(html):
+            fragments.append(html)
+            return f'\x00{len(fragments) - 1}\x00'
+
+        text = WIKI_LINK.sub(lambda match: keep(self.wiki_link(match)), text)
+        text = LINK.sub(lambda match: keep(self.link(match)), text)
+        text = escape(text)
+        text = STRONG.sub(r'<strong>\1</strong>', text)
+        text = EMPHASIS.sub(r'<em>\1</em>', text)
+        return PLACEHOLDER.sub(lambda match: fragments[int(match.group(1))], text)
+
+    def wiki_link(self, match):
+        title = normalize_title(match.group(1))
+        label = escape((match.group(2) or match.group(1)).strip())
+        pk = self.links.get(title)
+        if pk is None:
+            return f'<span class="wiki-link-missing" title="Заметка не найдена">{label}</span>'
+        try:
+            url = reverse('note_detail', kwargs={'pk': pk})
+        except NoReverseMatch:
+            return label
+        return f'<a class="wiki-link" href="{escape(url)}">{label}</a>'
+
+    def link(self, match):
+        label, url = match.group(1), match.group(2)
+        if not url.lower().startswith(SAFE_URL_PREFIXES):
+            return escape(match.group(0))
+        rel = ' rel="nofollow noopener"' if url.lower().startswith(('http://', 'https://')) else ''
+        return f'<a href="{escape(url)}"{rel}>{escape(label)}</a>'
+
+
+def render_markdown(text, author_id=None, note_model=None):
+    """HTML для текста заметки автора ``author_id``"""
+    links = resolve_wiki_links(wiki_link_titles(text), author_id, note_model)
+    return Renderer(links).render(text)
+
+
+STRIP_FOR_EXCERPT = [
+    (re.compile(r'^\s*```.*$', re.MULTILINE), ''),
+    (re.compile(r'^\s*(?:#{1,6}|>|[-*+]|\d+[.)])\s+', re.MULTILINE), ''),
+    (WIKI_LINK, lambda match: match.group(2) or match.group(1)),
+    (LINK, r'\1'),
+    (re.compile(r'[*`]+'), ''),
+]
+
+
+def make_excerpt(text, words=EXCERPT_WORDS):
+    """Анонс: первые ``words`` слов текста без разметки"""
+    head = text[:EXCERPT_SCAN_CHARS]
+    for pattern, replacement in STRIP_FOR_EXCERPT:
+        head = pattern.sub(replacement, head)
+    tokens = head.split()
+    truncated = len(tokens) > words or len(text) > EXCERPT_SCAN_CHARS
+    excerpt = ' '.join(tokens[:words])
+    return excerpt + ' …' if truncated and excerpt else excerpt
+
+
+def render_note(content, author_id=None, note_model=None, links=None):
+    """
+    Пара (HTML, анонс) для сохранения в заметке автора ``author_id``.
+
+    ``links`` — заранее найденные вики-ссылки (при массовой обработке).
+    """
+    if links is None:
+        html = render_markdown(content, author_id, note_model)
+    else:
+        html = Renderer(links).render(content)
+    return html, make_excerpt(content)
+
+
+def rerender_notes(force=False, chunk_size=500, note_model=None, progress=None):
+    """
+    Пересчитывает сохраненный HTML и анонсы пачками.
+
+    По умолчанию обрабатываются только заметки с устаревшей версией
+    разметки; ``force`` — все (например, чтобы обновить вики-ссылки на
+    заметки, созданные позже). Возвращает число обновленных заметок.
+    """
+    if note_model is None:
+        from .models import Note as note_model
+    queryset = note_model.objects.all()
+    if not force:
+        queryset = queryset.exclude(rendered_version=RENDERER_VERSION)
+    note_ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+
+    for start in range(0, len(note_ids), chunk_size):
+        notes = list(
+            note_model.objects.filter(pk__in=note_ids[start:start + chunk_size]).only('pk', 'author_id', 'content')
+        )
+        titles = set().union(*(wiki_link_titles(note.content) for note in notes))
+        links = resolve_wiki_links_by_author(titles, {note.author_id for note in notes}, note_model)
+        for note in notes:
+            note.content_html, note.excerpt = render_note(note.content, links=links[note.author_id])
+            note.rendered_version = RENDERER_VERSION
+        note_model.objects.bulk_update(notes, RENDERED_FIELDS)
+        if progress:
+            progress(min(start + chunk_size, len(note_ids)))
+    return len(note_ids)
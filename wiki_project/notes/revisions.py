@@ -0,0 +1,255 @@
+"""
+История изменений заметок.
+
+Каждое сохранение заметки с новым текстом или заголовком добавляет
+ревизию. Ревизия хранит либо полный текст (снимок), либо разницу по
+строкам с предыдущей ревизией; и то, и другое сжимается zlib. Снимок
+делается через каждые ``REVISION_SNAPSHOT_INTERVAL`` ревизий, а также
+когда разница получается не меньше самого текста, поэтому восстановление
+любой ревизии — это один снимок и не больше ``K - 1`` разниц.
+
+Цепочки, ставшие длиннее интервала (например, после его уменьшения),
+перестраивает команда ``compact_revisions``.
+"""
+import difflib
+import json
+import zlib
+
+from django.conf import settings
+from django.db import router, transaction
+from django.utils import timezone
+
+# Поля заметки, изменение которых создает новую ревизию
+REVISION_FIELDS = {'title', 'content'}
+
+COMPRESSION_LEVEL = 6
+DIFF_CONTEXT_LINES = 3
+
+
+def snapshot_interval():
+    return max(1, getattr(settings, 'REVISION_SNAPSHOT_INTERVAL', 20))
+
+
+def compress_text(text):
+    return zlib.compress(text.encode('utf-8'), COMPRESSION_LEVEL)
+
+
+def decompress_text(data):
+    return zlib.decompress(data).decode('utf-8')
+
+
+def make_delta(old, new):
+    """
+    Сжатая разница между текстами.
+
+    Операции — пары ``[начало, конец]`` (строки, взятые из старого текста)
+    и строки (новый текст); удаленные строки просто не упоминаются.
+    """
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    operations = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            operations.append([i1, i2])
+        elif tag in ('replace', 'insert'):
+            operations.append(''.join(new_lines[j1:j2]))
+    payload = json.dumps(operations, ensure_ascii=False, separators=(',', ':'))
+    return zlib.compress(payload.encode('utf-8'), COMPRESSION_LEVEL)
+
+
+def apply_delta(old, data):
+    old_lines = old.splitlines(keepends=True)
+    parts = []
+    for operation in json.loads(zlib.decompress(data)):
+        if isinstance(operation, str):
+            parts.append(operation)
+        else:
+            parts.extend(old_lines[operation[0]:operation[1]])
+    return ''.join(parts)
+
+
+def encode_revision(previous_text, text, previous_depth, interval=None):
+    """
+    Пара (глубина, данные) для новой ревизии.
+
+    ``previous_text`` и ``previous_depth`` — текст и глубина предыдущей
+    ревизии (None для первой); глубина 0 означает снимок.
+    """
+    interval = interval or snapshot_interval()
+    snapshot = compress_text(text)
+    if previous_text is None or previous_depth + 1 >= interval:
+        return 0, snapshot
+    delta = make_delta(previous_text, text)
+    # Сильно переписанный текст дешевле хранить целиком
+    if len(delta) >= len(snapshot):
+        return 0, snapshot
+    return previous_depth + 1, delta
+
+
+def revision_text(revision, revision_model=None):
+    """Текст ревизии: ближайший снимок и разницы после него (одним запросом)"""
+    if revision.depth == 0:
+        return decompress_text(revision.data)
+    if revision_model is None:
+        revision_model = type(revision)
+    chain = (
+        revision_model.objects
+        .filter(
+            note_id=revision.note_id,
+            number__gte=revision.number - revision.depth,
+            number__lt=revision.number,
+        )
+        .order_by('number')
+        .values_list('depth', 'data')
+    )
+    text = None
+    for depth, data in chain:
+        text = decompress_text(data) if depth == 0 else apply_delta(text, data)
+    return apply_delta(text, revision.data)
+
+
+def record_revision(note, author=None, revision_model=None):
+    """
+    Добавляет ревизию с текущими заголовком и текстом заметки.
+
+    Возвращает новую ревизию или None, если они не изменились с
+    последней ревизии.
+    """
+    if revision_model is None:
+        from .models import NoteRevision as revision_model
+    using = router.db_for_write(revision_model)
+    note_model = revision_model._meta.get_field('note').related_model
+    with transaction.atomic(using=using):
+        # Строка заметки блокируется до конца транзакции, чтобы параллельные
+        # правки не взяли один и тот же следующий номер
+        list(note_model.objects.using(using).select_for_update().filter(pk=note.pk).values_list('pk'))
+        latest = revision_model.objects.using(using).filter(note_id=note.pk).order_by('-number').first()
+        previous_text = None
+        if latest is not None:
+            previous_text = revision_text(latest)
+            if previous_text == note.content and latest.title == note.title:
+                return None
+        depth, data = encode_revision(previous_text, note.content, latest.depth if latest else 0)
+        return revision_model.objects.using(using).create(
+            note_id=note.pk,
+            number=latest.number + 1 if latest else 1,
+            author_id=getattr(author, 'pk', author),
+            title=note.title,
+            depth=depth,
+            data=data,
+            size=len(note.content),
+        )
+
+
+def initial_revision(note, revision_model=None):
+    """Первая ревизия (снимок) для заметки, созданной без save(), например bulk_create"""
+    if revision_model is None:
+        from .models import NoteRevision as revision_model
+    return revision_model(
+        note_id=note.pk,
+        number=1,
+        author_id=note.author_id,
+        created_at=note.updated_at or note.created_at or timezone.now(),
+        title=note.title,
+        depth=0,
+        data=compress_text(note.content),
+        size=len(note.content),
+    )
+
+
+def create_initial_revisions(note_model=None, revision_model=None, chunk_size=500):
+    """Снимки для заметок, у которых еще нет ревизий; возвращает их число"""
+    if note_model is None:
+        from .models import Note as note_model
+    if revision_model is None:
+        from .models import NoteRevision as revision_model
+    note_ids = list(
+        note_model.objects.filter(revisions__isnull=True).order_by('pk').values_list('pk', flat=True)
+    )
+    for start in range(0, len(note_ids), chunk_size):
+        notes = note_model.objects.filter(pk__in=note_ids[start:start + chunk_size]).only(
+            'pk', 'author_id', 'title', 'content', 'created_at', 'updated_at',
+        )
+        revision_model.objects.bulk_create([initial_revision(note, revision_model) for note in notes])
+    return len(note_ids)
+
+
+def compact_note_revisions(note_id, interval=None, revision_model=None):
+    """
+    Перестраивает цепочки ревизий заметки под интервал снимков.
+
+    Разницы всегда считаются от предыдущей ревизии, поэтому данные
+    пересчитываются только у ревизий, которые становятся снимками или
+    перестают ими быть; у остальных меняется глубина. Возвращает число
+    измененных ревизий.
+    """
+    if revision_model is None:
+        from .models import NoteRevision as revision_model
+    interval = interval or snapshot_interval()
+    changed = []
+    with transaction.atomic(using=router.db_for_write(revision_model)):
+        revisions = revision_model.objects.filter(note_id=note_id).order_by('number').only(
+            'pk', 'number', 'depth', 'data',
+        )
+        previous_text, previous_depth = None, 0
+        for revision in revisions.iterator(chunk_size=200):
+            if revision.depth == 0:
+                text = decompress_text(revision.data)
+            else:
+                text = apply_delta(previous_text, revision.data)
+            if previous_text is None or previous_depth + 1 >= interval:
+                depth = 0
+            elif revision.depth == 0:
+                # Снимок посреди цепочки: разница может оказаться меньше
+                depth, _ = encode_revision(previous_text, text, previous_depth, interval)
+            else:
+                depth = previous_depth + 1
+            if depth != revision.depth:
+                # Данные пересчитываются, только если ревизия стала снимком или перестала им быть
+                if depth == 0:
+                    revision.data = compress_text(text)
+                elif revision.depth == 0:
+                    revision.data = make_delta(previous_text, text)
+                revision.depth = depth
+                changed.append(revision)
+            previous_text, previous_depth = text, depth
+        revision_model.objects.bulk_update(changed, ['depth', 'data'], batch_size=200)
+    return len(changed)
+
+
+def compact_revisions(interval=None, rebalance=False, revision_model=None, progress=None):
+    """
+    Перестраивает цепочки ревизий, ставшие длиннее интервала.
+
+    ``rebalance`` — обработать все заметки, в том числе заменить лишние
+    снимки разницами после увеличения интервала. Возвращает пару
+    (число заметок, число перезаписанных ревизий).
+    """
+    if revision_model is None:
+        from .models import NoteRevision as revision_model
+    interval = interval or snapshot_interval()
+    revisions = revision_model.objects.all()
+    if not rebalance:
+        revisions = revisions.filter(depth__gte=interval)
+    note_ids = list(revisions.order_by('note_id').values_list('note_id', flat=True).distinct())
+    rewritten = 0
+    for done, note_id in enumerate(note_ids, 1):
+        rewritten += compact_note_revisions(note_id, interval, revision_model)
+        if progress:
+            progress(done)
+    return len(note_ids), rewritten
+
+
+def diff_lines(old, new, context=DIFF_CONTEXT_LINES):
+    """
+    Построчная разница для шаблона: пары (вид, строка), где вид —
+    ``hunk``, ``added``, ``removed`` или ``context``.
+    """
+    lines = difflib.unified_diff(old.splitlines(), new.splitlines(), n=context, lineterm='')
+    kinds = {'@': 'hunk', '+': 'added', '-': 'removed', ' ': 'context'}
+    # Первые две строки — заголовки «--- / +++»
+    return [
+        (kinds[line[0]], line if line[0] == '@' else line[1:])
+        for line in list(lines)[2:]
+    ]
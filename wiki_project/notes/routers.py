@@ -0,0 +1,121 @@
+"""
+Маршрутизация запросов между основной базой и репликами.
+
+Записи всегда идут в ``default``. Чтение уходит на реплику
+(``DATABASE_REPLICAS``) только внутри HTTP-запроса, который это
+разрешает: безопасный метод (GET, HEAD) и отсутствие «привязки» к
+основной базе. Фоновые потоки, команды и миграции читают из основной
+базы — им нужны актуальные данные.
+
+После изменяющего запроса (POST и т.п.) пользователь получает cookie,
+и в течение ``REPLICA_PIN_SECONDS`` секунд все его запросы читают из
+основной базы: так он видит свои изменения, даже если реплика отстает.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE_NAME = 'wiki_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_replica_allowed = ContextVar('replica_allowed', default=False)
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+@contextmanager
+def use_primary():
+    """Все чтения внутри блока идут в основную базу"""
+    token = _replica_allowed.set(False)
+    try:
+        yield
+    finally:
+        _replica_allowed.reset(token)
+
+
+@contextmanager
+def allow_replica_reads():
+    token = _replica_allowed.set(True)
+    try:
+        yield
+    finally:
+        _replica_allowed.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """Чтение с реплик (если разрешено), запись и миграции — в основную базу"""
+
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if not aliases or not _replica_allowed.get():
+            return DEFAULT_DB_ALIAS
+        # Внутри транзакции читаем то, что в ней же записано
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная база
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replicas()
+
+
+class ReplicaPinningMiddleware:
+    """
+    Разрешает чтение с реплик для безопасных запросов и привязывает
+    пользователя к основной базе после изменяющих.
+
+    Должен стоять до SessionMiddleware и AuthenticationMiddleware, чтобы
+    их запросы тоже маршрутизировались.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if self.pinned(request):
+            response = self.get_response(request)
+        else:
+            with allow_replica_reads():
+                response = self.get_response(request)
+        return self.process_response(request, response)
+
+    async def __acall__(self, request):
+        # Контекстная переменная переходит в sync_to_async вместе с контекстом
+        if self.pinned(request):
+            response = await self.get_response(request)
+        else:
+            with allow_replica_reads():
+                response = await self.get_response(request)
+        return self.process_response(request, response)
+
+    def pinned(self, request):
+        return request.method not in SAFE_METHODS or PIN_COOKIE_NAME in request.COOKIES
+
+    def process_response(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400 and replicas():
+            response.set_cookie(
+                PIN_COOKIE_NAME, '1',
+                max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 10),
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
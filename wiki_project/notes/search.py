@@ -0,0 +1,456 @@
+"""
+Полнотекстовый поиск по заметкам на основе инвертированного индекса.
+
+Текст заметки (заголовок, теги, содержание, комментарии) разбивается на
+токены, приводится к основам слов (русский и английский) и сохраняется в
+таблице ``SearchIndexEntry`` в виде пар «терм → заметка» с весом.
+Поиск выбирает заметки, содержащие все термы запроса, и сортирует их по
+сумме весов.
+
+Изменения заметок, тегов и комментариев попадают в индекс инкрементально:
+сигналы (см. ``signals.py``) ставят id заметок в фоновую очередь, которая
+пачками пересчитывает только изменившиеся постинги.
+
+Миграция создает пустой индекс; пока он не построен командой
+``rebuild_search_index``, поиск работает по вхождению подстроки в
+заголовок и текст, как до появления индекса.
+"""
+import re
+from collections import Counter
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery, Sum, Value
+
+from .background import BatchWorker
+from .caching import bump_version
+from .models import Note, SearchIndexEntry
+
+# Веса полей документа
+TITLE_WEIGHT = 5
+TAG_WEIGHT = 3
+CONTENT_WEIGHT = 1
+COMMENT_WEIGHT = 1
+
+# Ограничение частоты терма в одном поле, чтобы повторы не «накручивали» ранг
+MAX_TERM_FREQUENCY = 10
+
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = 64
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+CYRILLIC_RE = re.compile(r'[а-я]')
+
+STOP_WORDS = frozenset("""
+    и в во не что он на я с со как а то все она так его но да ты к у же вы за
+    бы по только ее мне было вот от меня еще нет о из ему теперь когда даже ну
+    вдруг ли если уже или ни быть был него до вас нибудь опять уж вам ведь там
+    потом себя ничего ей может они тут где есть надо ней для мы тебя их чем была
+    сам чтоб без будто чего раз тоже себе под будет ж тогда кто этот того потому
+    этого какой совсем ним здесь этом один почти мой тем чтобы нее сейчас были
+    куда зачем всех никогда можно при наконец два об другой хоть после над
+    больше тот через эти нас про всего них какая много разве три эту моя
+    впрочем хорошо свою этой перед иногда лучше чуть том нельзя такой им более
+    всегда конечно всю между это
+    a an and are as at be but by for if in into is it no not of on or such that
+    the their then there these they this to was will with
+""".split())
+
+
+# --- Стемминг -------------------------------------------------------------
+
+RU_VOWELS = 'аеиоуыэюя'
+
+RU_PERFECTIVE_GERUND = ('ившись', 'ывшись', 'авшись', 'явшись', 'ив', 'ыв', 'ав', 'яв')
+RU_REFLEXIVE = ('ся', 'сь')
+RU_ADJECTIVE = (
+    'ими', 'ыми', 'его', 'ого', 'ему', 'ому', 'ее', 'ие', 'ые', 'ое', 'ей', 'ий',
+    'ый', 'ой', 'ем', 'им', 'ым', 'ом', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею',
+)
+RU_PARTICIPLE = ('ивш', 'ывш', 'ующ', 'ющ', 'ащ', 'ящ', 'вш', 'нн', 'ем')
+RU_VERB = (
+    'ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил',
+    'ыл', 'им', 'ым', 'ен', 'ило', 'ыло', 'ено', 'ят', 'ует', 'уют', 'ит', 'ыт',
+    'ены', 'ить', 'ыть', 'ишь', 'ую', 'ла', 'на', 'ете', 'йте', 'ли', 'ем', 'ло',
+    'но', 'ет', 'ют', 'ны', 'ть', 'ешь', 'нно',
+)
+RU_NOUN = (
+    'иями', 'ями', 'ами', 'ией', 'иям', 'ием', 'иях', 'ев', 'ов', 'ие', 'ье', 'еи',
+    'ии', 'ей', 'ой', 'ий', 'ям', 'ем', 'ам', 'ом', 'ах', 'ях', 'ию', 'ью', 'ия',
+    'ья', 'а', 'е', 'и', 'й', 'о', 'у', 'ы', 'ь', 'ю', 'я',
+)
+RU_DERIVATIONAL = ('ость', 'ост')
+RU_SUPERLATIVE = ('ейше', 'ейш')
+
+
+def _longest_first(suffixes):
+    return tuple(sorted(suffixes, key=len, reverse=True))
+
+
+RU_PERFECTIVE_GERUND, RU_REFLEXIVE, RU_ADJECTIVE, RU_PARTICIPLE, RU_VERB, RU_NOUN = map(
+    _longest_first,
+    (RU_PERFECTIVE_GERUND, RU_REFLEXIVE, RU_ADJECTIVE, RU_PARTICIPLE, RU_VERB, RU_NOUN),
+)
+
+
+def _strip_suffix(word, suffixes, min_stem=1):
+    """Отрезает самое длинное подходящее окончание, возвращает (основа, успех)"""
+    for suffix in suffixes:
+        if word.endswith(suffix) and len(word) - len(suffix) >= min_stem:
+            return word[:-len(suffix)], True
+    return word, False
+
+
+def stem_russian(word):
+    """Упрощённый стеммер Портера (Snowball) для русского языка"""
+    # RV — часть слова после первой гласной
+    for i, char in enumerate(word):
+        if char in RU_VOWELS:
+            prefix, rv = word[:i + 1], word[i + 1:]
+            break
+    else:
+        return word
+
+    rv, removed = _strip_suffix(rv, RU_PERFECTIVE_GERUND)
+    if not removed:
+        rv, _ = _strip_suffix(rv, RU_REFLEXIVE)
+        rv, removed = _strip_suffix(rv, RU_ADJECTIVE)
+        if removed:
+            rv, _ = _strip_suffix(rv, RU_PARTICIPLE)
+        else:
+            rv, removed = _strip_suffix(rv, RU_VERB)
+            if not removed:
+                rv, _ = _strip_suffix(rv, RU_NOUN)
+
+    if rv.endswith('и'):
+        rv = rv[:-1]
+    rv, _ = _strip_suffix(rv, RU_DERIVATIONAL, min_stem=2)
+    rv, removed = _strip_suffix(rv, RU_SUPERLATIVE)
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    elif not removed and rv.endswith('ь'):
+        rv = rv[:-1]
+    return prefix + rv
+
+
+EN_VOWELS = 'aeiouy'
+EN_SUFFIXES = (
+    ('ational', 'ate'), ('ization', 'ize'), ('fulness', 'ful'), ('ousness', 'ous'),
+    ('iveness', 'ive'), ('tional', 'tion'), ('ement', ''), ('ment', ''),
+    ('ness', ''), ('able', ''), ('ible', ''), ('ally', 'al'), ('ly', ''),
+)
+
+
+def _has_vowel(word):
+    return any(char in EN_VOWELS for char in word)
+
+
+def stem_english(word):
+    """Облегчённый стеммер Портера для английского языка"""
+    if len(word) <= 3:
+        return word
+
+    # Множественное число
+    if word.endswith('sses'):
+        word = word[:-2]
+    elif word.endswith('ies'):
+        word = word[:-3] + 'i'
+    elif word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        word = word[:-1]
+
+    # Прошедшее время и причастия
+    for suffix in ('ing', 'ed'):
+        if word.endswith(suffix) and _has_vowel(word[:-len(suffix)]):
+            word = word[:-len(suffix)]
+            if len(word) > 2 and word[-1] == word[-2] and word[-1] not in 'lsz':
+                word = word[:-1]
+            break
+
+    # Словообразовательные суффиксы
+    for suffix, replacement in EN_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)] + replacement
+            break
+
+    if word.endswith('y') and _has_vowel(word[:-1]):
+        word = word[:-1] + 'i'
+    return word
+
+
+@lru_cache(maxsize=100000)
+def stem(word):
+    """Приведение слова к основе в зависимости от алфавита"""
+    if word.isdigit():
+        return word
+    if CYRILLIC_RE.search(word):
+        return stem_russian(word)
+    return stem_english(word)
+
+
+# --- Анализ текста --------------------------------------------------------
+
+def tokenize(text):
+    """Разбиение текста на нормализованные слова"""
+    text = (text or '').lower().replace('ё', 'е')
+    return [
+        token for token in TOKEN_RE.findall(text)
+        if MIN_TERM_LENGTH <= len(token) <= MAX_TERM_LENGTH
+        and token not in STOP_WORDS
+        and not token.startswith('_')
+    ]
+
+
+def analyze(text):
+    """Список термов текста (основ слов)"""
+    return [stem(token) for token in tokenize(text)]
+
+
+def build_postings(title, content, tag_names=(), comment_texts=()):
+    """Словарь {терм: вес} для документа заметки"""
+    postings = Counter()
+    fields = (
+        ([title], TITLE_WEIGHT),
+        (tag_names, TAG_WEIGHT),
+        ([content], CONTENT_WEIGHT),
+        (comment_texts, COMMENT_WEIGHT),
+    )
+    for texts, weight in fields:
+        frequencies = Counter()
+        for text in texts:
+            frequencies.update(analyze(text))
+        for term, frequency in frequencies.items():
+            postings[term] += min(frequency, MAX_TERM_FREQUENCY) * weight
+    return dict(postings)
+
+
+def note_postings(note):
+    """Постинги заметки; теги и комментарии берутся из prefetch, если он есть"""
+    tag_names = [note_tag.tag.name for note_tag in note.note_tags.all()]
+    comment_texts = [comment.text for comment in note.comments.all()]
+    return build_postings(note.title, note.content, tag_names, comment_texts)
+
+
+def indexable_notes():
+    """Заметки с предзагруженными данными, нужными для индексации"""
+    return Note.objects.defer('content_html', 'excerpt').prefetch_related('note_tags__tag', 'comments').order_by()
+
+
+# --- Индексация -----------------------------------------------------------
+
+def stored_postings(note_ids):
+    """Текущие постинги заметок в индексе: {note_id: {терм: (pk, вес)}}"""
+    stored = {}
+    entries = SearchIndexEntry.objects.filter(note_id__in=note_ids).values_list(
+        'pk', 'note_id', 'term', 'weight'
+    )
+    for pk, note_id, term, weight in entries:
+        stored.setdefault(note_id, {})[term] = (pk, weight)
+    return stored
+
+
+def update_index(note_ids, batch_size=500):
+    """
+    Инкрементальное обновление индекса для набора заметок.
+
+    Сравнивает ожидаемые постинги с сохранёнными и меняет только
+    разницу. Возвращает кортеж (создано, обновлено, удалено).
+    """
+    note_ids = set(note_ids)
+    notes = {note.pk: note for note in indexable_notes().filter(pk__in=note_ids)}
+    stored = stored_postings(note_ids)
+
+    to_create, to_update, to_delete = [], [], []
+    for note_id in note_ids:
+        expected = note_postings(notes[note_id]) if note_id in notes else {}
+        current = stored.get(note_id, {})
+        for term, (pk, weight) in current.items():
+            if term not in expected:
+                to_delete.append(pk)
+            elif expected[term] != weight:
+                to_update.append(SearchIndexEntry(pk=pk, weight=expected[term]))
+        to_create.extend(
+            SearchIndexEntry(note_id=note_id, term=term, weight=weight)
+            for term, weight in expected.items()
+            if term not in current
+        )
+
+    if not (to_create or to_update or to_delete):
+        return 0, 0, 0
+    with transaction.atomic():
+        for start in range(0, len(to_delete), batch_size):
+            SearchIndexEntry.objects.filter(pk__in=to_delete[start:start + batch_size]).delete()
+        SearchIndexEntry.objects.bulk_update(to_update, ['weight'], batch_size=batch_size)
+        SearchIndexEntry.objects.bulk_create(to_create, batch_size=batch_size, ignore_conflicts=True)
+    return len(to_create), len(to_update), len(to_delete)
+
+
+index_queue = BatchWorker(
+    update_index,
+    batch_size=getattr(settings, 'SEARCH_INDEX_BATCH_SIZE', 100),
+    interval=getattr(settings, 'SEARCH_INDEX_INTERVAL', 1.0),
+    name='search-index',
+)
+
+
+def schedule_reindex(note_ids):
+    """
+    Ставит заметки в очередь на переиндексацию после фиксации транзакции.
+
+    При ``SEARCH_INDEX_ASYNC = False`` индекс обновляется сразу после
+    коммита в текущем потоке.
+    """
+    note_ids = list(note_ids)
+    if not note_ids:
+        return
+    if getattr(settings, 'SEARCH_INDEX_ASYNC', True):
+        transaction.on_commit(lambda: index_queue.submit(note_ids))
+    else:
+        transaction.on_commit(lambda: update_index(note_ids))
+
+
+def find_drift(chunk_size=500):
+    """
+    Сверяет индекс с содержимым таблиц.
+
+    Для каждой расходящейся заметки возвращает кортеж
+    (note_id, отсутствующие термы, лишние термы, термы с неверным весом).
+    """
+    chunk = []
+    for note in indexable_notes().iterator(chunk_size=chunk_size):
+        chunk.append(note)
+        if len(chunk) >= chunk_size:
+            yield from _chunk_drift(chunk)
+            chunk = []
+    yield from _chunk_drift(chunk)
+
+
+def _chunk_drift(notes):
+    stored = stored_postings([note.pk for note in notes])
+    for note in notes:
+        expected = note_postings(note)
+        current = {term: weight for term, (pk, weight) in stored.get(note.pk, {}).items()}
+        missing = sorted(expected.keys() - current.keys())
+        stale = sorted(current.keys() - expected.keys())
+        changed = sorted(
+            term for term in expected.keys() & current.keys()
+            if expected[term] != current[term]
+        )
+        if missing or stale or changed:
+            yield note.pk, missing, stale, changed
+
+
+def _insert_postings(rows):
+    """
+    Массовая вставка строк (term, note_id, weight) в обход создания объектов
+    моделей — при полной перестройке это основная часть работы.
+    """
+    if not rows:
+        return
+    connection = connections[router.db_for_write(SearchIndexEntry)]
+    quote = connection.ops.quote_name
+    sql = 'INSERT INTO {} ({}, {}, {}) VALUES (%s, %s, %s)'.format(
+        quote(SearchIndexEntry._meta.db_table), quote('term'), quote('note_id'), quote('weight'),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def rebuild_index(chunk_size=500, batch_size=5000, progress=None):
+    """
+    Полная перестройка индекса; возвращает число проиндексированных заметок.
+
+    Заметки обрабатываются порциями по ``chunk_size`` в порядке id, каждая
+    порция — в своей короткой транзакции: её постинги заменяются целиком.
+    Поиск во время перестройки видит полный индекс (старые постинги у еще
+    не обработанных заметок), а фоновые очереди ждут блокировку записи
+    SQLite не дольше одной порции.
+    """
+    total, last_pk = 0, 0
+    while True:
+        note_ids = list(
+            Note.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+        )
+        if not note_ids:
+            break
+        with transaction.atomic():
+            # Удаление берет блокировку записи: заметки читаются уже под ней
+            SearchIndexEntry.objects.filter(note_id__in=note_ids).delete()
+            rows = []
+            for note in indexable_notes().filter(pk__in=note_ids):
+                rows.extend((term, note.pk, weight) for term, weight in note_postings(note).items())
+                if len(rows) >= batch_size:
+                    _insert_postings(rows)
+                    rows = []
+                total += 1
+            _insert_postings(rows)
+        last_pk = note_ids[-1]
+        if progress:
+            progress(total)
+    # Страницы поиска в кэше построены по прежнему индексу
+    bump_version('notes')
+    return total
+
+
+# --- Поиск ----------------------------------------------------------------
+
+def matching_note_ids(terms):
+    """Подзапрос id заметок, содержащих все термы"""
+    return (
+        SearchIndexEntry.objects.filter(term__in=terms)
+        .values('note_id')
+        .annotate(hits=Count('term'))
+        .filter(hits=len(terms))
+        .values('note_id')
+    )
+
+
+def index_is_empty():
+    """Индекс еще не построен (например, сразу после migrate на старой базе)"""
+    return not SearchIndexEntry.objects.exists()
+
+
+def substring_match(query):
+    """Условие прежнего поиска: подстрока в заголовке или тексте"""
+    return Q(title__icontains=query) | Q(content__icontains=query)
+
+
+def filter_by_terms(queryset, query, field='pk'):
+    """Фильтр по индексу без ранжирования; ``field`` — поле с id заметки"""
+    if index_is_empty():
+        return queryset.filter(**{f'{field}__in': Note.objects.filter(substring_match(query)).values('pk')})
+    terms = sorted(set(analyze(query)))
+    if not terms:
+        return queryset.none()
+    return queryset.filter(**{f'{field}__in': matching_note_ids(terms)})
+
+
+def search_notes(queryset, query):
+    """
+    Фильтрует queryset заметок по поисковому запросу.
+
+    Возвращаются только заметки, содержащие все термы запроса, с аннотацией
+    ``search_rank``; правила видимости задаёт исходный queryset.
+    """
+    if index_is_empty():
+        return (
+            queryset.filter(substring_match(query))
+            .annotate(search_rank=Value(0, output_field=IntegerField()))
+            .order_by('-created_at')
+        )
+    terms = sorted(set(analyze(query)))
+    if not terms:
+        # Аннотация нужна и пустому результату: по ней сортируют списки
+        return queryset.none().annotate(search_rank=Value(0, output_field=IntegerField()))
+
+    rank = (
+        SearchIndexEntry.objects.filter(note_id=OuterRef('pk'), term__in=terms)
+        .values('note_id')
+        .annotate(rank=Sum('weight'))
+        .values('rank')
+    )
+    return (
+        queryset.filter(pk__in=matching_note_ids(terms))
+        .annotate(search_rank=Subquery(rank, output_field=IntegerField()))
+        .order_by('-search_rank', '-created_at')
+    )
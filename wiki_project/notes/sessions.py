@@ -0,0 +1,117 @@
+"""
+Сессии и пользователь запроса из кэша.
+
+* ``SessionStore`` (``SESSION_ENGINE = 'notes.sessions'``) — сессии
+  ``cached_db``: чтение из кэша с запасным чтением из базы, запись в обе.
+  Сессия сохраняется, только если её данные действительно изменились, а
+  не при любом присваивании.
+* ``CachedAuthenticationMiddleware`` заменяет ``AuthenticationMiddleware``:
+  пользователь сессии берется из кэша на ``USER_CACHE_TIMEOUT`` секунд.
+  В кэше лежат поля пользователя без хэша пароля и хэш для сессии
+  (``get_session_auth_hash``), с которым сверяется сессия, как в
+  ``auth.get_user``. Сохранение или удаление пользователя и изменение его
+  групп и прав убирают его из кэша (см. ``signals.py``), так что смена
+  пароля, имени или прав видна сразу.
+
+При нескольких процессах кэш должен быть общим (``WIKI_CACHE_BACKEND``),
+иначе изменения пользователя видны в других процессах только по таймауту.
+"""
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth import get_user_model
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.sessions.backends import cached_db
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
+
+
+class SessionStore(cached_db.SessionStore):
+    """Сессия cached_db, которая не перезаписывает неизменившиеся данные"""
+
+    _saved_state = None
+
+    def _state(self, data):
+        return self.serializer().dumps(data)
+
+    def load(self):
+        data = super().load()
+        self._saved_state = self._state(data)
+        return data
+
+    def save(self, must_create=False):
+        if (
+            not must_create
+            # Каждое сохранение продлевает срок сессии
+            and not settings.SESSION_SAVE_EVERY_REQUEST
+            and self.session_key
+            and self._saved_state is not None
+            and self._state(self._get_session()) == self._saved_state
+        ):
+            return
+        super().save(must_create)
+        self._saved_state = self._state(self._get_session())
+
+
+def user_cache_key(user_id):
+    return f'notes:user:{user_id}'
+
+
+def forget_user(user_id):
+    cache.delete(user_cache_key(user_id))
+
+
+def cached_user_state(user):
+    """
+    Данные пользователя для кэша: поля без пароля и хэш для сессии.
+
+    Хэш сессии — HMAC от пароля на ``SECRET_KEY``, он и так хранится в
+    каждой сессии пользователя, сам хэш пароля в общий кэш не попадает.
+    """
+    fields = {
+        field.attname: getattr(user, field.attname)
+        for field in user._meta.concrete_fields if field.attname != 'password'
+    }
+    return fields, user.get_session_auth_hash(), user._state.db
+
+
+def user_from_state(state):
+    """Пользователь из кэша; пароль отложен и загрузится из базы при обращении"""
+    fields, session_hash, using = state
+    return get_user_model().from_db(using, list(fields), list(fields.values())), session_hash
+
+
+def get_user(request):
+    """``auth.get_user`` с кэшированием пользователя по id"""
+    try:
+        user_id = auth._get_user_session_key(request)
+    except KeyError:
+        return auth.get_user(request)
+    backend_path = request.session.get(auth.BACKEND_SESSION_KEY)
+    timeout = getattr(settings, 'USER_CACHE_TIMEOUT', 300)
+    if not timeout or backend_path not in settings.AUTHENTICATION_BACKENDS:
+        return auth.get_user(request)
+
+    key = user_cache_key(user_id)
+    state = cache.get(key)
+    if state is None:
+        user = auth.get_user(request)
+        if user.is_authenticated:
+            cache.set(key, cached_user_state(user), timeout)
+        return user
+
+    user, user_hash = user_from_state(state)
+    session_hash = request.session.get(auth.HASH_SESSION_KEY)
+    if not (session_hash and constant_time_compare(session_hash, user_hash)):
+        # Несовпадение (смена пароля, SECRET_KEY_FALLBACKS) разбирает Django
+        return auth.get_user(request)
+    user.backend = backend_path
+    return user
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    """``AuthenticationMiddleware`` с пользователем из кэша"""
+
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: get_user(request))
@@ -0,0 +1,184 @@
+"""Обработчики сигналов моделей приложения notes"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .caching import bump_version
+from .counters import adjust_counter
+from .models import Category, Comment, Note, NoteTag, RelatedNote, Tag
+from .related import schedule_related_update
+from .search import schedule_reindex
+from .sessions import forget_user
+
+# Поля заметки, от которых зависит поисковый индекс
+INDEXED_NOTE_FIELDS = frozenset({'title', 'content'})
+
+
+@receiver(post_save, sender=Note)
+def reindex_saved_note(sender, instance, update_fields=None, raw=False, **kwargs):
+    # Сохранения служебных полей (например, счетчика просмотров) индекс не меняют
+    if raw or (update_fields and not INDEXED_NOTE_FIELDS & set(update_fields)):
+        return
+    schedule_reindex([instance.pk])
+
+
+@receiver(post_save, sender=NoteTag)
+@receiver(post_delete, sender=NoteTag)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def reindex_related_note(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    schedule_reindex([instance.note_id])
+
+
+@receiver(post_save, sender=Tag)
+def reindex_tagged_notes(sender, instance, created=False, raw=False, **kwargs):
+    # Переименование тега меняет документы всех заметок с этим тегом
+    if raw or created:
+        return
+    schedule_reindex(instance.note_tags.values_list('note_id', flat=True))
+
+
+# --- Похожие заметки ------------------------------------------------------
+
+@receiver(post_save, sender=NoteTag)
+@receiver(post_delete, sender=NoteTag)
+def update_related_notes(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    schedule_related_update([instance.note_id])
+
+
+@receiver(pre_delete, sender=Note)
+def refill_related_notes(sender, instance, **kwargs):
+    # Строки с удаляемой заметкой удалятся каскадом, списки пересчитываются после
+    schedule_related_update(RelatedNote.objects.filter(related=instance).values_list('note_id', flat=True))
+
+
+# --- Денормализованные счетчики -------------------------------------------
+
+def _moved(instance, attname, created, update_fields):
+    """(старое, новое) значение внешнего ключа, если запись перепривязана"""
+    if update_fields and attname not in update_fields and attname[:-3] not in update_fields:
+        return None
+    current = getattr(instance, attname)
+    if created:
+        return None, current
+    previous = instance.loaded_value(attname, current)
+    return (previous, current) if previous != current else None
+
+
+@receiver(post_save, sender=Note)
+def count_note_in_category(sender, instance, created=False, update_fields=None, raw=False, **kwargs):
+    if raw:
+        return
+    moved = _moved(instance, 'category_id', created, update_fields)
+    if moved:
+        adjust_counter(Category, moved[0], 'notes_count', -1)
+        adjust_counter(Category, moved[1], 'notes_count', 1)
+
+
+@receiver(post_delete, sender=Note)
+def uncount_note_in_category(sender, instance, **kwargs):
+    adjust_counter(Category, instance.category_id, 'notes_count', -1)
+
+
+@receiver(post_save, sender=NoteTag)
+def count_tag_link(sender, instance, created=False, update_fields=None, raw=False, **kwargs):
+    if raw:
+        return
+    moved = _moved(instance, 'tag_id', created, update_fields)
+    if moved:
+        adjust_counter(Tag, moved[0], 'notes_count', -1)
+        adjust_counter(Tag, moved[1], 'notes_count', 1)
+
+
+@receiver(post_delete, sender=NoteTag)
+def uncount_tag_link(sender, instance, **kwargs):
+    adjust_counter(Tag, instance.tag_id, 'notes_count', -1)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created=False, update_fields=None, raw=False, **kwargs):
+    if raw:
+        return
+    moved = _moved(instance, 'note_id', created, update_fields)
+    if moved:
+        adjust_counter(Note, moved[0], 'comments_count', -1)
+        adjust_counter(Note, moved[1], 'comments_count', 1)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    adjust_counter(Note, instance.note_id, 'comments_count', -1)
+
+
+# --- Версии кэша ----------------------------------------------------------
+
+@receiver(post_save, sender=Note)
+@receiver(post_delete, sender=Note)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_notes_and_categories(sender, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {'views_count'}:
+        return
+    bump_version('notes', 'categories')
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=NoteTag)
+@receiver(post_delete, sender=NoteTag)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_notes(sender, **kwargs):
+    bump_version('notes')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_author_pages(sender, update_fields=None, **kwargs):
+    # Имя автора выводится на страницах заметок; вход (last_login) их не меняет
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    bump_version('notes')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # Пароль, имя, права и активность читаются из кэша сессий
+    forget_user(instance.pk)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def invalidate_cached_user_access(sender, instance, action, reverse, pk_set, **kwargs):
+    # Группы и права: со стороны пользователя или группы/права (reverse)
+    if not reverse:
+        if action.startswith('post_'):
+            forget_user(instance.pk)
+        return
+    if action == 'pre_clear':
+        # После очистки связей пользователей уже не найти
+        instance._cleared_user_ids = list(
+            sender.objects.filter(**{instance._meta.model_name: instance}).values_list('user_id', flat=True)
+        )
+    elif action == 'post_clear':
+        pk_set = instance.__dict__.pop('_cleared_user_ids', ())
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        for user_id in pk_set:
+            forget_user(user_id)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """Настройка нового соединения с SQLite (WAL, ожидание блокировок и т.д.)"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {name} = {value}')
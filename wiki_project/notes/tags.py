@@ -0,0 +1,86 @@
+"""
+Работа с тегами заметок.
+
+Имена тегов нормализуются (пробелы, регистр, длина), существующие теги
+находятся одним запросом, недостающие создаются через
+``bulk_create(ignore_conflicts=True)`` — это безопасно при одновременном
+создании одного и того же тега. У заметки меняется только разница между
+текущим и новым набором тегов; строка заметки на это время блокируется,
+поэтому параллельные правки не добавят одну связь дважды и не собьют
+счетчики тегов.
+"""
+from django.db import transaction
+from django.db.models import F
+
+from .caching import bump_version
+from .models import Note, NoteTag, Tag
+from .related import schedule_related_update
+from .search import schedule_reindex
+
+MAX_TAG_LENGTH = Tag._meta.get_field('name').max_length
+
+
+def normalize_tag_name(name):
+    """Приведение имени тега к каноническому виду"""
+    return ' '.join(name.split()).lower()[:MAX_TAG_LENGTH].strip()
+
+
+def parse_tag_names(value):
+    """Список уникальных нормализованных имен из строки «тег1, тег2»"""
+    names = []
+    for raw_name in (value or '').split(','):
+        name = normalize_tag_name(raw_name)
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def format_tag_names(note):
+    """Строка тегов заметки для поля формы"""
+    return ', '.join(
+        note.note_tags.order_by('tag__name').values_list('tag__name', flat=True)
+    )
+
+
+def resolve_tags(names):
+    """Словарь {имя: Tag}; отсутствующие теги создаются"""
+    names = list(dict.fromkeys(names))
+    if not names:
+        return {}
+    tags = {tag.name: tag for tag in Tag.objects.filter(name__in=names)}
+    missing = [name for name in names if name not in tags]
+    if missing:
+        Tag.objects.bulk_create([Tag(name=name) for name in missing], ignore_conflicts=True)
+        # Теги, созданные параллельным запросом, тоже попадут в выборку
+        tags.update((tag.name, tag) for tag in Tag.objects.filter(name__in=missing))
+    return tags
+
+
+@transaction.atomic
+def set_note_tags(note, names):
+    """
+    Устанавливает теги заметки, меняя только разницу.
+
+    Возвращает пару множеств id тегов (добавленные, удаленные).
+    """
+    tags = resolve_tags(names)
+    wanted = {tag.pk for tag in tags.values()}
+    # До конца транзакции набор тегов заметки меняет только этот вызов
+    list(Note.objects.select_for_update().filter(pk=note.pk).values_list('pk'))
+    current = set(NoteTag.objects.filter(note=note).values_list('tag_id', flat=True))
+    added, removed = wanted - current, current - wanted
+
+    if removed:
+        # Удаление идет через сигналы: они обновят счетчики, индекс и кэш
+        NoteTag.objects.filter(note=note, tag_id__in=removed).delete()
+    if added:
+        # bulk_create сигналов не отправляет, поэтому их работа делается здесь.
+        # Без ignore_conflicts: под блокировкой этих связей точно нет, а если
+        # связь все же вставлена в обход set_note_tags, лучше ошибка, чем
+        # счетчик, увеличенный за чужую строку
+        NoteTag.objects.bulk_create([NoteTag(note=note, tag_id=tag_id) for tag_id in added])
+        Tag.objects.filter(pk__in=added).update(notes_count=F('notes_count') + 1)
+        schedule_reindex([note.pk])
+        schedule_related_update([note.pk])
+        bump_version('notes')
+    return added, removed
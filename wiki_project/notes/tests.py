@@ -1,3 +1,1285 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import os
+import pickle
+import re
+import tempfile
+from datetime import date, datetime, timedelta
+from unittest import mock, skipIf
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import AnonymousUser, Group, Permission, User
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.db import DatabaseError, connection
+from django.db.models import Count
+from django.http import Http404, HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import async_views, views
+from .analytics import rollup_views, top_viewed
+from .assets import purge_css, serve, static_files, used_tokens
+from .background import BatchWorker, CounterWorker
+from .benchmarks import compare_results, measure, percentile, seed_dataset, summarize
+from .caching import get_versions, page_cache_key
+from .counters import repair_counters
+from .instrumentation import get_report
+from .models import (
+    Category, Comment, DailyViewStat, HourlyViewStat, Note, RelatedNote, SearchIndexEntry, Tag, TrendingNote,
+    ViewEvent, ViewStat,
+)
+from .pagination import LAST, EstimatedCountPaginator, KeysetPaginator, encode_cursor
+from .related import np, rebuild_related, related_notes
+from .rendering import RENDERER_VERSION, rerender_notes
+from .routers import (
+    PIN_COOKIE_NAME, PrimaryReplicaRouter, ReplicaPinningMiddleware, allow_replica_reads, use_primary,
+)
+from .revisions import compact_revisions, diff_lines, record_revision, revision_text
+from .search import build_postings, find_drift, rebuild_index, search_notes, update_index
+from .sessions import user_cache_key, user_from_state
+from .tags import format_tag_names, parse_tag_names, set_note_tags
+from .transfer import (
+    NoteImporter, TransferError, export_queryset, export_stream, iter_records, read_jsonl, read_records,
+)
+from .viewcount import _view_executor, count_view, flush_views, record_view, record_view_later, view_buffer
+
+# Фоновые очереди в тестах не нужны: работа выполняется после коммита
+SYNC_SETTINGS = {'SEARCH_INDEX_ASYNC': False, 'RELATED_NOTES_ASYNC': False}
+
+
+def make_note(author, title='Заметка', content='Текст', is_public=True, **fields):
+    return Note.objects.create(author=author, title=title, content=content, is_public=is_public, **fields)
+
+
+def raw_cursor(payload):
+    """Токен курсора с произвольным содержимым"""
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+@override_settings(**SYNC_SETTINGS)
+class KeysetPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pw')
+        cls.other = User.objects.create_user('other', password='pw')
+        start = timezone.now() - timedelta(days=1)
+        for i in range(25):
+            # Пары заметок с одинаковой датой: порядок задает id
+            make_note(cls.author if i % 3 else cls.other, f'Заметка {i}', created_at=start + timedelta(minutes=i // 2))
+        make_note(cls.other, 'Личная', is_public=False)
+
+    def walk(self, paginator, cursor=None, attribute='next_cursor'):
+        pages = []
+        while True:
+            page = paginator.page(cursor)
+            pages.append(page)
+            cursor = getattr(page, attribute)
+            if cursor is None:
+                return pages
+
+    def test_forward_pages_cover_rows_in_order(self):
+        queryset = Note.objects.filter(is_public=True)
+        pages = self.walk(KeysetPaginator(queryset, 10))
+        expected = list(queryset.order_by('-created_at', '-id').values_list('pk', flat=True))
+        self.assertEqual([note.pk for page in pages for note in page], expected)
+        self.assertEqual([page.number for page in pages], [1, 2, 3])
+        self.assertFalse(pages[0].has_previous())
+        self.assertFalse(pages[-1].has_next())
+
+    def test_backward_pages_from_last(self):
+        queryset = Note.objects.filter(is_public=True)
+        paginator = KeysetPaginator(queryset, 10)
+        pages = self.walk(paginator, LAST, 'previous_cursor')
+        # Последняя страница полная, неполной оказывается первая
+        self.assertEqual([page.number for page in pages], [3, 2, 1])
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        rows = [note.pk for page in reversed(pages) for note in page]
+        self.assertEqual(rows, list(queryset.order_by('-created_at', '-id').values_list('pk', flat=True)))
+
+    def test_streams_merge_like_single_query(self):
+        base = Note.objects.visible_to(self.other)
+        streams = Note.objects.all().visibility_streams(self.other)
+        single = self.walk(KeysetPaginator(base, 7))
+        merged = self.walk(KeysetPaginator(base, 7, streams=streams))
+        self.assertEqual(
+            [note.pk for page in merged for note in page],
+            [note.pk for page in single for note in page],
+        )
+
+    def test_home_pages_follow_cursor(self):
+        first = self.client.get(reverse('home'))
+        page = first.context['page_obj']
+        second = self.client.get(reverse('home'), {'cursor': page.next_cursor})
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.context['page_obj'].number, 2)
+        self.assertFalse({note.pk for note in page} & {note.pk for note in second.context['page_obj']})
+
+    def test_invalid_cursors_return_404(self):
+        note = Note.objects.filter(is_public=True).first()
+        Comment.objects.create(note=note, author=self.author, text='Комментарий')
+        moment = timezone.now().isoformat()
+        cursors = [
+            'не-base64',
+            raw_cursor(['x', [moment, 1], 2]),
+            raw_cursor(['n', [moment], 2]),
+            raw_cursor(['n', ['не дата', 1], 2]),
+            raw_cursor(['n', [moment, 'не число'], 2]),
+            raw_cursor(['n', [moment, [1]], 2]),
+            raw_cursor(['n', [None, 1], 2]),
+            raw_cursor(['n', [moment, 10 ** 30], 2]),
+            raw_cursor(['n', [moment, 1], 'два']),
+            raw_cursor(['n', [moment, 1], 0]),
+        ]
+        urls = [reverse('home'), reverse('note_comments', args=[note.pk])]
+        for url in urls:
+            for cursor in cursors:
+                with self.subTest(url=url, cursor=cursor):
+                    self.assertEqual(self.client.get(url, {'cursor': cursor}).status_code, 404)
+
+    def test_encoded_cursor_round_trip(self):
+        note = Note.objects.filter(is_public=True).order_by('-created_at', '-id')[3]
+        paginator = KeysetPaginator(Note.objects.filter(is_public=True), 5)
+        page = paginator.page(encode_cursor('n', [note.created_at, note.pk], 2))
+        self.assertEqual(page.number, 2)
+        self.assertEqual(page[0].pk, Note.objects.filter(is_public=True).order_by('-created_at', '-id')[4].pk)
+
+
+@override_settings(**SYNC_SETTINGS)
+class QueryPlanTests(TestCase):
+    """Запросы списков читают строки по своим индексам без отдельной сортировки"""
+
+    PUBLIC = 'note_public_created_idx'
+    AUTHOR = 'note_author_created_idx'
+    CATEGORY = 'note_category_created_idx'
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset(400, 5)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.user = User.objects.filter(notes__isnull=False).order_by('pk').first()
+        cls.category = Category.objects.order_by('-notes_count').first()
+
+    def setUp(self):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest('Планы проверяются только для SQLite и PostgreSQL')
+
+    def stream_plans(self, view_class, user, **kwargs):
+        """Планы запросов страницы представления: первой и после курсора"""
+        view = view_class()
+        view.setup(RequestFactory().get('/'), **kwargs)
+        view.request.user = user
+        paginator = view.get_keyset_paginator(view.get_queryset(), view.paginate_by)
+        after = paginator.key(paginator.page()[-1])
+        return [
+            [queryset.explain() for queryset in paginator.stream_querysets(key)]
+            for key in (None, after)
+        ]
+
+    def assertPlansUse(self, plans, indexes):
+        for page_plans in plans:
+            self.assertEqual(len(page_plans), len(indexes))
+            for plan, index in zip(page_plans, indexes):
+                with self.subTest(index=index):
+                    self.assertIn(index, plan)
+                    if connection.vendor == 'sqlite':
+                        self.assertNotIn('TEMP B-TREE', plan)
+                    else:
+                        self.assertNotRegex(plan, r'(?m)^\s*(->\s*)?Sort')
+
+    def test_home_anonymous(self):
+        self.assertPlansUse(self.stream_plans(views.HomeView, AnonymousUser()), [self.PUBLIC])
+
+    def test_home_authenticated(self):
+        self.assertPlansUse(self.stream_plans(views.HomeView, self.user), [self.AUTHOR, self.PUBLIC])
+
+    def test_my_notes(self):
+        self.assertPlansUse(self.stream_plans(views.MyNotesView, self.user), [self.AUTHOR])
+
+    def test_category_anonymous(self):
+        plans = self.stream_plans(views.CategoryNotesView, AnonymousUser(), pk=self.category.pk)
+        self.assertPlansUse(plans, [self.CATEGORY])
+
+    def test_category_authenticated(self):
+        plans = self.stream_plans(views.CategoryNotesView, self.user, pk=self.category.pk)
+        self.assertPlansUse(plans, [self.AUTHOR, self.CATEGORY])
+
+
+@override_settings(**SYNC_SETTINGS)
+class WikiLinkTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pw')
+        cls.other = User.objects.create_user('other', password='pw')
+        cls.public = make_note(cls.other, 'Общая')
+        cls.own = make_note(cls.author, 'Своя', is_public=False)
+        make_note(cls.other, 'Чужая', is_public=False)
+
+    def test_links_resolve_only_to_visible_notes(self):
+        note = make_note(self.author, 'Ссылки', '[[Общая]] [[Своя]] [[Чужая]]')
+        self.assertIn(reverse('note_detail', args=[self.public.pk]), note.content_html)
+        self.assertIn(reverse('note_detail', args=[self.own.pk]), note.content_html)
+        self.assertIn('<span class="wiki-link-missing" title="Заметка не найдена">Чужая</span>', note.content_html)
+
+    def test_batch_rerender_resolves_per_author(self):
+        mine = make_note(self.author, 'Моя', '[[Своя]]')
+        theirs = make_note(self.other, 'Их', '[[Своя]]')
+        rerender_notes(force=True)
+        mine.refresh_from_db()
+        theirs.refresh_from_db()
+        self.assertIn('class="wiki-link"', mine.content_html)
+        self.assertIn('wiki-link-missing', theirs.content_html)
+
+    def test_detail_renders_notes_saved_before_rendering(self):
+        # Так выглядят заметки сразу после миграции 0005
+        note = make_note(self.author, 'Старая', '**жирный** [[Общая]]')
+        Note.objects.filter(pk=note.pk).update(content_html='', excerpt='', rendered_version=0)
+        cache.clear()
+        self.client.force_login(self.author)
+        response = self.client.get(reverse('note_detail', args=[note.pk]))
+        view_buffer.flush()
+        self.assertContains(response, '<strong>жирный</strong>')
+        self.assertContains(response, reverse('note_detail', args=[self.public.pk]))
+        stored = Note.objects.get(pk=note.pk)
+        self.assertEqual((stored.rendered_version, stored.updated_at), (RENDERER_VERSION, note.updated_at))
+        self.assertEqual(stored.excerpt, 'жирный Общая')
+
+
+@override_settings(REVISION_SNAPSHOT_INTERVAL=3, **SYNC_SETTINGS)
+class RevisionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pw')
+
+    def edit(self, note, versions):
+        """Первая версия — текущий текст заметки, остальные сохраняются по очереди"""
+        record_revision(note, self.author)
+        for content in versions:
+            note.content = content
+            note.save()
+            record_revision(note, self.author)
+
+    def test_revisions_rebuild_from_snapshots_and_deltas(self):
+        lines = [f'Строка {i}\n' for i in range(40)]
+        versions = [''.join(lines[:10 + i] + ['Правка\n'] * i) for i in range(7)]
+        note = make_note(self.author, content=versions[0])
+        self.edit(note, versions[1:])
+        revisions = list(note.revisions.order_by('number'))
+        self.assertEqual([revision.number for revision in revisions], list(range(1, 8)))
+        self.assertEqual([revision.depth for revision in revisions], [0, 1, 2, 0, 1, 2, 0])
+        self.assertEqual([revision_text(revision) for revision in revisions], versions)
+
+    def test_unchanged_note_adds_no_revision(self):
+        note = make_note(self.author)
+        self.assertIsNotNone(record_revision(note, self.author))
+        self.assertIsNone(record_revision(note, self.author))
+        self.assertEqual(note.revisions.count(), 1)
+
+    def test_compaction_keeps_texts(self):
+        versions = [f'Начало\nВерсия {i}\n' for i in range(6)]
+        note = make_note(self.author, content=versions[0])
+        with override_settings(REVISION_SNAPSHOT_INTERVAL=10):
+            self.edit(note, versions[1:])
+        self.assertEqual(max(note.revisions.values_list('depth', flat=True)), 5)
+        compact_revisions()
+        revisions = list(note.revisions.order_by('number'))
+        self.assertEqual([revision.depth for revision in revisions], [0, 1, 2, 0, 1, 2])
+        self.assertEqual([revision_text(revision) for revision in revisions], versions)
+
+    def test_diff_lines(self):
+        self.assertEqual(
+            diff_lines('а\nб\nв', 'а\nг\nв'),
+            [('hunk', '@@ -1,3 +1,3 @@'), ('context', 'а'), ('removed', 'б'), ('added', 'г'), ('context', 'в')],
+        )
+
+
+@override_settings(**SYNC_SETTINGS)
+class TagTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pw')
+
+    def counts(self):
+        return dict(Tag.objects.values_list('name', 'notes_count'))
+
+    def test_names_are_normalized(self):
+        self.assertEqual(parse_tag_names(' Python ,python,  Web   Dev, ,'), ['python', 'web dev'])
+
+    def test_set_note_tags_changes_only_difference(self):
+        first, second = make_note(self.author), make_note(self.author)
+        set_note_tags(first, ['python', 'django'])
+        set_note_tags(second, ['python'])
+        self.assertEqual(self.counts(), {'python': 2, 'django': 1})
+
+        added, removed = set_note_tags(first, ['python', 'web'])
+        self.assertEqual(added, {Tag.objects.get(name='web').pk})
+        self.assertEqual(removed, {Tag.objects.get(name='django').pk})
+        self.assertEqual(self.counts(), {'python': 2, 'django': 0, 'web': 1})
+
+        # Повторная установка того же набора счетчики не меняет
+        self.assertEqual(set_note_tags(first, ['python', 'web']), (set(), set()))
+        self.assertEqual(self.counts(), {'python': 2, 'django': 0, 'web': 1})
+        self.assertEqual(format_tag_names(first), 'python, web')
+
+
+@override_settings(**SYNC_SETTINGS)
+class CounterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pw')
+        cls.first = Category.objects.create(name='Первая')
+        cls.second = Category.objects.create(name='Вторая')
+
+    def assertCount(self, obj, field, expected):
+        obj.refresh_from_db(fields=[field])
+        self.assertEqual(getattr(obj, field), expected)
+
+    def test_comment_counter(self):
+        note = make_note(self.author)
+        other = make_note(self.author)
+        comments = [Comment.objects.create(note=note, author=self.author, text=str(i)) for i in range(3)]
+        self.assertCount(note, 'comments_count', 3)
+        comments[0].delete()
+        comments[1].note = other
+        comments[1].save()
+        self.assertCount(note, 'comments_count', 1)
+        self.assertCount(other, 'comments_count', 1)
+
+    def test_category_counter_follows_moves_and_deletes(self):
+        note = make_note(self.author, category=self.first)
+        make_note(self.author, category=self.first)
+        self.assertCount(self.first, 'notes_count', 2)
+        note.category = self.second
+        note.save()
+        self.assertCount(self.first, 'notes_count', 1)
+        self.assertCount(self.second, 'notes_count', 1)
+        note.delete()
+        self.assertCount(self.second, 'notes_count', 0)
+
+    def test_repair_counters_fixes_drift(self):
+        note = make_note(self.author, category=self.first)
+        Comment.objects.create(note=note, author=self.author, text='Комментарий')
+        Note.objects.filter(pk=note.pk).update(comments_count=7)
+        Category.objects.filter(pk=self.first.pk).update(notes_count=0)
+        self.assertEqual(
+            repair_counters(dry_run=True),
+            {'Note.comments_count': 1, 'Category.notes_count': 1, 'Tag.notes_count': 0},
+        )
+        repair_counters()
+        self.assertCount(note, 'comments_count', 1)
+        self.assertCount(self.first, 'notes_count', 1)
+
+
+@override_settings(ADMIN_COUNT_LIMIT=5, **SYNC_SETTINGS)
+class EstimatedCountPaginatorTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('admin', password='pw', is_staff=True, is_superuser=True)
+        for i in range(30):
+            make_note(cls.author, f'Заметка {i}')
+
+    def test_capped_count_reaches_requested_page(self):
+        queryset = Note.objects.filter(is_public=True).order_by('pk')
+        first = EstimatedCountPaginator(queryset, 4)
+        # Предел — следующая страница после первой и одна лишняя строка
+        self.assertEqual(first.count, 9)
+        self.assertEqual(first.num_pages, 3)
+        deep = EstimatedCountPaginator(queryset, 4, number='8')
+        self.assertEqual(deep.count, 30)
+        self.assertEqual(len(deep.page(8)), 2)
+
+    def test_admin_pages_past_limit(self):
+        self.client.force_login(self.author)
+        url = reverse('admin:notes_note_changelist')
+        response = self.client.get(url, {'is_public__exact': '1', 'p': '2'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cl'].result_list), 10)
+
+
+@override_settings(**SYNC_SETTINGS)
+class CachedUserTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('author', password='pw')
+        cls.group = Group.objects.create(name='Редакторы')
+
+    def setUp(self):
+        cache.clear()
+        self.client.login(username='author', password='pw')
+        self.key = user_cache_key(self.user.pk)
+
+    def test_cache_holds_no_password_hash(self):
+        self.assertEqual(self.client.get(reverse('my_notes')).status_code, 200)
+        state = cache.get(self.key)
+        self.assertNotIn('password', state[0])
+        self.assertNotIn(self.user.password.encode(), pickle.dumps(state))
+
+        response = self.client.get(reverse('my_notes'))
+        self.assertEqual(response.context['user'].username, 'author')
+        # Пароль загружается из базы, только если к нему обращаются
+        cached = user_from_state(state)[0]
+        with self.assertNumQueries(1):
+            self.assertTrue(cached.check_password('pw'))
+
+    def test_password_change_logs_out(self):
+        self.client.get(reverse('my_notes'))
+        self.user.set_password('new')
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('my_notes')).status_code, 302)
+
+    def test_group_and_permission_changes_clear_cache(self):
+        changes = [
+            lambda: self.user.groups.add(self.group),
+            lambda: self.group.user_set.remove(self.user),
+            lambda: self.group.user_set.add(self.user),
+            lambda: self.group.user_set.clear(),
+            lambda: self.user.user_permissions.add(Permission.objects.get(codename='change_note')),
+        ]
+        for change in changes:
+            self.client.get(reverse('my_notes'))
+            self.assertIsNotNone(cache.get(self.key))
+            change()
+            self.assertIsNone(cache.get(self.key))
+
+
+class BatchWorkerTests(SimpleTestCase):
+
+    def make_worker(self, handler, worker_class=BatchWorker, **kwargs):
+        # Поток не просыпается сам: пачки обрабатываются через flush()
+        return worker_class(handler, interval=3600, name='test-worker', **kwargs)
+
+    def test_failed_batch_is_retried(self):
+        calls = []
+
+        def handler(batch):
+            calls.append(sorted(batch))
+            if len(calls) < 3:
+                raise RuntimeError('Сбой')
+
+        worker = self.make_worker(handler)
+        worker.submit([1, 2, 3])
+        with self.assertLogs('notes.background', 'ERROR'):
+            worker.flush()
+            worker.flush()
+        self.assertEqual(worker.pending_count(), 3)
+        worker.flush()
+        self.assertEqual(calls, [[1, 2, 3]] * 3)
+        self.assertEqual(worker.pending_count(), 0)
+        self.assertEqual(worker._failures, {})
+
+    def test_items_dropped_after_max_attempts(self):
+        def handler(batch):
+            raise RuntimeError('Сбой')
+
+        worker = self.make_worker(handler, max_attempts=2)
+        worker.submit(['a'])
+        with self.assertLogs('notes.background', 'ERROR') as logs:
+            worker.flush()
+            self.assertEqual(worker.pending_count(), 1)
+            worker.flush()
+        self.assertEqual(worker.pending_count(), 0)
+        self.assertIn('отброшено 1 элементов после 2 попыток', logs.output[-1])
+
+    def test_counter_increments_survive_failure(self):
+        batches = []
+
+        def handler(batch):
+            batches.append(dict(batch))
+            if len(batches) == 1:
+                raise RuntimeError('Сбой')
+
+        worker = self.make_worker(handler, worker_class=CounterWorker)
+        worker.add('note', 2)
+        with self.assertLogs('notes.background', 'ERROR'):
+            worker.flush()
+        worker.add('note', 3)
+        worker.flush()
+        self.assertEqual(batches, [{'note': 2}, {'note': 5}])
+
+
+@override_settings(**SYNC_SETTINGS)
+class SearchIndexTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pw')
+
+    def test_update_index_changes_only_difference(self):
+        note = make_note(self.author, 'Кошки', 'рыжая кошка спит')
+        terms = build_postings(note.title, note.content)
+        self.assertEqual(update_index([note.pk]), (len(terms), 0, 0))
+        self.assertEqual(update_index([note.pk]), (0, 0, 0))
+
+        # Один терм пропал, один добавился, у одного вырос вес
+        Note.objects.filter(pk=note.pk).update(content='рыжая кошка кошки ест')
+        self.assertEqual(update_index([note.pk]), (1, 1, 1))
+        self.assertEqual(list(find_drift()), [])
+        self.assertEqual(list(search_notes(Note.objects.all(), 'ест')), [note])
+
+    def test_rebuild_index_in_chunks(self):
+        notes = [make_note(self.author, f'Кошка {number}', 'рыжая кошка') for number in range(5)]
+        SearchIndexEntry.objects.create(note=notes[0], term='устаревший', weight=1)
+        SearchIndexEntry.objects.filter(note=notes[4]).delete()
+        counts = []
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(rebuild_index(chunk_size=2, batch_size=3, progress=counts.append), 5)
+        # Каждая порция — отдельная транзакция (внутри TestCase — точка сохранения)
+        self.assertEqual(sum(query['sql'].startswith('SAVEPOINT') for query in queries), 3)
+        self.assertEqual(counts, [2, 4, 5])
+        self.assertEqual(list(find_drift()), [])
+
+    def test_find_drift_reports_missing_terms(self):
+        note = make_note(self.author, 'Собаки', 'лает громко')
+        self.assertEqual(len(list(find_drift())), 1)
+        rebuild_index()
+        self.assertEqual(list(find_drift()), [])
+        self.assertEqual([found.pk for found in search_notes(Note.objects.all(), 'собака лает')], [note.pk])
+
+
+@override_settings(QUERY_INSTRUMENTATION=True, **SYNC_SETTINGS)
+class InstrumentationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pw')
+        make_note(cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    def assertInstrumented(self, response):
+        self.assertEqual(response.status_code, 200)
+        queries = int(re.search(r'desc="(\d+) queries"', response['Server-Timing']).group(1))
+        self.assertGreater(queries, 0)
+        self.assertEqual(get_report()['home']['requests'], 1)
+
+    def test_sync_request(self):
+        self.assertInstrumented(self.client.get(reverse('home')))
+
+    async def test_async_request(self):
+        self.assertInstrumented(await self.async_client.get(reverse('home')))
+
+
+@override_settings(**SYNC_SETTINGS)
+class ConditionalGetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pw')
+        cls.note = make_note(cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('note_detail', args=[self.note.pk])
+
+    def test_matching_etag_returns_304_and_counts_view(self):
+        first = self.client.get(self.url, REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('Last-Modified', first)
+        self.assertIn('public', first['Cache-Control'])
+        second = self.client.get(self.url, REMOTE_ADDR='10.0.0.2', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second['ETag'], first['ETag'])
+        modified = self.client.get(self.url, REMOTE_ADDR='10.0.0.3', HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(modified.status_code, 304)
+        view_buffer.flush()
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.views_count, 3)
+
+    def test_new_comment_changes_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        Comment.objects.create(note=self.note, author=self.author, text='Комментарий')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        view_buffer.flush()
+
+    def test_tag_author_and_comment_edits_change_etag(self):
+        set_note_tags(self.note, ['старый'])
+        comment = Comment.objects.create(note=self.note, author=self.author, text='Комментарий')
+        tag = Tag.objects.get(name='старый')
+
+        def rename_tag():
+            tag.name = 'новый'
+            tag.save()
+
+        def rename_author():
+            self.author.username = 'renamed'
+            self.author.save()
+
+        def edit_comment():
+            comment.text = 'Исправлено'
+            comment.save()
+
+        for edit in (rename_tag, rename_author, edit_comment):
+            with self.subTest(edit=edit.__name__):
+                etag = self.client.get(self.url)['ETag']
+                edit()
+                self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        view_buffer.flush()
+
+    def test_login_keeps_etag(self):
+        User.objects.create_user('reader', password='pw')
+        etag = self.client.get(self.url)['ETag']
+        self.client.login(username='reader', password='pw')
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        view_buffer.flush()
+
+    def test_list_etag_depends_on_viewer_and_changes(self):
+        anonymous = self.client.get(reverse('home'))['ETag']
+        self.assertEqual(self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=anonymous).status_code, 304)
+        self.client.force_login(self.author)
+        response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=anonymous)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        make_note(self.author, 'Новая')
+        self.assertEqual(self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+@override_settings(**SYNC_SETTINGS)
+class TransferTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pw')
+        cls.other = User.objects.create_user('other', password='pw')
+        category = Category.objects.create(name='Работа')
+        start = timezone.now() - timedelta(days=3)
+        for i in range(5):
+            note = make_note(
+                cls.author if i % 2 else cls.other, f'Заметка {i}', f'# Заголовок\n\nТекст {i}\n---\nконец',
+                is_public=bool(i % 3), category=category if i % 2 else None, created_at=start + timedelta(hours=i),
+            )
+            set_note_tags(note, ['общий', f'тег {i}'])
+
+    def records(self):
+        return [
+            {key: value for key, value in record.items() if key not in ('id', 'updated_at')}
+            for record in iter_records(export_queryset())
+        ]
+
+    def round_trip(self, format):
+        expected = self.records()
+        source = io.BytesIO(b''.join(export_stream(format, export_queryset(), chunk_size=2)))
+        Note.objects.all().delete()
+        offsets = []
+        stats = NoteImporter(batch_size=2).run(read_records(source, format), on_commit=offsets.append)
+        self.assertEqual(stats['created'], 5)
+        self.assertEqual(len(offsets), 3)
+        self.assertEqual(self.records(), expected)
+        self.assertEqual(dict(Tag.objects.values_list('name', 'notes_count'))['общий'], 5)
+        self.assertEqual(Category.objects.get(name='Работа').notes_count, 2)
+        self.assertEqual(list(find_drift()), [])
+
+        # Повторный запуск с середины файла не создает дублей
+        stats = NoteImporter(batch_size=2).run(read_records(source, format, offsets[0]))
+        self.assertEqual((stats['created'], stats['duplicates']), (0, 3))
+
+    def test_jsonl_round_trip(self):
+        self.round_trip('jsonl')
+
+    def test_markdown_round_trip(self):
+        self.round_trip('markdown')
+
+    def test_duplicates_in_batch_and_related_notes(self):
+        records = self.records()
+        Note.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = NoteImporter(batch_size=10).run(
+                (record, offset) for offset, record in enumerate(records + records[:2])
+            )
+        self.assertEqual((stats['created'], stats['duplicates']), (5, 2))
+        self.assertEqual(dict(Tag.objects.values_list('name', 'notes_count'))['общий'], 5)
+        # Все заметки связаны общим тегом
+        self.assertEqual(
+            sorted(RelatedNote.objects.values('note').annotate(n=Count('pk')).values_list('n', flat=True)), [4] * 5,
+        )
+
+    def test_broken_jsonl_line(self):
+        with self.assertRaises(TransferError):
+            list(read_jsonl(io.BytesIO(b'{"title": "x"}\n{oops\n')))
+
+
+class BenchmarkHelperTests(TestCase):
+
+    def test_percentile_interpolates(self):
+        self.assertEqual(percentile([], 0.5), 0.0)
+        self.assertEqual(percentile([3, 1, 2], 0.5), 2)
+        self.assertEqual(percentile([0, 10], 0.95), 9.5)
+
+    def test_summarize(self):
+        self.assertEqual(
+            summarize([0.001, 0.002, 0.003], [2, 3, 1]),
+            {'runs': 3, 'p50_ms': 2.0, 'p95_ms': 2.9, 'mean_ms': 2.0, 'queries': 3},
+        )
+
+    def test_measure_counts_queries(self):
+        result = measure(lambda: list(User.objects.all()) + list(Note.objects.all()), repeat=3, warmup=1)
+        self.assertEqual((result['runs'], result['queries']), (3, 2))
+        self.assertNotIn('queries', measure(lambda: None, repeat=1, count_queries=False))
+
+    def test_compare_results(self):
+        baseline = {'scenarios': {'home': {'p95_ms': 10.0, 'queries': 4}, 'old': {'p95_ms': 1.0}}}
+        current = {'scenarios': {
+            'home': {'p95_ms': 13.0, 'queries': 5},
+            'new': {'p95_ms': 100.0, 'queries': 50},
+        }}
+        regressions = compare_results(current, baseline)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(all(regression.startswith('home:') for regression in regressions))
+        self.assertEqual(compare_results(current, baseline, max_ratio=1.5, max_extra_queries=1), [])
+
+
+@override_settings(**SYNC_SETTINGS)
+class SearchViewTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pw')
+        cls.note = make_note(cls.author, 'Кошки', 'рыжая кошка')
+        update_index([cls.note.pk])
+
+    def test_search_finds_note(self):
+        response = self.client.get(reverse('home'), {'query': 'кошки'})
+        self.assertEqual([note.pk for note in response.context['page_obj']], [self.note.pk])
+
+    def test_substring_search_until_index_is_built(self):
+        SearchIndexEntry.objects.all().delete()
+        other = make_note(self.author, 'Собаки', 'рыжий пес')
+        # Часть слова находит только поиск по подстроке
+        response = self.client.get(reverse('home'), {'query': 'ыж'})
+        self.assertEqual({note.pk for note in response.context['page_obj']}, {self.note.pk, other.pk})
+        rebuild_index()
+        response = self.client.get(reverse('home'), {'query': 'ыж'})
+        self.assertEqual(list(response.context['page_obj']), [])
+
+    def test_query_without_terms_returns_empty_page(self):
+        # Одни стоп-слова и знаки: термов нет
+        response = self.client.get(reverse('home'), {'query': 'и, а!'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['page_obj']), [])
+
+
+@override_settings(RELATED_NOTES_METRIC='jaccard', **SYNC_SETTINGS)
+class RelatedNotesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pw')
+        cls.other = User.objects.create_user('other', password='pw')
+        cls.a = make_note(cls.author, 'А')
+        cls.b = make_note(cls.author, 'Б')
+        cls.c = make_note(cls.other, 'В', is_public=False)
+        cls.d = make_note(cls.other, 'Г')
+        for note, names in ((cls.a, ['x', 'y']), (cls.b, ['x', 'y']), (cls.c, ['x', 'y']), (cls.d, ['x'])):
+            set_note_tags(note, names)
+        rebuild_related(engine='python')
+
+    def neighbors(self, note, user=None):
+        return [(item.related_id, item.score) for item in related_notes(note, user or AnonymousUser())]
+
+    def test_private_neighbours_are_hidden(self):
+        self.assertEqual(self.neighbors(self.a), [(self.b.pk, 1.0), (self.d.pk, 0.5)])
+        self.assertEqual(
+            self.neighbors(self.a, self.other),
+            [(self.c.pk, 1.0), (self.b.pk, 1.0), (self.d.pk, 0.5)],
+        )
+
+    @skipIf(np is None, 'нужны numpy и scipy')
+    def test_engines_agree(self):
+        stored = list(RelatedNote.objects.values_list('note_id', 'rank', 'related_id', 'score'))
+        rebuild_related(engine='numpy')
+        self.assertEqual(list(RelatedNote.objects.values_list('note_id', 'rank', 'related_id', 'score')), stored)
+
+    def test_tag_changes_update_both_sides(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            set_note_tags(self.d, ['x', 'y'])
+        self.assertEqual(self.neighbors(self.d)[:2], [(self.b.pk, 1.0), (self.a.pk, 1.0)])
+        self.assertIn((self.d.pk, 1.0), self.neighbors(self.a))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            set_note_tags(self.b, ['z'])
+        self.assertEqual(self.neighbors(self.b), [])
+        self.assertNotIn(self.b.pk, [related_id for related_id, _ in self.neighbors(self.a)])
+
+    def test_detail_page_reads_related_in_one_query(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('note_detail', args=[self.a.pk]))
+        view_buffer.flush()
+        self.assertEqual([item.related_id for item in response.context['related']], [self.b.pk, self.d.pk])
+        related_queries = [query for query in queries if RelatedNote._meta.db_table in query['sql']]
+        self.assertEqual(len(related_queries), 1)
+
+
+@override_settings(**SYNC_SETTINGS)
+class ViewCounterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pw')
+        cls.first = make_note(cls.author)
+        cls.second = make_note(cls.author)
+
+    def setUp(self):
+        cache.clear()
+        view_buffer.flush()
+        self.minute = timezone.now().replace(second=0, microsecond=0)
+
+    def views(self):
+        return dict(Note.objects.values_list('pk', 'views_count'))
+
+    def test_flush_applies_increments_and_events(self):
+        flush_views({
+            (self.first.pk, self.minute): 2,
+            (self.first.pk, self.minute - timedelta(minutes=1)): 3,
+            (self.second.pk, self.minute): 3,
+        })
+        self.assertEqual(self.views(), {self.first.pk: 5, self.second.pk: 3})
+        self.assertEqual(
+            sorted(ViewEvent.objects.values_list('note_id', 'views')),
+            [(self.first.pk, 2), (self.first.pk, 3), (self.second.pk, 3)],
+        )
+        self.assertEqual(ViewEvent.objects.filter(day=timezone.localdate(self.minute)).count(), 3)
+
+    def test_flush_is_one_transaction(self):
+        with mock.patch.object(ViewEvent.objects, 'bulk_create', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                flush_views({(self.first.pk, self.minute): 2})
+        self.assertEqual(self.views(), {self.first.pk: 0, self.second.pk: 0})
+
+    @override_settings(VIEW_COUNTER_DEDUP_TIMEOUT=60)
+    def test_repeat_views_by_one_viewer_are_ignored(self):
+        self.assertTrue(count_view(self.first.pk, 'session'))
+        self.assertFalse(count_view(self.first.pk, 'session'))
+        self.assertTrue(count_view(self.second.pk, 'session'))
+        factory = RequestFactory()
+        self.assertTrue(record_view(factory.get('/', REMOTE_ADDR='10.0.0.1'), self.first.pk))
+        self.assertFalse(record_view(factory.get('/', REMOTE_ADDR='10.0.0.1'), self.first.pk))
+        self.assertTrue(record_view(factory.get('/', REMOTE_ADDR='10.0.0.2'), self.first.pk))
+        view_buffer.flush()
+        self.assertEqual(self.views(), {self.first.pk: 3, self.second.pk: 1})
+
+    @override_settings(VIEW_COUNTER_DEDUP_TIMEOUT=0)
+    def test_every_view_counts_without_dedup(self):
+        for _ in range(3):
+            count_view(self.first.pk, 'session')
+        view_buffer.flush()
+        self.assertEqual(self.views()[self.first.pk], 3)
+
+
+# Заметки и категории меняют обе версии, от которых зависят все ключи
+EVERY_KEY = ('home', 'detail', 'sidebar_categories', 'sidebar_trending')
+
+
+@override_settings(**SYNC_SETTINGS)
+class CacheInvalidationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pw')
+        cls.category = Category.objects.create(name='Работа')
+        cls.note = make_note(cls.author, title='Первая', category=cls.category)
+
+    def setUp(self):
+        cache.clear()
+
+    def keys(self):
+        """Ключи анонимных страниц и фрагментов при текущих версиях"""
+        request = RequestFactory().get(reverse('home'))
+        request.user = AnonymousUser()
+        detail = RequestFactory().get(reverse('note_detail', args=[self.note.pk]))
+        detail.user = AnonymousUser()
+        versions = get_versions()
+        return {
+            'home': page_cache_key(request, views.HomeView.page_cache_versions),
+            'detail': page_cache_key(detail, views.NoteDetailView.page_cache_versions),
+            'sidebar_categories': make_template_fragment_key('sidebar_categories', [versions['categories']]),
+            'sidebar_trending': make_template_fragment_key(
+                'sidebar_trending', [versions['trending'], versions['notes']],
+            ),
+        }
+
+    def assertKeysChange(self, before, *names):
+        after = self.keys()
+        for name in before:
+            if name in names:
+                self.assertNotEqual(after[name], before[name], name)
+            else:
+                self.assertEqual(after[name], before[name], name)
+
+    def test_note_save_and_delete_change_keys(self):
+        before = self.keys()
+        self.note.title = 'Новая'
+        self.note.save()
+        self.assertKeysChange(before, *EVERY_KEY)
+        before = self.keys()
+        make_note(self.author).delete()
+        self.assertKeysChange(before, *EVERY_KEY)
+
+    def test_category_save_and_delete_change_keys(self):
+        before = self.keys()
+        self.category.description = 'Описание'
+        self.category.save()
+        self.assertKeysChange(before, *EVERY_KEY)
+        before = self.keys()
+        Category.objects.create(name='Дом').delete()
+        self.assertKeysChange(before, *EVERY_KEY)
+
+    def test_comment_save_and_delete_change_keys(self):
+        before = self.keys()
+        comment = Comment.objects.create(note=self.note, author=self.author, text='Первый')
+        self.assertKeysChange(before, 'home', 'detail', 'sidebar_trending')
+        before = self.keys()
+        comment.text = 'Исправленный'
+        comment.save()
+        self.assertKeysChange(before, 'home', 'detail', 'sidebar_trending')
+        before = self.keys()
+        comment.delete()
+        self.assertKeysChange(before, 'home', 'detail', 'sidebar_trending')
+
+    def test_unrelated_saves_keep_keys(self):
+        before = self.keys()
+        self.note.views_count = 10
+        self.note.save(update_fields=['views_count'])
+        flush_views({(self.note.pk, timezone.now()): 2})
+        self.author.last_login = timezone.now()
+        self.author.save(update_fields=['last_login'])
+        self.assertKeysChange(before)
+
+    def test_cached_page_shows_changes(self):
+        self.assertNotContains(self.client.get(reverse('home')), 'Вторая')
+        make_note(self.author, title='Вторая')
+        self.assertContains(self.client.get(reverse('home')), 'Вторая')
+        self.note.delete()
+        self.assertNotContains(self.client.get(reverse('home')), 'Первая')
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRoutingTests(SimpleTestCase):
+    # SimpleTestCase: внутри транзакции TestCase чтение всегда идет в основную базу
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+
+    def read_alias(self, request):
+        """База, из которой читает представление за промежуточным слоем"""
+        aliases = []
+
+        def view(request):
+            aliases.append(self.router.db_for_read(Note))
+            return HttpResponse()
+
+        response = ReplicaPinningMiddleware(view)(request)
+        return aliases[0], response
+
+    def test_reads_use_replica_only_inside_safe_requests(self):
+        self.assertEqual(self.router.db_for_read(Note), 'default')
+        alias, response = self.read_alias(self.factory.get('/'))
+        self.assertEqual(alias, 'replica1')
+        self.assertNotIn(PIN_COOKIE_NAME, response.cookies)
+        self.assertEqual(self.router.db_for_write(Note), 'default')
+        with allow_replica_reads():
+            self.assertEqual(self.router.db_for_write(Note), 'default')
+        self.assertFalse(self.router.allow_migrate('replica1', 'notes'))
+        self.assertTrue(self.router.allow_migrate('default', 'notes'))
+
+    def test_unsafe_request_pins_reads_to_primary(self):
+        alias, response = self.read_alias(self.factory.post('/'))
+        self.assertEqual(alias, 'default')
+        self.assertIn(PIN_COOKIE_NAME, response.cookies)
+        self.assertEqual(response.cookies[PIN_COOKIE_NAME]['max-age'], 10)
+        pinned = self.factory.get('/')
+        pinned.COOKIES[PIN_COOKIE_NAME] = '1'
+        self.assertEqual(self.read_alias(pinned)[0], 'default')
+        with allow_replica_reads(), use_primary():
+            self.assertEqual(self.router.db_for_read(Note), 'default')
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas_everything_uses_primary(self):
+        alias, response = self.read_alias(self.factory.get('/'))
+        self.assertEqual(alias, 'default')
+        self.assertNotIn(PIN_COOKIE_NAME, self.read_alias(self.factory.post('/'))[1].cookies)
+
+    async def test_async_requests(self):
+        aliases = []
+
+        async def view(request):
+            aliases.append(self.router.db_for_read(Note))
+            # Контекст с разрешением переходит и в синхронный код
+            aliases.append(await sync_to_async(self.router.db_for_read)(Note))
+            return HttpResponse()
+
+        middleware = ReplicaPinningMiddleware(view)
+        response = await middleware(self.factory.get('/'))
+        self.assertNotIn(PIN_COOKIE_NAME, response.cookies)
+        response = await middleware(self.factory.post('/'))
+        self.assertIn(PIN_COOKIE_NAME, response.cookies)
+        self.assertEqual(aliases, ['replica1', 'replica1', 'default', 'default'])
+        self.assertEqual(self.router.db_for_read(Note), 'default')
+
+
+@override_settings(PAGE_CACHE_TIMEOUT=0, FRAGMENT_CACHE_TIMEOUT=0, **SYNC_SETTINGS)
+class AsyncViewTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pw')
+        cls.other = User.objects.create_user('other', password='pw')
+        cls.category = Category.objects.create(name='Работа')
+        cls.notes = [
+            make_note(cls.author, title=f'Заметка {number}', category=cls.category, is_public=number % 3 != 0)
+            for number in range(14)
+        ]
+        make_note(cls.other, title='Чужая приватная', is_public=False)
+        for note in cls.notes[:3]:
+            set_note_tags(note, ['общий'])
+        Comment.objects.create(note=cls.notes[1], author=cls.other, text='Комментарий')
+        rebuild_related(engine='python')
+
+    def setUp(self):
+        cache.clear()
+
+    def render(self, view_class, user, path='/', **kwargs):
+        """Код ответа и текст страницы без случайного CSRF-токена"""
+        request = RequestFactory().get(path)
+        request.user = user
+        view = view_class.as_view()
+        if view_class.view_is_async:
+            view = async_to_sync(view)
+        response = view(request, **kwargs).render()
+        return response.status_code, re.sub(r'name="csrfmiddlewaretoken" value="[^"]+"', '', response.content.decode())
+
+    def assertSameOutput(self, name, user, path='/', **kwargs):
+        self.assertTrue(getattr(async_views, name).view_is_async)
+        expected = self.render(getattr(views, name), user, path, **kwargs)
+        self.assertEqual(self.render(getattr(async_views, name), user, path, **kwargs), expected)
+        return expected[1]
+
+    def test_lists_match_sync_views(self):
+        for user in (AnonymousUser(), self.author, self.other):
+            self.assertSameOutput('HomeView', user)
+            self.assertSameOutput('HomeView', user, f'/?category={self.category.pk}')
+            self.assertSameOutput('CategoryNotesView', user, pk=self.category.pk)
+        content = self.assertSameOutput('MyNotesView', self.author)
+        self.assertIn('Заметка 13', content)
+        # Вторая страница по курсору
+        cursor = re.search(r'\?cursor=([\w-]+)', content).group(1)
+        self.assertIn('Заметка 0', self.assertSameOutput('MyNotesView', self.author, f'/?cursor={cursor}'))
+
+    @mock.patch('notes.async_views.record_view_later')
+    @mock.patch('notes.views.record_view', return_value=False)
+    def test_detail_matches_sync_view(self, record_view, record_view_later):
+        # Синхронная страница показывает счетчик с текущим просмотром, асинхронная — без него
+        note = self.notes[1]
+        content = self.assertSameOutput('NoteDetailView', AnonymousUser(), pk=note.pk)
+        self.assertIn('Комментарий', content)
+        self.assertIn(self.notes[2].title, content)
+        self.assertSameOutput('NoteDetailView', self.author, pk=self.notes[0].pk)
+        self.assertEqual(record_view_later.call_count, 2)
+        with self.assertRaises(Http404):
+            self.render(async_views.NoteDetailView, self.other, pk=self.notes[0].pk)
+
+    @override_settings(VIEW_COUNTER_DEDUP_TIMEOUT=60)
+    def test_record_view_later_counts_in_background(self):
+        view_buffer.flush()
+        note = self.notes[1]
+        for address in ('10.0.0.1', '10.0.0.1', '10.0.0.2'):
+            record_view_later(RequestFactory().get('/', REMOTE_ADDR=address), note.pk)
+        # Очередь исполнителя последовательна: пустая задача ждет предыдущие
+        _view_executor.submit(lambda: None).result()
+        view_buffer.flush()
+        note.refresh_from_db()
+        self.assertEqual(note.views_count, 2)
+
+
+class AnalyticsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pw')
+        cls.category = Category.objects.create(name='Работа')
+        cls.note = make_note(cls.author, category=cls.category)
+        cls.hidden = make_note(cls.author, is_public=False)
+
+    def setUp(self):
+        # Местное время (TIME_ZONE): граница суток не совпадает с UTC
+        self.now = self.local(2026, 3, 12, 12)
+
+    def local(self, *args):
+        return timezone.make_aware(datetime(*args))
+
+    def event(self, note, moment, views=1):
+        ViewEvent.objects.create(note_id=note.pk, day=timezone.localdate(moment), viewed_at=moment, views=views)
+
+    def stats(self):
+        return (
+            sorted(HourlyViewStat.objects.values_list('dimension', 'object_id', 'bucket', 'views')),
+            sorted(DailyViewStat.objects.values_list('dimension', 'object_id', 'day', 'views')),
+            list(TrendingNote.objects.values_list('rank', 'note_id', 'views')),
+        )
+
+    def test_hour_and_day_boundaries(self):
+        self.event(self.note, self.local(2026, 3, 10, 22, 59), 2)
+        self.event(self.note, self.local(2026, 3, 10, 23, 0), 3)
+        self.event(self.note, self.local(2026, 3, 10, 23, 59), 4)
+        self.event(self.note, self.local(2026, 3, 11, 0, 0), 5)
+        rollup_views(self.now)
+        hourly = HourlyViewStat.objects.filter(dimension=ViewStat.NOTE, object_id=self.note.pk)
+        self.assertEqual(
+            {timezone.localtime(bucket).hour: views for bucket, views in hourly.values_list('bucket', 'views')},
+            {22: 2, 23: 7, 0: 5},
+        )
+        for dimension, object_id in (
+            (ViewStat.NOTE, self.note.pk), (ViewStat.CATEGORY, self.category.pk), (ViewStat.AUTHOR, self.author.pk),
+        ):
+            self.assertEqual(
+                dict(DailyViewStat.objects.filter(dimension=dimension, object_id=object_id).values_list('day', 'views')),
+                {date(2026, 3, 10): 9, date(2026, 3, 11): 5},
+            )
+
+    def test_rollup_is_idempotent(self):
+        self.event(self.note, self.local(2026, 3, 11, 10, 15), 2)
+        self.event(self.note, self.local(2026, 3, 12, 11, 30), 3)
+        self.event(self.hidden, self.local(2026, 3, 12, 11, 45), 10)
+        first = rollup_views(self.now)
+        stats = self.stats()
+        self.assertEqual(stats[2], [(1, self.note.pk, 5)])
+        second = rollup_views(self.now)
+        self.assertEqual(self.stats(), stats)
+        self.assertEqual(second['trending'], first['trending'])
+        # Опоздавшие события последних часов учитываются один раз
+        self.event(self.note, self.local(2026, 3, 12, 11, 50), 1)
+        rollup_views(self.now)
+        rollup_views(self.now)
+        self.assertEqual(
+            DailyViewStat.objects.get(dimension=ViewStat.NOTE, object_id=self.note.pk, day=date(2026, 3, 12)).views, 4,
+        )
+        self.assertEqual(list(TrendingNote.objects.values_list('note_id', 'views')), [(self.note.pk, 6)])
+
+    @override_settings(VIEW_EVENT_RETENTION_DAYS=30, HOURLY_VIEW_STAT_RETENTION_DAYS=35)
+    def test_purge_keeps_rolled_up_stats(self):
+        old = self.local(2026, 1, 20, 15)
+        self.event(self.note, old, 4)
+        self.event(self.note, self.local(2026, 2, 20, 15), 2)
+        self.event(self.note, self.local(2026, 3, 12, 9), 1)
+        result = rollup_views(self.now)
+        self.assertEqual((result['purged_events'], result['purged_hourly']), (1, 3))
+        self.assertEqual(ViewEvent.objects.count(), 2)
+        self.assertFalse(HourlyViewStat.objects.filter(bucket__lt=self.local(2026, 2, 1)).exists())
+        rollup_views(self.now)
+        self.assertEqual(
+            dict(DailyViewStat.objects.filter(dimension=ViewStat.NOTE).values_list('day', 'views')),
+            {date(2026, 1, 20): 4, date(2026, 2, 20): 2, date(2026, 3, 12): 1},
+        )
+        self.assertEqual(top_viewed(ViewStat.AUTHOR, 60, 5, today=date(2026, 3, 12)), [(self.author.pk, 7)])
+
+
+class PurgeCssTests(SimpleTestCase):
+
+    def test_unused_rules_and_selectors_are_removed(self):
+        css = '.used{color:red}\n.unused{color:blue}\n.used,.unused > p{margin:0}\np{padding:0}'
+        self.assertEqual(purge_css(css, {'used'}), '.used{color:red}.used{margin:0}p{padding:0}')
+
+    def test_nested_at_rules(self):
+        css = (
+            '@media (min-width: 768px){.used{color:red}.unused{color:blue}}'
+            '@supports (display:grid){@media print{.unused{color:blue}}}'
+            '@font-face{font-family:x;src:url(x.woff)}'
+            '@import url("x.css");'
+        )
+        self.assertEqual(
+            purge_css(css, {'used'}),
+            '@media (min-width: 768px){.used{color:red}}'
+            '@font-face{font-family:x;src:url(x.woff)}'
+            '@import url("x.css");',
+        )
+
+    def test_not_and_attribute_selectors(self):
+        css = (
+            '.used:not(.unused){a:1}'
+            '.unused:not(.used){a:2}'
+            '.used[data-state=".unused"]{a:3}'
+            '[class*="col-"]{a:4}'
+            '.used:is(.unused, .other) span{a:5}'
+        )
+        self.assertEqual(
+            purge_css(css, {'used'}),
+            '.used:not(.unused){a:1}.used[data-state=".unused"]{a:3}[class*="col-"]{a:4}'
+            '.used:is(.unused, .other) span{a:5}',
+        )
+
+    def test_escaped_class_names_are_kept(self):
+        css = '.md\\:flex{display:flex}.w-1\\/2{width:50%}.unused{a:1}'
+        self.assertEqual(purge_css(css, set()), '.md\\:flex{display:flex}.w-1\\/2{width:50%}')
+
+    def test_comments(self):
+        css = '/*! Bootstrap | MIT */\n/* обычный комментарий */.unused{a:1}/* .used{a:2} */.used{content:"/* }"}'
+        self.assertEqual(purge_css(css, {'used'}), '/*! Bootstrap | MIT */\n.used{content:"/* }"}')
+
+    def test_classes_used_only_in_scripts(self):
+        with tempfile.TemporaryDirectory() as source:
+            with open(os.path.join(source, 'menu.js'), 'w', encoding='utf-8') as file:
+                file.write("button.addEventListener('click', () => menu.classList.toggle('is-open'));")
+            used = used_tokens([source])
+        self.assertIn('is-open', used)
+        self.assertEqual(purge_css('.is-open{display:block}.is-closed{display:none}', used), '.is-open{display:block}')
+
+
+class StaticServeTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        for name, data in (('app.css', b'plain'), ('app.css.gz', b'gzip'), ('app.css.br', b'brotli'), ('logo.txt', b'x')):
+            with open(os.path.join(self.root, name), 'wb') as file:
+                file.write(data)
+        self.factory = RequestFactory()
+
+    def get(self, path, encoding=None):
+        headers = {'HTTP_ACCEPT_ENCODING': encoding} if encoding is not None else {}
+        with self.settings(STATIC_ROOT=self.root):
+            response = serve(self.factory.get('/static/' + path, **headers), path)
+        self.addCleanup(response.close)
+        return response
+
+    def test_encoding_choice(self):
+        cases = [
+            ('gzip, deflate, br', b'brotli', 'br'),
+            ('gzip', b'gzip', 'gzip'),
+            ('br;q=0, gzip;q=0.5', b'gzip', 'gzip'),
+            ('BR', b'brotli', 'br'),
+            ('identity', b'plain', None),
+            (None, b'plain', None),
+        ]
+        for encoding, content, content_encoding in cases:
+            with self.subTest(encoding=encoding):
+                response = self.get('app.css', encoding)
+                self.assertEqual(b''.join(response.streaming_content), content)
+                self.assertEqual(response.get('Content-Encoding'), content_encoding)
+                self.assertEqual(response['Content-Type'], 'text/css')
+                self.assertIn('Accept-Encoding', response['Vary'])
+        # Сжатых вариантов нет — отдается исходный файл
+        self.assertNotIn('Content-Encoding', self.get('logo.txt', 'gzip, br'))
+
+    def test_cache_headers_and_missing_files(self):
+        with mock.patch.dict(static_files.__dict__, {'hashed_names': {'app.css'}}):
+            self.assertIn('immutable', self.get('app.css')['Cache-Control'])
+        self.assertNotIn('immutable', self.get('app.css')['Cache-Control'])
+        for path in ('missing.css', '../secret.txt'):
+            with self.assertRaises(Http404), self.settings(STATIC_ROOT=self.root):
+                serve(self.factory.get('/static/' + path), path)
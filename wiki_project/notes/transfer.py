@@ -0,0 +1,347 @@
+"""
+Потоковый экспорт и импорт заметок.
+
+Форматы:
+
+* ``jsonl`` — по одной заметке в строке JSON;
+* ``markdown`` — tar-архив из файлов ``.md``: заголовок в начале файла
+  (front matter между строками ``---``, значения записаны как JSON) и
+  текст заметки.
+
+Экспорт читает заметки через ``iterator(chunk_size=...)`` и отдает
+данные генератором, поэтому расход памяти не зависит от числа заметок.
+Импорт читает источник последовательно и сохраняет заметки пачками:
+каждая пачка — одна транзакция, после нее вызывается ``on_commit`` со
+смещением в байтах, с которого продолжается следующий запуск.
+"""
+import json
+import math
+import tarfile
+from collections import Counter
+from datetime import datetime
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F, Prefetch
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .caching import bump_version
+from .models import Category, Note, NoteRevision, NoteTag, Tag
+from .related import schedule_related_update
+from .rendering import RENDERER_VERSION, render_note, resolve_wiki_links_by_author, wiki_link_titles
+from .revisions import initial_revision
+from .search import update_index
+from .tags import normalize_tag_name, resolve_tags
+
+FORMATS = ('jsonl', 'markdown')
+CONTENT_TYPES = {'jsonl': 'application/x-ndjson', 'markdown': 'application/x-tar'}
+EXTENSIONS = {'jsonl': 'jsonl', 'markdown': 'tar'}
+
+EXPORT_CHUNK_SIZE = 1000
+TAR_BLOCK = tarfile.BLOCKSIZE
+FRONT_MATTER = '---'
+RECORD_FIELDS = ('title', 'author', 'category', 'tags', 'is_public', 'created_at', 'updated_at')
+
+
+class TransferError(Exception):
+    """Ошибка формата источника импорта"""
+
+
+# --- Экспорт --------------------------------------------------------------
+
+def export_queryset(author=None):
+    """Заметки для экспорта в порядке id; ``author`` — только его заметки"""
+    queryset = Note.objects.all()
+    if author is not None:
+        queryset = queryset.filter(author=author)
+    return (
+        queryset.select_related('author', 'category')
+        .only(
+            'pk', 'title', 'content', 'is_public', 'created_at', 'updated_at',
+            'author__username', 'category__name',
+        )
+        .prefetch_related(
+            Prefetch('note_tags', queryset=NoteTag.objects.select_related('tag').only('note_id', 'tag__name'))
+        )
+        .order_by('pk')
+    )
+
+
+def note_record(note):
+    return {
+        'id': note.pk,
+        'title': note.title,
+        'author': note.author.username,
+        'category': note.category.name if note.category_id else None,
+        'tags': sorted(link.tag.name for link in note.note_tags.all()),
+        'is_public': note.is_public,
+        'created_at': note.created_at.isoformat(),
+        'updated_at': note.updated_at.isoformat(),
+        'content': note.content,
+    }
+
+
+def iter_records(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    # С chunk_size iterator() подгружает теги отдельным запросом на пачку
+    for note in queryset.iterator(chunk_size=chunk_size):
+        yield note_record(note)
+
+
+def export_jsonl(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """Строки JSONL в байтах"""
+    for record in iter_records(queryset, chunk_size):
+        yield json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+def markdown_document(record):
+    """Текст файла .md: front matter и содержимое заметки"""
+    lines = [FRONT_MATTER]
+    lines.extend(
+        f'{name}: {json.dumps(record[name], ensure_ascii=False)}'
+        for name in ('id',) + RECORD_FIELDS
+    )
+    lines.append(FRONT_MATTER)
+    return '\n'.join(lines) + '\n\n' + record['content']
+
+
+def markdown_filename(record):
+    slug = slugify(record['title'], allow_unicode=True)[:80] or 'note'
+    return f'notes/{record["id"]:08d}-{slug}.md'
+
+
+def tar_member(name, data, mtime):
+    """Заголовок и данные одного файла tar, выровненные по блокам"""
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    header = info.tobuf(format=tarfile.PAX_FORMAT, encoding='utf-8', errors='strict')
+    padding = b'\0' * (-len(data) % TAR_BLOCK)
+    return header + data + padding
+
+
+def export_markdown(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """tar-архив Markdown-файлов, формируемый по одному файлу"""
+    for record in iter_records(queryset, chunk_size):
+        data = markdown_document(record).encode('utf-8')
+        yield tar_member(markdown_filename(record), data, datetime.fromisoformat(record['updated_at']).timestamp())
+    # Конец архива — два пустых блока
+    yield b'\0' * TAR_BLOCK * 2
+
+
+def export_stream(format, queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    if format == 'jsonl':
+        return export_jsonl(queryset, chunk_size)
+    return export_markdown(queryset, chunk_size)
+
+
+# --- Чтение источника -----------------------------------------------------
+
+def read_jsonl(source, offset=0):
+    """Пары (запись, смещение следующей записи) из бинарного файла JSONL"""
+    source.seek(offset)
+    for number, line in enumerate(iter(source.readline, b''), 1):
+        offset += len(line)
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            raise TransferError(f'строка {number}: {error}')
+        yield record, offset
+
+
+def parse_markdown(text, name=''):
+    """Запись из файла .md с front matter"""
+    lines = text.split('\n')
+    if not lines or lines[0].strip() != FRONT_MATTER:
+        raise TransferError(f'{name}: нет front matter')
+    record = {}
+    for index, line in enumerate(lines[1:], 1):
+        if line.strip() == FRONT_MATTER:
+            break
+        key, separator, value = line.partition(':')
+        if not separator:
+            raise TransferError(f'{name}: строка {index + 1} без «:»')
+        try:
+            record[key.strip()] = json.loads(value)
+        except ValueError:
+            # Значение, записанное вручную без кавычек
+            record[key.strip()] = value.strip()
+    else:
+        raise TransferError(f'{name}: front matter не закрыт')
+    record['content'] = '\n'.join(lines[index + 1:]).lstrip('\n')
+    return record
+
+
+def read_markdown(source, offset=0):
+    """Пары (запись, смещение следующего файла) из tar-архива"""
+    source.seek(offset)
+    # Только несжатый архив: смещения в нем совпадают с позициями в файле
+    with tarfile.open(fileobj=source, mode='r|') as archive:
+        for member in archive:
+            if not member.isfile() or not member.name.endswith('.md'):
+                continue
+            text = archive.extractfile(member).read().decode('utf-8')
+            next_offset = offset + member.offset_data + math.ceil(member.size / TAR_BLOCK) * TAR_BLOCK
+            yield parse_markdown(text, member.name), next_offset
+
+
+def read_records(source, format, offset=0):
+    if format == 'jsonl':
+        return read_jsonl(source, offset)
+    return read_markdown(source, offset)
+
+
+def detect_format(path):
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson', '.json')) else 'markdown'
+
+
+# --- Импорт ---------------------------------------------------------------
+
+def parse_datetime_value(value, default):
+    if not value:
+        return default
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return default
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+class NoteImporter:
+    """
+    Сохранение записей пачками.
+
+    Авторы ищутся по имени; записи неизвестных авторов получают
+    ``default_author`` или пропускаются. Категории и теги находятся и
+    создаются одним запросом на пачку. Записи, уже импортированные
+    (тот же автор, заголовок и дата создания) или повторяющиеся внутри
+    пачки, пропускаются — повторный запуск после сбоя не создает дублей.
+    Похожие заметки для новых заметок с тегами пересчитываются после
+    коммита пачки, как при правке тегов.
+    """
+
+    def __init__(self, batch_size=1000, default_author=None, index=True):
+        self.batch_size = batch_size
+        self.default_author = default_author
+        self.index = index
+        self.stats = Counter()
+
+    def run(self, records, on_commit=None):
+        """``records`` — пары (запись, смещение); ``on_commit(offset)`` после каждой пачки"""
+        batch, offset = [], None
+        for record, offset in records:
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                self.save_batch(batch)
+                batch = []
+                if on_commit:
+                    on_commit(offset)
+        if batch:
+            self.save_batch(batch)
+        if on_commit and offset is not None:
+            on_commit(offset)
+        if self.stats['created']:
+            bump_version('notes', 'categories')
+        return self.stats
+
+    def save_batch(self, records):
+        now = timezone.now()
+        with transaction.atomic():
+            authors = self.resolve_authors(records)
+            categories = self.resolve_categories(records)
+            tags = resolve_tags(
+                normalize_tag_name(name) for record in records for name in record.get('tags') or ()
+            )
+            notes, note_tags = [], []
+            for record in records:
+                author_id = authors.get(record.get('author'), getattr(self.default_author, 'pk', None))
+                if author_id is None or not record.get('title'):
+                    self.stats['skipped'] += 1
+                    continue
+                created_at = parse_datetime_value(record.get('created_at'), now)
+                note = Note(
+                    title=str(record['title'])[:200],
+                    content=record.get('content') or '',
+                    author_id=author_id,
+                    category_id=categories.get(record.get('category')),
+                    is_public=bool(record.get('is_public')),
+                    created_at=created_at,
+                )
+                notes.append(note)
+                note_tags.append({
+                    tags[name].pk
+                    for name in (normalize_tag_name(raw) for raw in record.get('tags') or ())
+                    if name in tags
+                })
+            notes, note_tags = self.exclude_existing(notes, note_tags)
+            self.render(notes)
+
+            Note.objects.bulk_create(notes)
+            NoteRevision.objects.bulk_create([initial_revision(note) for note in notes])
+            NoteTag.objects.bulk_create(
+                [NoteTag(note_id=note.pk, tag_id=tag_id) for note, tag_ids in zip(notes, note_tags) for tag_id in tag_ids],
+                ignore_conflicts=True,
+            )
+            # bulk_create не отправляет сигналов: счетчики и похожие заметки обновляются здесь
+            self.increment(Category, Counter(note.category_id for note in notes if note.category_id))
+            self.increment(Tag, Counter(tag_id for tag_ids in note_tags for tag_id in tag_ids))
+            schedule_related_update(note.pk for note, tag_ids in zip(notes, note_tags) if tag_ids)
+        if self.index and notes:
+            update_index([note.pk for note in notes])
+        self.stats['created'] += len(notes)
+
+    def resolve_authors(self, records):
+        names = {record.get('author') for record in records if record.get('author')}
+        return dict(User.objects.filter(username__in=names).values_list('username', 'pk'))
+
+    def resolve_categories(self, records):
+        names = {record['category'] for record in records if record.get('category')}
+        if not names:
+            return {}
+        categories = dict(Category.objects.filter(name__in=names).values_list('name', 'pk'))
+        missing = names - categories.keys()
+        if missing:
+            Category.objects.bulk_create([Category(name=name) for name in missing], ignore_conflicts=True)
+            categories.update(Category.objects.filter(name__in=missing).values_list('name', 'pk'))
+            self.stats['categories'] += len(missing)
+        return categories
+
+    def exclude_existing(self, notes, note_tags):
+        """Убирает записи, уже сохраненные предыдущим запуском или повторенные в пачке"""
+        if not notes:
+            return notes, note_tags
+        seen = set(
+            Note.objects.filter(
+                author_id__in={note.author_id for note in notes},
+                created_at__in={note.created_at for note in notes},
+            ).values_list('author_id', 'created_at', 'title')
+        )
+        kept = []
+        for note, tag_ids in zip(notes, note_tags):
+            key = (note.author_id, note.created_at, note.title)
+            if key not in seen:
+                seen.add(key)
+                kept.append((note, tag_ids))
+        self.stats['duplicates'] += len(notes) - len(kept)
+        return [note for note, _ in kept], [tag_ids for _, tag_ids in kept]
+
+    def render(self, notes):
+        """HTML и анонсы пачки с одним запросом на вики-ссылки"""
+        titles = set().union(*(wiki_link_titles(note.content) for note in notes))
+        links = resolve_wiki_links_by_author(titles, {note.author_id for note in notes})
+        for note in notes:
+            note.content_html, note.excerpt = render_note(note.content, links=links[note.author_id])
+            note.rendered_version = RENDERER_VERSION
+
+    def increment(self, model, amounts):
+        """Одним UPDATE на каждое значение приращения"""
+        by_amount = {}
+        for pk, amount in amounts.items():
+            by_amount.setdefault(amount, []).append(pk)
+        for amount, pks in by_amount.items():
+            model.objects.filter(pk__in=pks).update(notes_count=F('notes_count') + amount)
@@ -1,14 +1,24 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# Страницы чтения: асинхронные версии для запуска под ASGI
+read_views = async_views if getattr(settings, 'NOTES_ASYNC_VIEWS', False) else views
 
 urlpatterns = [
-    path('', views.HomeView.as_view(), name='home'),
-    path('note/<int:pk>/', views.NoteDetailView.as_view(), name='note_detail'),
+    path('', read_views.HomeView.as_view(), name='home'),
+    path('note/<int:pk>/', read_views.NoteDetailView.as_view(), name='note_detail'),
     path('note/new/', views.NoteCreateView.as_view(), name='note_create'),
     path('note/<int:pk>/edit/', views.NoteUpdateView.as_view(), name='note_update'),
+    path('note/<int:pk>/history/', views.NoteHistoryView.as_view(), name='note_history'),
+    path('note/<int:pk>/history/<int:number>/', views.NoteRevisionView.as_view(), name='note_revision'),
+    path('note/<int:pk>/diff/', views.NoteDiffView.as_view(), name='note_diff'),
     path('note/<int:pk>/delete/', views.NoteDeleteView.as_view(), name='note_delete'),
     path('note/<int:pk>/comment/', views.add_comment, name='add_comment'),
-    path('my-notes/', views.MyNotesView.as_view(), name='my_notes'),
-    path('category/<int:pk>/', views.CategoryNotesView.as_view(), name='category_notes'),
+    path('note/<int:pk>/comments/', views.note_comments, name='note_comments'),
+    path('my-notes/', read_views.MyNotesView.as_view(), name='my_notes'),
+    path('category/<int:pk>/', read_views.CategoryNotesView.as_view(), name='category_notes'),
+    path('export/', views.export_notes, name='export_notes'),
     path('register/', views.register, name='register'),
+    path('instrumentation/queries/', views.query_report, name='query_report'),
 ]
\ No newline at end of file
@@ -1,87 +1,144 @@
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
-from django.urls import reverse_lazy
-from django.db.models import Q, Count
+from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView, TemplateView
+from django.template.loader import render_to_string
+from django.urls import reverse, reverse_lazy
 from django.contrib import messages
-from .models import Note, Category, Tag, NoteTag, Comment
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from .models import Note, Category, Comment
+from .analytics import trending_notes
 from .forms import NoteForm, CommentForm, UserRegisterForm, SearchForm
+from .caching import AnonymousPageCacheMixin, ConditionalGetMixin, FragmentCacheMixin
+from .instrumentation import get_report
+from .pagination import KeysetPaginationMixin, KeysetPaginator
+from .related import related_notes
+from .rendering import render_note
+from .revisions import REVISION_FIELDS, diff_lines, record_revision, revision_text
+from .search import search_notes
+from .tags import parse_tag_names, set_note_tags
+from .transfer import CONTENT_TYPES, EXTENSIONS, FORMATS, export_queryset, export_stream
+from .viewcount import record_view
 
 
-class HomeView(ListView):
+class HomeView(ConditionalGetMixin, AnonymousPageCacheMixin, FragmentCacheMixin, KeysetPaginationMixin, ListView):
     """Главная страница со списком заметок"""
     model = Note
     template_name = 'notes/home.html'
     context_object_name = 'notes'
     paginate_by = 10
+    page_cache_versions = conditional_versions = ('notes', 'categories', 'trending')
     
-    def get_queryset(self):
-        queryset = Note.objects.select_related('author', 'category').annotate(
-            comments_count=Count('comments')
-        )
-        
-        # Если пользователь авторизован, показываем его заметки + публичные
-        if self.request.user.is_authenticated:
-            queryset = queryset.filter(
-                Q(author=self.request.user) | Q(is_public=True)
-            )
-        else:
-            # Неавторизованным показываем только публичные
-            queryset = queryset.filter(is_public=True)
-        
-        # Поиск
-        search_query = self.request.GET.get('query')
-        if search_query:
-            queryset = queryset.filter(
-                Q(title__icontains=search_query) |
-                Q(content__icontains=search_query)
-            )
+    def get_base_queryset(self):
+        queryset = Note.objects.all()
         
         # Фильтр по категории
         category_id = self.request.GET.get('category')
         if category_id:
             queryset = queryset.filter(category_id=category_id)
+        return queryset
+    
+    def get_queryset(self):
+        # Авторизованным показываем их заметки + публичные, остальным — только публичные
+        queryset = self.get_base_queryset().visible_to(self.request.user)
+        
+        # Поиск по инвертированному индексу с ранжированием
+        search_query = self.request.GET.get('query')
+        if search_query:
+            queryset = search_notes(queryset, search_query)
         
-        return queryset.distinct()
+        return queryset.cards()
+    
+    def get_keyset_ordering(self):
+        # Результаты поиска упорядочены по релевантности
+        if self.request.GET.get('query'):
+            return ('-search_rank', '-created_at', '-id')
+        return super().get_keyset_ordering()
+    
+    def get_keyset_streams(self, queryset):
+        # Свои и чужие публичные заметки читаются по разным индексам
+        if self.request.GET.get('query'):
+            return None
+        return [stream.cards() for stream in self.get_base_queryset().visibility_streams(self.request.user)]
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['search_form'] = SearchForm(self.request.GET)
-        context['categories'] = Category.objects.annotate(
-            notes_count=Count('notes')
-        )
+        context['categories'] = Category.objects.all()
+        context['trending'] = trending_notes()
         return context
 
 
-class NoteDetailView(DetailView):
+class NoteDetailView(ConditionalGetMixin, AnonymousPageCacheMixin, DetailView):
     """Детальная страница заметки"""
     model = Note
     template_name = 'notes/note_detail.html'
     context_object_name = 'note'
     
     def get_queryset(self):
-        queryset = super().get_queryset()
-        # Авторизованный пользователь видит свои и публичные заметки
-        if self.request.user.is_authenticated:
-            return queryset.filter(
-                Q(author=self.request.user) | Q(is_public=True)
-            )
-        # Неавторизованные видят только публичные
-        return queryset.filter(is_public=True)
+        # Авторизованный пользователь видит свои и публичные заметки,
+        # неавторизованные — только публичные
+        return super().get_queryset().visible_to(self.request.user)
     
     def get_object(self):
         obj = super().get_object()
-        # Увеличиваем счетчик просмотров
-        obj.increment_views()
+        # Заметки до rerender_notes (например, сразу после миграции)
+        obj.ensure_rendered()
+        # Просмотр попадает в буфер и будет записан в базу фоновым потоком
+        if record_view(self.request, obj.pk):
+            obj.views_count += 1
         return obj
     
+    def page_cache_hit(self, request, *args, **kwargs):
+        # Страница отдана из кэша, но просмотр всё равно учитывается
+        record_view(request, kwargs['pk'])
+    
+    def conditional_hit(self, request, *args, **kwargs):
+        # Ответ 304 — тоже просмотр
+        self.page_cache_hit(request, *args, **kwargs)
+    
+    # Версия notes меняется и при правке тегов, комментариев и имени автора,
+    # которые видны на странице, но не меняют updated_at заметки
+    page_cache_versions = conditional_versions = ('notes', 'categories', 'related')
+    
+    def get_validators(self, request, *args, **kwargs):
+        # Дата изменения, число и время последнего комментария — без текста заметки
+        latest_comment = (
+            Comment.objects.filter(note=OuterRef('pk')).order_by('-created_at').values('created_at')[:1]
+        )
+        rows = list(
+            Note.objects.filter(pk=kwargs['pk']).visible_to(request.user)
+            .annotate(latest_comment=Subquery(latest_comment))
+            .values_list('updated_at', 'comments_count', 'latest_comment')
+        )
+        if not rows:
+            return None
+        updated_at, comments_count, latest_comment = rows[0]
+        parts, _ = super().get_validators(request, *args, **kwargs)
+        parts += [updated_at.isoformat(), comments_count, latest_comment and latest_comment.isoformat()]
+        return parts, max(updated_at, latest_comment or updated_at)
+    
+    def get_comments_page(self):
+        """Первая порция комментариев; общее число берется из comments_count"""
+        paginator = comment_paginator(self.object.pk, getattr(settings, 'COMMENTS_FIRST_PAGE_SIZE', 20))
+        return paginator.page()
+    
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['comment_form'] = CommentForm()
-        context['comments'] = self.object.comments.select_related('author')
-        context['tags'] = self.object.note_tags.select_related('tag')
+        # Асинхронное представление передает уже загруженные данные
+        if 'comments' not in context:
+            context['comments'] = self.get_comments_page()
+        context['more_comments_url'] = more_comments_url(self.object.pk, context['comments'])
+        if 'tags' not in context:
+            context['tags'] = self.object.note_tags.select_related('tag')
+        if 'related' not in context:
+            context['related'] = related_notes(self.object, self.request.user)
         return context
 
 
@@ -95,14 +152,10 @@ class NoteCreateView(LoginRequiredMixin, CreateView):
     def form_valid(self, form):
         form.instance.author = self.request.user
         response = super().form_valid(form)
+        record_revision(self.object, self.request.user)
         
         # Обработка тегов
-        tags_string = form.cleaned_data.get('tags', '')
-        if tags_string:
-            tag_names = [tag.strip() for tag in tags_string.split(',') if tag.strip()]
-            for tag_name in tag_names:
-                tag, created = Tag.objects.get_or_create(name=tag_name)
-                NoteTag.objects.create(note=self.object, tag=tag)
+        set_note_tags(self.object, parse_tag_names(form.cleaned_data.get('tags', '')))
         
         messages.success(self.request, 'Заметка успешно создана!')
         return response
@@ -120,20 +173,97 @@ class NoteUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     
     def form_valid(self, form):
         response = super().form_valid(form)
+        if REVISION_FIELDS & set(form.changed_data):
+            record_revision(self.object, self.request.user)
         
-        # Обновление тегов
-        self.object.note_tags.all().delete()
-        tags_string = form.cleaned_data.get('tags', '')
-        if tags_string:
-            tag_names = [tag.strip() for tag in tags_string.split(',') if tag.strip()]
-            for tag_name in tag_names:
-                tag, created = Tag.objects.get_or_create(name=tag_name)
-                NoteTag.objects.create(note=self.object, tag=tag)
+        # Обновление тегов: меняется только разница
+        set_note_tags(self.object, parse_tag_names(form.cleaned_data.get('tags', '')))
         
         messages.success(self.request, 'Заметка успешно обновлена!')
         return response
 
 
+class NoteRevisionsMixin:
+    """Заметка, история которой просматривается, с учетом ее видимости"""
+    
+    def get_note(self):
+        if not hasattr(self, 'note'):
+            notes = Note.objects.visible_to(self.request.user).defer('content', 'content_html')
+            self.note = get_object_or_404(notes, pk=self.kwargs['pk'])
+        return self.note
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['note'] = self.get_note()
+        return context
+
+
+class NoteHistoryView(NoteRevisionsMixin, KeysetPaginationMixin, ListView):
+    """Список ревизий заметки"""
+    template_name = 'notes/note_history.html'
+    context_object_name = 'revisions'
+    paginate_by = 50
+    keyset_ordering = ('-number',)
+    
+    def get_queryset(self):
+        return self.get_note().revisions.select_related('author').defer('data')
+
+
+class NoteRevisionView(NoteRevisionsMixin, DetailView):
+    """Заметка в состоянии на момент ревизии"""
+    template_name = 'notes/note_revision.html'
+    context_object_name = 'revision'
+    
+    def get_object(self):
+        return get_object_or_404(
+            self.get_note().revisions.select_related('author'), number=self.kwargs['number']
+        )
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Старые ревизии открывают редко, их HTML не хранится
+        context['content_html'], _ = render_note(revision_text(self.object), self.get_note().author_id)
+        return context
+
+
+class NoteDiffView(NoteRevisionsMixin, TemplateView):
+    """Разница между двумя ревизиями заметки (?from=&to=, по умолчанию — последняя правка)"""
+    template_name = 'notes/note_diff.html'
+    
+    def get_numbers(self):
+        try:
+            new = int(self.request.GET['to']) if self.request.GET.get('to') else None
+            old = int(self.request.GET['from']) if self.request.GET.get('from') else None
+        except ValueError:
+            raise Http404('Неверный номер ревизии')
+        if new is None:
+            new = self.get_note().revisions.order_by('-number').values_list('number', flat=True).first()
+            if new is None:
+                raise Http404('У заметки нет ревизий')
+        if old is None:
+            old = max(new - 1, 1)
+        return old, new
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        old_number, new_number = self.get_numbers()
+        revisions = {
+            revision.number: revision
+            for revision in self.get_note().revisions.select_related('author').filter(
+                number__in=[old_number, new_number]
+            )
+        }
+        if old_number not in revisions or new_number not in revisions:
+            raise Http404('Ревизия не найдена')
+        old, new = revisions[old_number], revisions[new_number]
+        context.update(
+            old=old,
+            new=new,
+            lines=diff_lines(revision_text(old), revision_text(new)),
+        )
+        return context
+
+
 class NoteDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     """Удаление заметки"""
     model = Note
@@ -149,6 +279,35 @@ class NoteDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
         return super().delete(request, *args, **kwargs)
 
 
+def comment_paginator(note_id, per_page):
+    """Курсорная пагинация комментариев заметки от старых к новым, без COUNT(*)"""
+    queryset = (
+        Comment.objects.filter(note_id=note_id)
+        .select_related('author')
+        .only('note_id', 'text', 'created_at', 'author__username')
+    )
+    return KeysetPaginator(queryset, per_page, ordering=('created_at', 'id'), count_timeout=0)
+
+
+def more_comments_url(note_id, page):
+    """Адрес следующей порции комментариев или None"""
+    if not page.has_next():
+        return None
+    return '{}?cursor={}'.format(reverse('note_comments', args=[note_id]), page.next_cursor)
+
+
+def note_comments(request, pk):
+    """Следующая порция комментариев (?cursor=...): HTML-фрагмент и адрес продолжения"""
+    if not Note.objects.filter(pk=pk).visible_to(request.user).exists():
+        raise Http404('Заметка не найдена')
+    paginator = comment_paginator(pk, getattr(settings, 'COMMENTS_PAGE_SIZE', 50))
+    page = paginator.page(request.GET.get('cursor'))
+    return JsonResponse({
+        'html': render_to_string('notes/includes/comments.html', {'comments': page}, request),
+        'next': more_comments_url(pk, page),
+    })
+
+
 @login_required
 def add_comment(request, pk):
     """Добавление комментария к заметке"""
@@ -183,7 +342,7 @@ def register(request):
     return render(request, 'registration/register.html', {'form': form})
 
 
-class MyNotesView(LoginRequiredMixin, ListView):
+class MyNotesView(LoginRequiredMixin, ConditionalGetMixin, FragmentCacheMixin, KeysetPaginationMixin, ListView):
     """Список заметок текущего пользователя"""
     model = Note
     template_name = 'notes/my_notes.html'
@@ -191,10 +350,10 @@ class MyNotesView(LoginRequiredMixin, ListView):
     paginate_by = 10
     
     def get_queryset(self):
-        return Note.objects.filter(author=self.request.user).select_related('category')
+        return Note.objects.filter(author=self.request.user).cards()
 
 
-class CategoryNotesView(ListView):
+class CategoryNotesView(ConditionalGetMixin, AnonymousPageCacheMixin, FragmentCacheMixin, KeysetPaginationMixin, ListView):
     """Список заметок по категории"""
     model = Note
     template_name = 'notes/category_notes.html'
@@ -203,18 +362,40 @@ class CategoryNotesView(ListView):
     
     def get_queryset(self):
         self.category = get_object_or_404(Category, pk=self.kwargs['pk'])
-        queryset = Note.objects.filter(category=self.category)
-        
-        if self.request.user.is_authenticated:
-            queryset = queryset.filter(
-                Q(author=self.request.user) | Q(is_public=True)
-            )
-        else:
-            queryset = queryset.filter(is_public=True)
-        
-        return queryset.select_related('author')
+        return Note.objects.filter(category=self.category).visible_to(self.request.user).cards()
+    
+    def get_keyset_streams(self, queryset):
+        streams = Note.objects.filter(category=self.category).visibility_streams(self.request.user)
+        return [stream.cards() for stream in streams]
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['category'] = self.category
-        return context
\ No newline at end of file
+        return context
+
+
+@login_required
+def export_notes(request):
+    """
+    Потоковая выгрузка заметок пользователя (?format=jsonl|markdown);
+    персонал может выгрузить все заметки (?scope=all).
+    """
+    export_format = request.GET.get('format', 'jsonl')
+    if export_format not in FORMATS:
+        raise Http404('Неизвестный формат')
+    everything = request.GET.get('scope') == 'all' and request.user.is_staff
+    queryset = export_queryset(None if everything else request.user)
+    filename = '{}-{}.{}'.format(
+        'wiki' if everything else request.user.username,
+        timezone.localdate().isoformat(),
+        EXTENSIONS[export_format],
+    )
+    response = StreamingHttpResponse(export_stream(export_format, queryset), content_type=CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@staff_member_required
+def query_report(request):
+    """Накопленная статистика SQL-запросов по маршрутам (для персонала)"""
+    return JsonResponse(get_report(), json_dumps_params={'ensure_ascii': False, 'indent': 2})
\ No newline at end of file
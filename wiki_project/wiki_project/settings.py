@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 Django settings for wiki_project project.
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,11 +45,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Стоит первым, чтобы учитывать запросы всех остальных слоев
+    'notes.instrumentation.QueryInstrumentationMiddleware',
+    # До сессий и аутентификации: их запросы тоже читают с реплик
+    'notes.routers.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # AuthenticationMiddleware с пользователем из кэша
+    'notes.sessions.CachedAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -77,13 +83,99 @@ WSGI_APPLICATION = 'wiki_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
+# Профиль выбирается переменной окружения WIKI_DB_PROFILE: sqlite или postgres
+
+DATABASE_PROFILES = {
+    'sqlite': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'NAME': os.environ.get('WIKI_SQLITE_PATH', str(BASE_DIR / 'db.sqlite3')),
+        # Соединение переиспользуется между запросами одного потока
+        'CONN_MAX_AGE': int(os.environ.get('WIKI_DB_CONN_MAX_AGE', 60)),
+    },
+    'postgres': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('WIKI_PG_NAME', 'wiki'),
+        'USER': os.environ.get('WIKI_PG_USER', 'wiki'),
+        'PASSWORD': os.environ.get('WIKI_PG_PASSWORD', ''),
+        'HOST': os.environ.get('WIKI_PG_HOST', '127.0.0.1'),
+        'PORT': os.environ.get('WIKI_PG_PORT', '5432'),
+        'CONN_MAX_AGE': int(os.environ.get('WIKI_DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'connect_timeout': 5,
+        },
+    },
 }
 
+# Пул соединений для PostgreSQL — PgBouncer в режиме transaction
+# (WIKI_PG_POOLER=pgbouncer, HOST/PORT указывают на PgBouncer).
+# Серверные курсоры в этом режиме не работают.
+if os.environ.get('WIKI_PG_POOLER') == 'pgbouncer':
+    DATABASE_PROFILES['postgres']['DISABLE_SERVER_SIDE_CURSORS'] = True
+
+DATABASES = {
+    'default': DATABASE_PROFILES[os.environ.get('WIKI_DB_PROFILE', 'sqlite')],
+}
+
+# Реплики для чтения: WIKI_DB_REPLICAS — пути к файлам SQLite (профиль sqlite)
+# или адреса серверов (профиль postgres) через запятую. Локально реплику
+# SQLite обновляет команда sync_replica.
+DATABASE_REPLICAS = []
+for number, location in enumerate(filter(None, os.environ.get('WIKI_DB_REPLICAS', '').split(',')), start=1):
+    replica = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+    replica['NAME' if replica['ENGINE'].endswith('sqlite3') else 'HOST'] = location.strip()
+    DATABASES[f'replica{number}'] = replica
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['notes.routers.PrimaryReplicaRouter']
+REPLICA_PIN_SECONDS = 10  # чтение из основной базы после изменений пользователя
+
+# PRAGMA, выполняемые при каждом подключении к SQLite (см. notes/signals.py)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',  # читатели не блокируют писателя
+    'synchronous': 'NORMAL',  # в режиме WAL надежно и без fsync на каждый коммит
+    'busy_timeout': 5000,  # миллисекунды ожидания блокировки
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -32000,  # в килобайтах
+    'temp_store': 'MEMORY',
+}
+
+
+# Cache
+# Бэкенд выбирается переменной окружения WIKI_CACHE_BACKEND: locmem, file или redis
+
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'wiki',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('WIKI_CACHE_DIR', str(BASE_DIR / '.cache')),
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('WIKI_REDIS_URL', 'redis://127.0.0.1:6379/1'),
+    },
+}
+
+CACHES = {
+    'default': CACHE_BACKENDS[os.environ.get('WIKI_CACHE_BACKEND', 'locmem')],
+}
+
+# Сессии в кэше с записью в базу; пользователь сессии тоже кэшируется
+SESSION_ENGINE = 'notes.sessions'
+USER_CACHE_TIMEOUT = 300  # секунды, 0 — читать пользователя из базы
+# Сообщения в cookie: их показ не читает и не пишет сессию
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
+PAGE_CACHE_TIMEOUT = 60  # страницы для анонимных пользователей, 0 — не кэшировать
+FRAGMENT_CACHE_TIMEOUT = 300  # фрагменты шаблонов
+
+# Условные GET-запросы: ETag/Last-Modified и ответ 304
+CONDITIONAL_MAX_AGE = 0  # секунды, которые браузер может не перепроверять страницу
+CONDITIONAL_ETAG_SALT = os.environ.get('WIKI_RELEASE', '')  # смена выкладки меняет все ETag
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -123,6 +215,27 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# Сборка статики (collectstatic или build_static, см. notes/assets.py):
+# хэш содержимого в именах файлов, очистка сторонних CSS, сжатые копии .gz/.br
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'notes.assets.PrecompressedManifestStaticFilesStorage'},
+}
+# Отдача собранной статики самим приложением при DEBUG = False; за
+# nginx (gzip_static/brotli_static) можно выключить
+SERVE_STATIC = not DEBUG
+STATIC_MAX_AGE = 60 * 60  # для файлов без хэша в имени, секунды
+STATIC_COMPRESS_MIN_SIZE = 256  # файлы меньше не сжимаются, байты
+# CSS, из которых удаляются правила для классов, не встречающихся в STATIC_PURGE_SOURCES
+STATIC_PURGE_FILES = ['vendor/bootstrap/*/css/*.css', 'vendor/fontawesome/*/css/*.css']
+STATIC_PURGE_SOURCES = [BASE_DIR / 'notes', BASE_DIR / 'static' / 'css']
+# Классы, которые добавляются скриптами Bootstrap и не встречаются в шаблонах
+STATIC_PURGE_SAFELIST = [
+    'show', 'showing', 'hiding', 'fade', 'collapse', 'collapsing', 'collapsed',
+    'active', 'disabled', 'dropdown-menu-end', 'modal-backdrop', 'modal-open',
+    'was-validated', 'is-invalid', 'is-valid', 'invalid-feedback',
+]
+
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
@@ -135,4 +248,67 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Login/Logout URLs
 LOGIN_REDIRECT_URL = 'home'
 LOGOUT_REDIRECT_URL = 'home'
-LOGIN_URL = 'login'
\ No newline at end of file
+LOGIN_URL = 'login'
+
+# Поисковый индекс: обновляется в фоновом потоке пачками
+SEARCH_INDEX_ASYNC = True
+SEARCH_INDEX_BATCH_SIZE = 100
+SEARCH_INDEX_INTERVAL = 1.0  # секунды
+
+# Счетчик просмотров: приращения буферизуются и сбрасываются пачкой
+VIEW_COUNTER_FLUSH_INTERVAL = 5.0  # секунды
+VIEW_COUNTER_FLUSH_THRESHOLD = 500  # заметок в буфере
+VIEW_COUNTER_DEDUP_TIMEOUT = 30 * 60  # повторные просмотры не считаются, 0 — считать все
+
+# Курсорная пагинация: время кэширования общего числа записей, 0 — не считать
+PAGINATION_COUNT_TIMEOUT = 60  # секунды
+
+# Комментарии на странице заметки: первая порция и догрузка кнопкой «Показать ещё»
+COMMENTS_FIRST_PAGE_SIZE = 20
+COMMENTS_PAGE_SIZE = 50
+
+# Админка: списки больших таблиц без точного COUNT(*)
+ADMIN_COUNT_LIMIT = 10000  # строк; больше — оценка по статистике, с фильтрами — нижняя граница
+ADMIN_INLINE_COMMENTS = 20  # последних комментариев на странице заметки
+
+# Инструментирование SQL: число и время запросов, повторы, время рендеринга
+QUERY_INSTRUMENTATION = DEBUG
+QUERY_BUDGET = 30  # запросов на страницу, сверх — предупреждение в журнале
+QUERY_BUDGETS = {
+    # Отдельные бюджеты маршрутов: {'note_detail': 10, ...}
+}
+QUERY_REPORT_TIMEOUT = 24 * 60 * 60  # время хранения статистики, секунды
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'notes': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
+# Асинхронные страницы чтения (главная, заметка, категория, мои заметки) —
+# для запуска под ASGI: WIKI_ASYNC_VIEWS=1 uvicorn wiki_project.asgi:application
+NOTES_ASYNC_VIEWS = os.environ.get('WIKI_ASYNC_VIEWS') == '1'
+
+# История заметок: полный снимок текста через каждые N ревизий, между
+# ними — сжатые разницы; восстановление ревизии — не больше N - 1 разниц
+REVISION_SNAPSHOT_INTERVAL = 20
+
+# Аналитика просмотров: журнал событий и сводки (команда rollup_views)
+VIEW_ROLLUP_LOOKBACK_HOURS = 2  # часы, пересчитываемые повторно ради опоздавших событий
+VIEW_EVENT_RETENTION_DAYS = 30
+HOURLY_VIEW_STAT_RETENTION_DAYS = 90
+TRENDING_DAYS = 7  # окно для популярных заметок
+TRENDING_SIZE = 5
+
+# Похожие заметки по общим тегам (команда rebuild_related, см. notes/related.py)
+RELATED_NOTES_METRIC = 'jaccard'  # или 'cosine'
+RELATED_NOTES_STORED = 10  # соседей в таблице на заметку, с запасом на скрытые
+RELATED_NOTES_COUNT = 5  # показывается на странице заметки
+RELATED_NOTES_MAX_TAG_NOTES = 2000  # более частые теги не учитываются
+RELATED_NOTES_CHUNK_SIZE = 2000  # строк матрицы за одно умножение
+RELATED_NOTES_ASYNC = True